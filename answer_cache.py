@@ -0,0 +1,126 @@
+import time, itertools, threading
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Cache of vector-path answers keyed by query meaning rather than query text.
+
+    An entry stores the query embedding, the ids of the chunks retrieved for it and the
+    generated answer. A new query reuses the answer when it retrieved the same chunks and
+    its embedding is within `threshold` cosine similarity of the cached query. Entries
+    expire after `ttl_seconds`, the least recently used ones are evicted beyond
+    `max_items`, and everything is dropped when the index bundle version changes.
+    """
+
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_items=1000):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.index_version = None
+        self.groups = {}
+        self.lru = OrderedDict()
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def chunk_key(chunk_ids):
+        return tuple(sorted(int(i) for i in chunk_ids))
+
+    @staticmethod
+    def unit(vector):
+        vector = np.asarray(vector, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def check_version(self, index_version):
+        """Drops every entry when the index bundle has been replaced."""
+        if index_version != self.index_version:
+            if self.lru:
+                self.stats["invalidations"] += 1
+            self.groups.clear()
+            self.lru.clear()
+            self.index_version = index_version
+
+    def lookup(self, query_vector, chunk_ids, index_version=None):
+        """
+        Returns a cached answer for a semantically equivalent query, or None.
+
+        Args:
+        - query_vector (np.ndarray): Embedding of the new query.
+        - chunk_ids (list): Ids of the chunks retrieved for the new query.
+        - index_version (str, optional): Version of the index the ids refer to.
+
+        Returns:
+        - str or None: Cached answer on a hit.
+        """
+        with self.lock:
+            self.check_version(index_version)
+            group = self.groups.get(self.chunk_key(chunk_ids), {})
+            query_vector = self.unit(query_vector)
+            now = time.time()
+            best_id, best_similarity = None, self.threshold
+            for entry_id, entry in list(group.items()):
+                if now - entry["created_at"] > self.ttl_seconds:
+                    self.remove(entry_id)
+                    self.stats["expired"] += 1
+                    continue
+                similarity = float(np.dot(entry["vector"], query_vector))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                self.stats["misses"] += 1
+                return None
+            self.lru.move_to_end(best_id)
+            self.stats["hits"] += 1
+            return group[best_id]["answer"]
+
+    def store(self, query_vector, chunk_ids, answer, index_version=None):
+        """
+        Caches the answer generated for a query.
+
+        Args:
+        - query_vector (np.ndarray): Embedding of the query.
+        - chunk_ids (list): Ids of the chunks the answer was generated from.
+        - answer (str): Generated answer.
+        - index_version (str, optional): Version of the index the ids refer to.
+        """
+        with self.lock:
+            self.check_version(index_version)
+            key = self.chunk_key(chunk_ids)
+            entry_id = next(self.ids)
+            self.groups.setdefault(key, {})[entry_id] = {
+                "vector": self.unit(query_vector),
+                "answer": answer,
+                "created_at": time.time(),
+            }
+            self.lru[entry_id] = key
+            while len(self.lru) > self.max_items:
+                self.remove(next(iter(self.lru)))
+                self.stats["evictions"] += 1
+
+    def remove(self, entry_id):
+        key = self.lru.pop(entry_id)
+        group = self.groups[key]
+        del group[entry_id]
+        if not group:
+            del self.groups[key]
+
+    def invalidate(self):
+        """Drops every cached answer, e.g. after the prompt or the model changed."""
+        with self.lock:
+            self.groups.clear()
+            self.lru.clear()
+            self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        """Returns hit/miss counters, the hit ratio and the number of cached answers."""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["items"] = len(self.lru)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,215 @@
+import asyncio, argparse, datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from config import config as config
+from settings import get_setting
+from history_cache import HistoryCache
+from tracing import span
+from write_behind import WriteBehindQueue
+
+
+class ChatStore:
+    """
+    Chat history split into one document per session and one document per message.
+
+    `sessions` holds `{session_id, emp_id, session_name, created_at, last_activity,
+    message_count}`, the last two maintained on every message write, and
+    `messages` holds `{session_id, emp_id, role, content, timestamp}`. A turn touches one
+    session document and inserts small message documents, so its cost does not grow with
+    the history of the employee. `history` keeps the last messages of active sessions in
+    memory for the chat-history prompts, checked against `message_count` so that turns
+    written by other workers are not missed, and every write goes through `writer`, which
+    either awaits it or buffers it for a background bulk write (`MONGODB` / `DURABILITY`).
+    """
+
+    def __init__(self, database):
+        self.sessions = database[get_setting("MONGODB", "SESSIONS_COLLECTION", "sessions")]
+        self.messages = database[get_setting("MONGODB", "MESSAGES_COLLECTION", "messages")]
+        self.history = HistoryCache(
+            max_messages=get_setting("HISTORY-CACHE", "MAX_MESSAGES", 20, int),
+            max_sessions=get_setting("HISTORY-CACHE", "MAX_SESSIONS", 10000, int),
+            max_bytes=get_setting("HISTORY-CACHE", "MAX_MB", 64, int) * 1024 * 1024
+        )
+        self.writer = WriteBehindQueue(
+            {"sessions": self.sessions, "messages": self.messages},
+            durability=get_setting("MONGODB", "DURABILITY", "ack"),
+            max_batch=get_setting("MONGODB", "WRITE_BATCH_SIZE", 200, int),
+            max_wait_ms=get_setting("MONGODB", "WRITE_MAX_WAIT_MS", 50, float)
+        )
+
+    async def ensure_indexes(self):
+        await self.sessions.create_indexes([
+            IndexModel([("session_id", ASCENDING)], unique=True),
+            IndexModel([("emp_id", ASCENDING), ("last_activity", DESCENDING), ("session_id", DESCENDING)]),
+        ])
+        await self.messages.create_indexes([
+            IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING)]),
+        ])
+
+    async def add_session(self, session):
+        """Creates a session document; `session` holds the fields listed above."""
+        if self.writer.durability == "write_behind":
+            self.writer.new_sessions[session["session_id"]] = session["emp_id"]
+        await self.writer.write("sessions", session["session_id"], InsertOne(session))
+
+    async def set_generated_name(self, session_id, provisional_name, session_name):
+        """Replaces the provisional name of a new session, unless the user renamed it meanwhile."""
+        await self.writer.write("sessions", session_id, UpdateOne(
+            {"session_id": session_id, "session_name": provisional_name},
+            {"$set": {"session_name": session_name}}
+        ))
+
+    async def touch_session(self, session_id, emp_id, timestamp, verified=False):
+        """
+        Records a new message in the session document of an employee.
+
+        Args:
+        - session_id (str): Session ID.
+        - emp_id (str): Employee ID that must own the session.
+        - timestamp (str): Time of the message.
+        - verified (bool, optional): The session was already checked in this turn, a
+          buffered write then needs no read. Defaults to False.
+
+        Returns:
+        - int or None: Message count of the session including the new message, or None if
+          the employee has no such session. In write-behind mode it is the stored count
+          plus the messages still buffered by this worker, and None for `verified` calls,
+          which read nothing.
+        """
+        query = {"session_id": session_id, "emp_id": emp_id}
+        update = {"$set": {"last_activity": timestamp}, "$inc": {"message_count": 1}}
+        if self.writer.durability != "write_behind":
+            with span("mongo.find_one_and_update", operation="touch_session"):
+                session = await self.sessions.find_one_and_update(
+                    query, update, projection={"_id": 0, "message_count": 1}, return_document=ReturnDocument.AFTER
+                )
+            return None if session is None else session.get("message_count", 0)
+        stored = None
+        if not verified:
+            if self.writer.new_sessions.get(session_id) == emp_id:
+                stored = 0
+            else:
+                with span("mongo.find_one", operation="check_session"):
+                    session = await self.sessions.find_one(query, {"_id": 0, "message_count": 1})
+                if session is None:
+                    return None
+                stored = session.get("message_count", 0)
+        await self.writer.write("sessions", session_id, UpdateOne(query, update))
+        return None if stored is None else stored + len(self.writer.pending_messages(session_id)) + 1
+
+    async def add_message(self, message):
+        """Stores a message document and appends it to the cached history of its session."""
+        message["_id"] = ObjectId()
+        await self.writer.write("messages", message["session_id"], InsertOne(message), message)
+        self.history.append(message["session_id"], history_entry(message))
+
+    def with_pending(self, session_id, messages):
+        """Appends the messages of a session that are still buffered to messages read from MongoDB."""
+        stored = {message["_id"] for message in messages}
+        messages = messages + [message for message in self.writer.pending_messages(session_id) if message["_id"] not in stored]
+        return [history_entry(message) for message in messages]
+
+    async def session_messages(self, session_id):
+        """Returns every message of a session, oldest first, including buffered ones."""
+        cursor = self.messages.find(
+            {"session_id": session_id},
+            {"_id": 1, "role": 1, "content": 1, "timestamp": 1}
+        ).sort("timestamp", 1)
+        return self.with_pending(session_id, [message async for message in cursor])
+
+    async def last_messages(self, session_id, n, message_count=None):
+        """
+        Returns the last n messages of a session, oldest first, from the history cache when
+        possible and otherwise with one indexed read that also fills the cache.
+
+        Args:
+        - session_id (str): Session ID.
+        - n (int): Number of messages.
+        - message_count (int, optional): Messages the session holds, from `touch_session`.
+          A cached buffer that counted a different number is reloaded; without it the
+          cache is trusted as is.
+        """
+        messages = self.history.get(session_id, n, message_count)
+        if messages is not None:
+            return messages
+        limit = max(n, self.history.max_messages)
+        with span("mongo.find", operation="load_history", limit=limit):
+            cursor = self.messages.find(
+                {"session_id": session_id},
+                {"_id": 1, "role": 1, "content": 1, "timestamp": 1}
+            ).sort("timestamp", -1).limit(limit)
+            messages = self.with_pending(session_id, [message async for message in cursor][::-1])[-limit:]
+        self.history.load(session_id, messages, message_count)
+        return messages[-n:]
+
+
+def history_entry(message):
+    """Message as returned to callers and kept in the history cache, without document IDs."""
+    return {"role": message["role"], "content": message["content"], "timestamp": message["timestamp"]}
+
+
+def now():
+    return datetime.datetime.now().isoformat()
+
+
+async def migrate(legacy_collection, store):
+    """
+    Copies the legacy layout (one `{emp_id, sessions: [{messages: [...]}]}` document per
+    employee) into the sessions and messages collections.
+
+    Sessions already present in the new layout are skipped, so the migration can be run
+    again after an interruption: messages are written before their session document and a
+    half-copied session is copied again from scratch.
+
+    Args:
+    - legacy_collection (MongoDB collection): Collection with the per-employee documents.
+    - store (ChatStore): Target store.
+
+    Returns:
+    - dict: Numbers of migrated and skipped sessions and of migrated messages.
+    """
+    await store.ensure_indexes()
+    counts = {"sessions": 0, "skipped": 0, "messages": 0}
+    async for employee in legacy_collection.find({}, {"emp_id": 1, "sessions": 1}):
+        emp_id = employee["emp_id"]
+        for session in employee.get("sessions") or []:
+            session_id = session["session_id"]
+            if await store.sessions.find_one({"session_id": session_id}, {"_id": 1}):
+                counts["skipped"] += 1
+                continue
+            messages = [
+                {
+                    "session_id": session_id,
+                    "emp_id": emp_id,
+                    "role": message["role"],
+                    "content": message["content"],
+                    "timestamp": message.get("timestamp") or "",
+                }
+                for message in session.get("messages") or []
+            ]
+            await store.messages.delete_many({"session_id": session_id})
+            if messages:
+                await store.messages.insert_many(messages, ordered=True)
+            timestamps = [message["timestamp"] for message in messages if message["timestamp"]]
+            await store.sessions.insert_one({
+                "session_id": session_id,
+                "emp_id": emp_id,
+                "session_name": session.get("session_name", ""),
+                "created_at": min(timestamps) if timestamps else now(),
+                "last_activity": max(timestamps) if timestamps else now(),
+                "message_count": len(messages),
+            })
+            counts["sessions"] += 1
+            counts["messages"] += len(messages)
+    return counts
+
+
+if __name__ == "__main__":
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Migrate chat history from the per-employee documents to the sessions and messages collections.")
+    parser.add_argument("--source", default=config["MONGODB"]["COLLECTION"], help="Legacy per-employee collection")
+    args = parser.parse_args()
+
+    database = AsyncIOMotorClient(config["MONGODB"]["CONNECTION_STRING"])[config["MONGODB"]["DATABASE"]]
+    print(asyncio.run(migrate(database[args.source], ChatStore(database))))
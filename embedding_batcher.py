@@ -0,0 +1,108 @@
+import time, asyncio
+import numpy as np
+from tracing import span
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding calls into batched embeddings API requests.
+
+    Callers await `embed(text)`; texts are collected until `max_batch_size` items are
+    waiting or `max_wait_ms` has passed since the first one, then sent as one request
+    and the vectors are handed back to the waiting callers.
+    """
+
+    def __init__(self, client, model, max_batch_size=64, max_wait_ms=5, max_concurrent_requests=4):
+        self.client = client
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.pending = []
+        self.flush_handle = None
+        self.in_flight = set()
+        self.stats = {
+            "requests": 0, "items": 0, "errors": 0, "max_batch_size": 0,
+            "queue_delay_ms_total": 0.0, "queue_delay_ms_max": 0.0,
+        }
+
+    async def embed(self, text):
+        """
+        Embeds one text as part of the next batch.
+
+        Args:
+        - text (str): Text to embed.
+
+        Returns:
+        - np.ndarray: float32 embedding vector.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future, time.perf_counter()))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait_ms / 1000, self.flush)
+        return await future
+
+    async def embed_many(self, texts):
+        """
+        Embeds many texts, e.g. for bulk ingestion; they are sent in batches of `max_batch_size`.
+
+        Args:
+        - texts (list): Texts to embed.
+
+        Returns:
+        - list: float32 embedding vectors in the order of `texts`.
+        """
+        return await asyncio.gather(*(self.embed(text) for text in texts))
+
+    def flush(self):
+        """Sends the waiting texts as one request."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending[:self.max_batch_size], self.pending[self.max_batch_size:]
+        task = asyncio.ensure_future(self.send(batch))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+        if self.pending:
+            self.flush()
+
+    async def send(self, batch):
+        """Calls the embeddings API for a batch and resolves the callers' futures."""
+        async with self.semaphore:
+            sent_at = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                delay_ms = (sent_at - enqueued_at) * 1000
+                self.stats["queue_delay_ms_total"] += delay_ms
+                self.stats["queue_delay_ms_max"] = max(self.stats["queue_delay_ms_max"], delay_ms)
+            self.stats["requests"] += 1
+            self.stats["items"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+
+            try:
+                with span("llm.embeddings", batch_size=len(batch)):
+                    response = await self.client.embeddings.create(
+                        input=[text for text, _, _ in batch],
+                        model=self.model
+                    )
+                for item in response.data:
+                    future = batch[item.index][1]
+                    if not future.done():
+                        future.set_result(np.array(item.embedding, dtype="float32"))
+            except Exception as e:
+                self.stats["errors"] += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def get_stats(self):
+        """Returns request and item counters with the average batch size and queueing delay."""
+        stats = dict(self.stats)
+        stats["avg_batch_size"] = stats["items"] / stats["requests"] if stats["requests"] else 0.0
+        stats["avg_queue_delay_ms"] = stats["queue_delay_ms_total"] / stats["items"] if stats["items"] else 0.0
+        stats["waiting"] = len(self.pending)
+        return stats
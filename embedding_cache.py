@@ -0,0 +1,167 @@
+import re, time, asyncio, sqlite3, hashlib, threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_text(text):
+    """Normalizes text for cache lookups: trims, collapses whitespace and lowercases."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache: an in-process LRU in front of a SQLite store on local disk.
+
+    The SQLite file runs in WAL mode, so every uvicorn worker on the host reads and
+    writes the same store and embeddings survive restarts. Both tiers are size bounded;
+    the disk tier evicts the least recently used rows.
+
+    `aget` and `aput` serve the event loop: only the memory tier is used on the loop and
+    every SQLite statement runs in a worker thread. `lock` guards the memory tier and the
+    counters, `disk_lock` the connection, so a slow disk write never holds up a memory hit.
+    The disk row count is kept in memory, counted on writes and recounted at each eviction
+    check, so reading the stats never touches SQLite.
+    """
+
+    def __init__(self, path, max_memory_items=2048, max_disk_items=200000):
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+        self.writes_since_eviction = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        self.disk_items = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(text, model):
+        """Builds the cache key of a text for a given embedding model."""
+        return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    async def aget(self, text, model):
+        """Returns the cached embedding of `text`, or None, reading the disk tier in a thread."""
+        key = self.make_key(text, model)
+        vector = self.lookup_memory(key)
+        if vector is None:
+            vector = await asyncio.to_thread(self.lookup_disk, key)
+        return vector
+
+    async def aput(self, text, model, vector):
+        """Stores the embedding of `text` in both tiers, writing the disk tier in a thread."""
+        key = self.make_key(text, model)
+        vector = np.asarray(vector, dtype="float32")
+        with self.lock:
+            self.remember(key, vector)
+        await asyncio.to_thread(self.store_disk, key, vector)
+
+    def lookup(self, key):
+        """
+        Looks a key up in memory first, then on disk. Blocks on SQLite; use `aget` on the
+        event loop.
+
+        Args:
+        - key (str): Cache key.
+
+        Returns:
+        - np.ndarray or None: Cached float32 vector, or None on a miss.
+        """
+        vector = self.lookup_memory(key)
+        return vector if vector is not None else self.lookup_disk(key)
+
+    def store(self, key, vector):
+        """
+        Stores a vector under a key in both tiers. Blocks on SQLite; use `aput` on the
+        event loop.
+
+        Args:
+        - key (str): Cache key.
+        - vector (np.ndarray): Embedding vector.
+        """
+        vector = np.asarray(vector, dtype="float32")
+        with self.lock:
+            self.remember(key, vector)
+        self.store_disk(key, vector)
+
+    def lookup_memory(self, key):
+        """Returns the vector of a key from the memory tier, or None."""
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+            return vector
+
+    def lookup_disk(self, key):
+        """Returns the vector of a key from the disk tier and promotes it to memory, or None."""
+        with self.disk_lock:
+            row = self.conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        with self.lock:
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            vector = np.frombuffer(row[0], dtype="float32")
+            self.remember(key, vector)
+            return vector
+
+    def store_disk(self, key, vector):
+        """Writes a vector to the disk tier."""
+        with self.disk_lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                (key, vector.tobytes(), time.time())
+            )
+            self.conn.commit()
+            with self.lock:
+                self.disk_items += 1
+            self.writes_since_eviction += 1
+            # counting rows on every write would cost more than the write itself
+            if self.writes_since_eviction >= 100:
+                self.evict_disk()
+
+    def remember(self, key, vector):
+        """Adds a vector to the memory tier, evicting the least recently used entries. Needs `lock`."""
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def evict_disk(self):
+        """Trims the disk tier back to `max_disk_items` rows, oldest first. Needs `disk_lock`."""
+        self.writes_since_eviction = 0
+        count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_disk_items
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+            self.conn.commit()
+        with self.lock:
+            self.disk_items = min(count, self.max_disk_items)
+            if excess > 0:
+                self.stats["disk_evictions"] += excess
+
+    def get_stats(self):
+        """Returns hit/miss counters, the hit ratio and the size of each tier (disk as counted in memory)."""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["memory_items"] = len(self.memory)
+            stats["disk_items"] = self.disk_items
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -1,55 +1,64 @@
 import io, os
 import numpy as np
 from io import BytesIO
-import requests, faiss
-from openai import AzureOpenAI
-from langchain_openai import AzureChatOpenAI
+import faiss, httpx
 from langchain.agents import AgentType
 from langchain_community.agent_toolkits.sql.base import create_sql_agent
-from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
 from sqlalchemy.orm import sessionmaker
 from langchain_core.prompts import ChatPromptTemplate
-from azure.storage.blob import BlobServiceClient
 from fastapi import HTTPException
 from config import config as config
-from schema import get_schema
-from prompt import get_prompt, get_suffix, get_followup_prompt
+from schema import get_schema, get_schema_version, get_status_values, init_schema
+from prompt import get_prompt, get_one_shot_prompt, get_suffix, get_followup_prompt
 from operator import itemgetter
-from database.__init__ import get_conn
-import asyncio
+from vector_store import search_index
+from embedding_cache import EmbeddingCache
+from sql_cache import SQLResultCache, CachedSQLDatabase, ALLOWED_VIEWS, run_query
+from plan_cache import PlanCache
+from sql_validation import validate_sql, check_emp_predicate, apply_limit, render_sql
+from query_templates import match_template, execute_template, format_rows
+from settings import get_setting
+from tracing import span, record_usage, TracingCallbackHandler
+from metrics import register_stats
+from resources import resources
+import asyncio, json, re, time, logging
 
 
-# Initialize Blob service client
-storage_string = config["BLOB-STORAGE-STRING"]["STRING"]
-blob_service_client = BlobServiceClient.from_connection_string(storage_string)
+logger = logging.getLogger(__name__)
 
-# Initialize Azure OpenAI clients
-api_key = config["AZURE"]["AZURE_API_KEY"]
-azure_endpoint = config["AZURE"]["AZURE_OPENAI_ENDPOINT"]
-azure_version = config["AZURE"]["API_VERSION"]
 deployment = config["AZURE"]["DEPLOYMENT2"]
 
-# Language Model for generating responses
-llm = AzureChatOpenAI(
-    api_key=api_key,
-    api_version=azure_version,
-    azure_endpoint=azure_endpoint,
-    azure_deployment=deployment
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Embeddings of repeated questions are served from memory or the shared on-disk store
+embedding_cache = EmbeddingCache(
+    get_setting("EMBEDDING-CACHE", "PATH", "embedding_cache.sqlite3"),
+    max_memory_items=get_setting("EMBEDDING-CACHE", "MAX_MEMORY_ITEMS", 2048, int),
+    max_disk_items=get_setting("EMBEDDING-CACHE", "MAX_DISK_ITEMS", 200000, int)
 )
 
-# OpenAI Embeddings Client
-client = AzureOpenAI(
-  api_key = api_key,  
-  api_version = azure_version,
-  azure_endpoint = azure_endpoint
+# Agent query results, so repeated questions do not hit the shared application database
+sql_result_cache = SQLResultCache(
+    default_ttl=get_setting("SQL-CACHE", "DEFAULT_TTL", 60, float),
+    view_ttls={
+        view: ttl for view in ALLOWED_VIEWS
+        if (ttl := get_setting("SQL-CACHE", f"TTL_{view.upper()}", cast=float)) is not None
+    },
+    max_entries=get_setting("SQL-CACHE", "MAX_ENTRIES", 2000, int),
+    max_rows=get_setting("SQL-CACHE", "MAX_ROWS", 500, int),
+    max_bytes=get_setting("SQL-CACHE", "MAX_BYTES", 256 * 1024, int)
 )
 
-# connect to the Database
-db_engine = get_conn()
+# SQL the agent wrote for earlier questions, reused for questions of the same shape
+plan_cache = PlanCache(max_items=get_setting("PLAN-CACHE", "MAX_ITEMS", 500, int))
+
+register_stats("embedding_cache", embedding_cache)
+register_stats("sql_result_cache", sql_result_cache)
+register_stats("plan_cache", plan_cache)
 
 
-def get_openai_embedding(text):
+async def get_openai_embedding(text):
     """
     Generates OpenAI embeddings for a given text.
 
@@ -63,147 +72,82 @@ def get_openai_embedding(text):
     - Exception: If there is an error generating the embedding.
     """
     try:
-        response = client.embeddings.create(
-            input=[text],
-            model="text-embedding-ada-002"
-        )
-        embedding = response.data[0].embedding
-        return np.array(embedding)
+        with span("embedding") as current:
+            cached_embedding = await embedding_cache.aget(text, EMBEDDING_MODEL)
+            current.set(cached=cached_embedding is not None)
+            if cached_embedding is not None:
+                return cached_embedding
+
+            embedding = await resources.embedding_batcher.embed(text)
+            await embedding_cache.aput(text, EMBEDDING_MODEL, embedding)
+            return embedding
     except Exception as e:
-        raise HTTPException(f"Error generating embedding: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating embedding: {e}")
 
 
 
-def load_npy_from_blob(blob_client):
+def search_chunk_ids(bundle, query_embedding, k=3):
     """
-    Loads data from a .npy file stored in Azure Blob Storage.
+    Searches an index bundle with an already computed query embedding.
 
     Args:
-    - blob_client: Azure Blob Client object for the .npy file.
+    - bundle (dict): Bundle returned by `load_index_bundle`.
+    - query_embedding (np.ndarray): Embedding of the query.
+    - k (int, optional): Number of nearest neighbors to retrieve. Defaults to 3.
 
     Returns:
-    - np.ndarray: Loaded numpy array from the .npy file.
-
-    Raises:
-    - Exception: If there is an error loading the .npy file from Blob Storage.
+    - list: Positions of the nearest chunks, closest first.
     """
-    # try:
-    #     blob_data = blob_client.download_blob().readall()
-    #     npy_data = np.load(io.BytesIO(blob_data), allow_pickle=True)
-    #     return npy_data
-    # except Exception as e:
-    #     raise HTTPException(f"Error loading npy file from blob: {e}")
-
-    try:
-        npy_data = np.load(blob_client, allow_pickle=True)
-        return npy_data
-    except Exception as e:
-        raise HTTPException(f"Error loading npy file: {e}")
-
-
-
-# def load_faiss_data_from_npy(container_name, connection_string):
-#     """
-#     Loads FAISS index data and embeddings from .npy files in Azure Blob Storage.
-
-#     Args:
-#     - container_name (str): Name of the Azure Blob Storage container.
-#     - connection_string (str): Connection string for Azure Blob Storage.
-
-#     Returns:
-#     - dict: Dictionary containing FAISS index, embeddings, and texts.
-
-#     Raises:
-#     - Exception: If there is an error loading FAISS data from .npy files.
-#     """
-#     try:
-#         blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-#         container_client = blob_service_client.get_container_client(container_name)
-
-#         embeddings_blob_client = container_client.get_blob_client(f"UserManual_embeddings.npy")
-#         texts_blob_client = container_client.get_blob_client(f"UserManual_texts.npy")
-#         index_blob_client = container_client.get_blob_client(f"UserManual_index.npy")
-
-#         embeddings = load_npy_from_blob(embeddings_blob_client)
-#         texts = load_npy_from_blob(texts_blob_client)
-#         index_data = load_npy_from_blob(index_blob_client)
+    _, ids = search_index(bundle, [query_embedding], k)
+    return [int(i) for i in ids[0] if i >= 0]
 
-#         # Create FAISS index and add index data
-#         index = faiss.IndexFlatL2(1536)
-#         index.add(index_data)
 
-#         return {"index": index, "embeddings": embeddings, "texts": texts}
-#     except Exception as e:
-#         raise HTTPException(f"Error loading FAISS data from blob: {e}")
-
-def load_faiss_data_from_npy(directory_path):
+async def generate_response(question, context):
     """
-    Loads FAISS index data and embeddings from .npy files stored locally.
+    Generates a response to a question using an Azure OpenAI model.
 
     Args:
-    - directory_path (str): Path to the directory containing the .npy files.
+    - question (str): Question to generate a response for.
+    - context (str): Context for the question.
 
     Returns:
-    - dict: Dictionary containing FAISS index, embeddings, and texts.
+    - str: Generated response.
 
     Raises:
-    - Exception: If there is an error loading FAISS data from .npy files.
+    - Exception: If there is an error generating the response.
     """
     try:
-        directory_path = "C:/Users/mmurtuza001/chatbot new pdf/"
-        embeddings_file_path = os.path.join(directory_path, "file_embeddings.npy")
-        texts_file_path = os.path.join(directory_path, "file_texts.npy")
-        index_file_path = os.path.join(directory_path, "file_index.npy")
-
-        embeddings = load_npy_from_blob(embeddings_file_path)
-        texts = load_npy_from_blob(texts_file_path)
-        index_data = load_npy_from_blob(index_file_path)
-
-        # Create FAISS index and add index data
-        index = faiss.IndexFlatL2(1536)
-        index.add(index_data)
-
-        return {"index": index, "embeddings": embeddings, "texts": texts}
-    except Exception as e:
-        raise HTTPException(f"Error loading FAISS data: {e}")
-
-
-
-def search_vector_store(index, texts, query, k=3):
-    """
-    Searches for vectors similar to a query in a FAISS index.
+        messages = [
+            {"role": "system", "content": "You are an AI Document Q&A Chatbot, you must answer the question given by the user with respect to the context given. If a user greets you, you must greet them back politely"},
+            {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
+        ]
 
-    Args:
-    - index: FAISS index object.
-    - texts (np.ndarray): Array of texts corresponding to the index.
-    - query (str): Query text to search for.
-    - k (int, optional): Number of nearest neighbors to retrieve. Defaults to 3.
+        with span("llm.generate_response") as current:
+            response = await resources.async_client.chat.completions.create(
+                model=deployment,
+                messages=messages,
+                temperature=0.5,
+                
+            )
+            record_usage(current, response.usage)
 
-    Returns:
-    - list: List of texts similar to the query.
+        answer = response.choices[0].message.content.strip()
 
-    Raises:
-    - Exception: If there is an error searching the vector store.
-    """
-    try:
-        query_embedding = get_openai_embedding(query)
-        D, I = index.search(np.array([query_embedding]), k)
-        results = [texts[i] for i in I[0]]
-        return results
+        return answer
     except Exception as e:
-        raise HTTPException(f"Error searching vector store: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating response: {e}")
 
 
-def generate_response(question, context):
+async def generate_response_stream(question, context):
     """
-    Generates a response to a question using an Azure OpenAI model.
+    Generates a response to a question using an Azure OpenAI model in streaming mode.
 
     Args:
     - question (str): Question to generate a response for.
     - context (str): Context for the question.
 
-    Returns:
-    - str: Generated response.
+    Yields:
+    - str: Response tokens as they are produced by the model.
 
     Raises:
     - Exception: If there is an error generating the response.
@@ -214,50 +158,22 @@ def generate_response(question, context):
             {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
         ]
 
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=messages,
-            temperature=0.5,
-            
-        )
-
-        answer = response.choices[0].message.content.strip()
-
-        return answer
+        with span("llm.generate_response_stream") as current:
+            response_stream = await resources.async_client.chat.completions.create(
+                model=deployment,
+                messages=messages,
+                temperature=0.5,
+                stream=True
+            )
+            chunks = 0
+            async for chunk in response_stream:
+                # Azure sends a leading chunk with only content filter results and no choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+            current.set(completion_chunks=chunks)
     except Exception as e:
-        raise HTTPException(f"Error generating response: {e}")
-
-# async def generate_response(question, context):
-#     """
-#     Generates a response to a question using an Azure OpenAI model in streaming mode.
-
-#     Args:
-#     - question (str): Question to generate a response for.
-#     - context (str): Context for the question.
-
-#     Yields:
-#     - str: Chunked response.
-
-#     Raises:
-#     - Exception: If there is an error generating the response.
-#     """
-#     try:
-#         messages = [
-#             {"role": "system", "content": "You are an AI Document Q&A Chatbot, you must answer the question given by the user with respect to the context given. If a user greets you, you must greet them back politely"},
-#             {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
-#         ]
-
-#         async with client.chat.completions.create(
-#             model=deployment,
-#             messages=messages,
-#             temperature=0.5,
-#             stream=True  # Enable streaming
-#         ) as response_stream:
-#             async for chunk in response_stream:
-#                 yield chunk.choices[0].delta.content  # Adjust based on actual response format
-
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=f"Error generating response: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating response: {e}")
 
 
 
@@ -268,7 +184,7 @@ def chunk_text(text, chunk_size=1):
         yield " ".join(words[i:i + chunk_size])
 
 
-def employee_ID(db_engine, token):
+async def employee_ID(db_engine, token):
     """
     Retrieves the employee ID using an LDAP service.
 
@@ -286,7 +202,8 @@ def employee_ID(db_engine, token):
         SessionLocal = sessionmaker(bind=db_engine)
         session = SessionLocal()
         url = f'https://ldapfastapi.salmonsmoke-83f22e73.uaenorth.azurecontainerapps.io/ldap/decode-token/?token={token}'
-        response = requests.post(url, verify=False)
+        async with httpx.AsyncClient(verify=False) as http_client:
+            response = await http_client.post(url)
         user_info = response.json()
         employeeid = user_info['employeeid']
         return employeeid
@@ -297,6 +214,16 @@ def employee_ID(db_engine, token):
 
 
 
+DISCOVERY_TOOLS = ("sql_db_list_tables", "sql_db_schema")
+
+
+class SnapshotSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """SQL toolkit without the table discovery tools, used when the schema snapshot is in the prompt."""
+
+    def get_tools(self):
+        return [tool for tool in super().get_tools() if tool.name not in DISCOVERY_TOOLS]
+
+
 def create_agent(db_engine, llm):
     """
     Creates an SQL agent for interacting with a SQL database.
@@ -313,10 +240,17 @@ def create_agent(db_engine, llm):
     """
     try:
        
-        db = SQLDatabase(db_engine, view_support=True, include_tables=["ProjectOrgView", "ProjectTasksStreamsView", "ProjectRequestsView", "ProjectApprovalsView"])
-        sql_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+        db = CachedSQLDatabase(db_engine, result_cache=sql_result_cache, view_support=True, include_tables=ALLOWED_VIEWS)
 
-        SQL_SUFFIX = get_suffix()
+        # With the schema snapshot in the prompt the agent goes straight to writing the query
+        use_snapshot = get_setting("SCHEMA", "ENABLED", True, bool)
+        if use_snapshot:
+            init_schema(db)
+            sql_toolkit = SnapshotSQLDatabaseToolkit(db=db, llm=llm)
+        else:
+            sql_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+
+        SQL_SUFFIX = get_suffix(schema_in_prompt=use_snapshot)
 
         
         sqldb_agent = create_sql_agent(
@@ -326,16 +260,16 @@ def create_agent(db_engine, llm):
             input_variables=["input", "agent_scratchpad", "history"],
             agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
             verbose=True,
-            agent_executor_kwargs={"handle_parsing_errors": True}
+            agent_executor_kwargs={"handle_parsing_errors": True, "return_intermediate_steps": True}
         )
 
         return sqldb_agent
     except Exception as e:
-        raise HTTPException(f"Failed to create agent: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create agent: {str(e)}")
 
 
 
-def get_response(sqldb_agent, user_query, emp_id):
+async def get_response(sqldb_agent, user_query, emp_id):
     """
     Retrieves a response from an SQL agent based on user input.
 
@@ -351,6 +285,14 @@ def get_response(sqldb_agent, user_query, emp_id):
     - RuntimeError: If there is an error retrieving the response.
     """
     try:
+        answer = await get_plan_response(user_query, emp_id)
+        if answer is not None:
+            return answer
+        if get_setting("SQL-AGENT", "MODE", "agent") == "one_shot":
+            answer = await get_one_shot_response(user_query, emp_id)
+            if answer is not None:
+                return answer
+
         schema = get_schema()
         prompt = get_prompt(schema, user_query, emp_id)
 
@@ -361,47 +303,289 @@ def get_response(sqldb_agent, user_query, emp_id):
             ]
         )
 
-        response = sqldb_agent.run(final_prompt.format(query=user_query))
-        return response
+        with span("sql.agent") as current:
+            handler = TracingCallbackHandler()
+            response = await sqldb_agent.ainvoke(
+                {"input": final_prompt.format(query=user_query), "history": ""}, config={"callbacks": [handler]}
+            )
+            current.set(
+                agent_iterations=handler.agent_iterations,
+                prompt_tokens=handler.prompt_tokens,
+                completion_tokens=handler.completion_tokens
+            )
+        log_agent_steps(len(response["intermediate_steps"]), "agent")
+        learn_plan(user_query, response["intermediate_steps"], emp_id)
+        return response["output"]
     except Exception as e:
-        raise HTTPException(f"Failed to get a response: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get a response: {str(e)}")
 
 
-# async def get_response(sqldb_agent, user_query, emp_id):
-#     """
-#     Retrieves a response from an SQL agent based on user input in streaming mode.
+async def get_template_response(user_query, emp_id):
+    """
+    Answers a canonical question (my tasks, streams, requests, approvals, projects) from a
+    parameterized query template instead of the SQL agent.
+
+    The matched template runs with bound parameters on a pooled connection and shares the
+    SQL result cache with the agent. The rows are phrased by a local formatter, or by one
+    short completion when TEMPLATES / PHRASING is "llm".
+
+    Args:
+    - user_query (str): Standalone user question.
+    - emp_id (str): Employee ID.
+
+    Returns:
+    - str or None: Answer, or None if no template matches and the agent has to answer.
+    """
+    if not get_setting("TEMPLATES", "ENABLED", True, bool):
+        return None
+    matched = match_template(user_query, emp_id)
+    if matched is None:
+        return None
+
+    started = time.perf_counter()
+    with span("sql.template", intent=matched["intent"]):
+        rows = await asyncio.to_thread(execute_template, resources.sql_engine, matched, sql_result_cache)
+        if rows and get_setting("TEMPLATES", "PHRASING", "local") == "llm":
+            answer = await phrase_rows(user_query, rows)
+        else:
+            answer = format_rows(matched["label"], rows)
+    logger.info(json.dumps({
+        "event": "sql_template",
+        "intent": matched["intent"],
+        "rows": len(rows),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }))
+    return answer
+
+
+async def phrase_rows(question, rows):
+    """Phrases query results as an answer to the question with a single completion."""
+    with span("llm.phrase_rows", rows=len(rows)) as current:
+        response = await resources.async_client.chat.completions.create(
+            model=deployment,
+            messages=[
+                {"role": "system", "content": "You answer the user's question about their own work items using only the given database results. Be brief and list every item."},
+                {"role": "user", "content": f"Results: {json.dumps(rows, default=str)}\n\nQuestion: {question}"}
+            ],
+            temperature=0,
+        )
+        record_usage(current, response.usage)
+    return response.choices[0].message.content.strip()
+
+
+SQL_FENCE_PATTERN = re.compile(r"```(?:sql)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+
+
+async def generate_sql(user_query, emp_id):
+    """
+    Writes the SQL query for a question with a single completion, given the schema snapshot.
+
+    Args:
+    - user_query (str): Standalone user question.
+    - emp_id (str): Employee ID.
+
+    Returns:
+    - str: SQL text produced by the model.
+    """
+    prompt = get_one_shot_prompt(get_schema(escaped=False), user_query, emp_id)
+    with span("llm.generate_sql") as current:
+        response = await resources.async_client.chat.completions.create(
+            model=deployment,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": user_query}
+            ],
+            temperature=0,
+        )
+        record_usage(current, response.usage)
+    sql = response.choices[0].message.content.strip()
+    fenced = SQL_FENCE_PATTERN.search(sql)
+    return fenced.group(1).strip() if fenced else sql
+
+
+async def get_one_shot_response(user_query, emp_id):
+    """
+    Answers a question with one SQL-writing completion instead of the ReAct agent.
+
+    The generated SQL must be a single read-only query over the allowed views that filters
+    on the employee ID; a LIMIT of SQL-AGENT / MAX_ROWS is enforced. The rows are phrased by
+    a second completion. Parse, validation and execution failures escalate to the agent.
+
+    Args:
+    - user_query (str): Standalone user question.
+    - emp_id (str): Employee ID.
 
-#     Args:
-#     - sqldb_agent: SQL database agent.
-#     - user_query (str): User query input.
-#     - emp_id (str): Employee ID.
+    Returns:
+    - str or None: Answer, or None if the question has to be escalated to the agent.
+    """
+    llm_calls = 1
+    sql = None
+    with span("sql.one_shot") as current:
+        try:
+            sql = await generate_sql(user_query, emp_id)
+            statement = validate_sql(sql)
+            check_emp_predicate(statement, emp_id)
+            statement = apply_limit(statement, get_setting("SQL-AGENT", "MAX_ROWS", 100, int))
+            rows = await asyncio.to_thread(run_query, resources.sql_engine, render_sql(statement), {}, emp_id, sql_result_cache)
+        except Exception as e:
+            current.set(escalated=True)
+            logger.info(json.dumps({"event": "sql_one_shot_escalated", "reason": str(e), "sql": sql}))
+            return None
+
+        remember_plan(user_query, sql, emp_id)
+        if rows:
+            llm_calls += 1
+            answer = await phrase_rows(user_query, rows)
+        else:
+            answer = "There is no such data available"
+    log_agent_steps(llm_calls, "one_shot")
+    return answer
+
+
+async def get_plan_response(user_query, emp_id):
+    """
+    Answers a question with SQL the agent wrote earlier for a question of the same shape.
+
+    Args:
+    - user_query (str): Standalone user question.
+    - emp_id (str): Employee ID.
+
+    Returns:
+    - str or None: Answer, or None on a plan cache miss or when the cached query failed.
+    """
+    if not get_setting("PLAN-CACHE", "ENABLED", True, bool):
+        return None
+    plan = plan_cache.lookup(user_query, emp_id)
+    if plan is None:
+        return None
+
+    started = time.perf_counter()
+    with span("sql.plan", slots=len(plan["params"]) - 1):
+        try:
+            rows = await asyncio.to_thread(run_query, resources.sql_engine, plan["sql"], plan["params"], emp_id, sql_result_cache)
+        except Exception as e:
+            logger.warning(f"Cached SQL plan failed, falling back to the agent: {e}")
+            plan_cache.discard(plan["key"])
+            return None
+        answer = await phrase_rows(user_query, rows) if rows else "There is no such data available"
+    logger.info(json.dumps({
+        "event": "sql_plan_cache",
+        "shape": plan["key"],
+        "rows": len(rows),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }))
+    return answer
+
+
+def learn_plan(user_query, steps, emp_id):
+    """Records the last query the agent ran successfully as the plan for the question's shape."""
+    for action, observation in reversed(steps):
+        if getattr(action, "tool", None) != "sql_db_query" or str(observation).startswith("Error"):
+            continue
+        sql = action.tool_input.get("query") if isinstance(action.tool_input, dict) else action.tool_input
+        remember_plan(user_query, sql, emp_id)
+        return
+
+
+def remember_plan(user_query, sql, emp_id):
+    """Stores a query that answered a question in the plan cache."""
+    if get_setting("PLAN-CACHE", "ENABLED", True, bool):
+        plan_cache.learn(user_query, sql, emp_id, constants=get_status_values())
+
+
+def log_agent_steps(steps, mode):
+    """Logs how many steps a SQL answer needed in the given mode, tagged with the schema snapshot in use."""
+    logger.info(json.dumps({"event": "sql_agent_steps", "mode": mode, "steps": steps, "schema_version": get_schema_version()}))
+
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+async def get_response_stream(sqldb_agent, user_query, emp_id):
+    """
+    Retrieves a response from an SQL agent based on user input in streaming mode.
+
+    Only the tokens of the agent's final answer are forwarded; thoughts, tool calls and
+    observations of the intermediate ReAct steps are swallowed.
+
+    Args:
+    - sqldb_agent: SQL database agent.
+    - user_query (str): User query input.
+    - emp_id (str): Employee ID.
 
-#     Yields:
-#     - str: Chunked response.
+    Yields:
+    - str: Tokens of the final answer as they are produced by the model.
 
-#     Raises:
-#     - RuntimeError: If there is an error retrieving the response.
-#     """
-#     try:
-#         schema = get_schema()
-#         prompt = get_prompt(schema, user_query, emp_id)
+    Raises:
+    - RuntimeError: If there is an error retrieving the response.
+    """
+    try:
+        answer = await get_plan_response(user_query, emp_id)
+        if answer is None and get_setting("SQL-AGENT", "MODE", "agent") == "one_shot":
+            answer = await get_one_shot_response(user_query, emp_id)
+        if answer is not None:
+            yield answer
+            return
 
-#         final_prompt = ChatPromptTemplate.from_messages(
-#             [
-#                 ("system", prompt),
-#                 ("user", "{query}\n ai: ")
-#             ]
-#         )
+        schema = get_schema()
+        prompt = get_prompt(schema, user_query, emp_id)
 
-#         async for chunk in sqldb_agent.run(final_prompt.format(query=user_query), stream=True):
-#             yield chunk  # Adjust based on actual response format
+        final_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", prompt),
+                ("user", "{query}\n ai: ")
+            ]
+        )
 
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=f"Failed to get a response: {e}")
+        llm_output = ""
+        answer_started = False
+        answer_streamed = False
+        agent_steps = 0
+        handler = TracingCallbackHandler()
+        with span("sql.agent", streaming=True) as current:
+            async for event in sqldb_agent.astream_events(
+                {"input": final_prompt.format(query=user_query), "history": ""}, config={"callbacks": [handler]}, version="v2"
+            ):
+                kind = event["event"]
+                if kind == "on_tool_start":
+                    agent_steps += 1
+                elif kind == "on_chat_model_start":
+                    # every ReAct iteration is a new completion, the marker has to be found again
+                    llm_output = ""
+                    answer_started = False
+                elif kind == "on_chat_model_stream":
+                    token = event["data"]["chunk"].content
+                    if answer_started:
+                        if not answer_streamed:
+                            token = token.lstrip()
+                        if token:
+                            answer_streamed = True
+                            yield token
+                        continue
+                    llm_output += token
+                    if FINAL_ANSWER_MARKER in llm_output:
+                        answer_started = True
+                        answer = llm_output.split(FINAL_ANSWER_MARKER, 1)[1].lstrip()
+                        if answer:
+                            answer_streamed = True
+                            yield answer
+                elif kind == "on_chain_end" and not event["parent_ids"]:
+                    current.set(
+                        agent_iterations=handler.agent_iterations,
+                        prompt_tokens=handler.prompt_tokens,
+                        completion_tokens=handler.completion_tokens
+                    )
+                    log_agent_steps(agent_steps, "agent")
+                    learn_plan(user_query, event["data"]["output"].get("intermediate_steps", []), emp_id)
+                    if not answer_streamed:
+                        # the agent finished without a streamed final answer (e.g. parsing error handling)
+                        yield event["data"]["output"]["output"]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get a response: {e}")
 
 
 
-def generate_session_name(query: str) -> str:
+async def generate_session_name(query: str) -> str:
     """
     Generates a session name based on a query using an Azure OpenAI model.
 
@@ -419,15 +603,17 @@ def generate_session_name(query: str) -> str:
                 {"role": "system", "content": "You are a good title creator for a chatbot session. Create a small, short and crisp one line (with three words maximum) title in the language of the {query}."},
                 {"role": "user", "content": query}
             ]
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=session_name_creation,
-            temperature=0,
-            max_tokens=10
-        )
+        with span("llm.generate_session_name") as current:
+            response = await resources.async_client.chat.completions.create(
+                model=deployment,
+                messages=session_name_creation,
+                temperature=0,
+                max_tokens=10
+            )
+            record_usage(current, response.usage)
         return response.choices[0].message.content.strip('"')
     except Exception as e:
-        raise HTTPException(f"Error generating session name: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating session name: {e}")
     
 
 
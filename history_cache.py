@@ -0,0 +1,116 @@
+from collections import OrderedDict, deque
+
+
+# Rough per-message overhead of the dict, the role and the timestamp, added to the content length
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def message_size(message):
+    return len(message["content"]) + MESSAGE_OVERHEAD_BYTES
+
+
+class HistoryCache:
+    """
+    LRU cache of the last messages of active sessions, one ring buffer per session.
+
+    A buffer always holds the last `max_messages` messages of its session (fewer when
+    the session is shorter): it is filled from MongoDB on a miss and appended to
+    whenever a message of the session is written, so a steady conversation reads no
+    history from MongoDB. Idle sessions are evicted once `max_sessions` or the
+    approximate `max_bytes` of message content is exceeded.
+
+    Every buffer also stores the session's message count as this process knows it. The
+    cache is per worker, so a turn served by another worker leaves the buffer behind;
+    readers pass the `message_count` of the session document and a buffer whose count
+    differs is treated as a miss and reloaded.
+
+    Only touched from the event loop, so no lock is needed.
+    """
+
+    def __init__(self, max_messages=20, max_sessions=10000, max_bytes=64 * 1024 * 1024):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.buffers = OrderedDict() # session_id -> deque of messages, oldest first
+        self.counts = {} # session_id -> messages in the session, None when unknown
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+    def get(self, session_id, n, message_count=None):
+        """
+        Returns the last n messages of a cached session, oldest first.
+
+        Args:
+        - session_id (str): Session ID.
+        - n (int): Number of messages.
+        - message_count (int, optional): Messages stored for the session; a buffer that
+          counted a different number is stale and dropped.
+
+        Returns:
+        - list or None: Messages, or None if the session is not cached, is stale or `n`
+          exceeds what a buffer can hold.
+        """
+        buffer = self.buffers.get(session_id)
+        if buffer is not None and message_count is not None and self.counts.get(session_id) != message_count:
+            self.stats["stale"] += 1
+            self.discard(session_id)
+            buffer = None
+        if buffer is None or n > self.max_messages:
+            self.stats["misses"] += 1
+            return None
+        self.buffers.move_to_end(session_id)
+        self.stats["hits"] += 1
+        return list(buffer)[-n:]
+
+    def load(self, session_id, messages, message_count=None):
+        """
+        Caches a session from its last `max_messages` messages as read from MongoDB, oldest
+        first, with the session's total message count when it is known.
+        """
+        self.discard(session_id)
+        self.buffers[session_id] = buffer = deque(maxlen=self.max_messages)
+        for message in messages[-self.max_messages:]:
+            buffer.append(message)
+            self.bytes += message_size(message)
+        self.counts[session_id] = message_count
+        self.evict()
+
+    def start(self, session_id):
+        """Caches a session that was just created and has no messages yet."""
+        self.load(session_id, [], 0)
+
+    def append(self, session_id, message):
+        """Adds a newly written message to the buffer of its session, if the session is cached."""
+        buffer = self.buffers.get(session_id)
+        if buffer is None:
+            return
+        if len(buffer) == buffer.maxlen:
+            self.bytes -= message_size(buffer[0])
+        buffer.append(message)
+        self.bytes += message_size(message)
+        if self.counts.get(session_id) is not None:
+            self.counts[session_id] += 1
+        self.buffers.move_to_end(session_id)
+        self.evict()
+
+    def discard(self, session_id):
+        buffer = self.buffers.pop(session_id, None)
+        self.counts.pop(session_id, None)
+        if buffer is not None:
+            self.bytes -= sum(message_size(message) for message in buffer)
+
+    def evict(self):
+        # the most recently used session stays even if it alone exceeds the byte budget
+        while len(self.buffers) > 1 and (len(self.buffers) > self.max_sessions or self.bytes > self.max_bytes):
+            session_id = next(iter(self.buffers))
+            self.discard(session_id)
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        """Returns hit/miss counters, the hit ratio, the number of cached sessions and their size."""
+        stats = dict(self.stats)
+        stats["sessions"] = len(self.buffers)
+        stats["bytes"] = self.bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
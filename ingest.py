@@ -0,0 +1,195 @@
+import os, time, hashlib, argparse, asyncio
+import numpy as np
+from pypdf import PdfReader
+from openai import AsyncAzureOpenAI
+from config import config as config
+from settings import get_setting
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from vector_store import write_bundle, read_manifest, read_metadata, current_version, INDEX_TYPES, METRICS
+
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+SUPPORTED_EXTENSIONS = (".pdf", ".md", ".markdown", ".txt")
+CHUNK_STORE_FILE = "chunk_embeddings.sqlite3"
+
+
+def iter_files(paths):
+    """Yields the supported document files under the given files and directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in sorted(os.walk(path)):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(directory, filename)
+        elif path.lower().endswith(SUPPORTED_EXTENSIONS):
+            yield path
+
+
+def read_documents(paths):
+    """
+    Streams the text of the documents one page (PDF) or file (Markdown/text) at a time.
+
+    Args:
+    - paths (list): Files or directories to ingest.
+
+    Yields:
+    - tuple: Source path, page number (None for non-PDF files) and text.
+    """
+    for file_path in iter_files(paths):
+        if file_path.lower().endswith(".pdf"):
+            for page_number, page in enumerate(PdfReader(file_path).pages, start=1):
+                yield file_path, page_number, page.extract_text() or ""
+        else:
+            with open(file_path, encoding="utf-8") as f:
+                yield file_path, None, f.read()
+
+
+def split_into_chunks(text, chunk_size=1000, overlap=200):
+    """
+    Splits text into overlapping character windows, cutting at whitespace where possible.
+
+    Args:
+    - text (str): Text to split.
+    - chunk_size (int, optional): Maximum chunk length in characters. Defaults to 1000.
+    - overlap (int, optional): Characters shared by consecutive chunks. Defaults to 200.
+
+    Yields:
+    - str: Non-empty chunks.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("overlap must be smaller than chunk_size")
+    text = " ".join(text.split())
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + overlap + 1, end)
+            end = cut if cut > 0 else end
+        chunk = text[start:end].strip()
+        if chunk:
+            yield chunk
+        if end == len(text):
+            break
+        start = max(end - overlap, start + 1)
+
+
+def chunk_hash(text):
+    """Content hash identifying a chunk across ingestion runs."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def bundle_is_current(root, hashes, index_type, metric, search_params=None, **index_params):
+    """
+    Whether the current bundle already holds these chunks, in this order, indexed with the
+    requested index type, metric, search parameters and explicit build parameters.
+    """
+    try:
+        previous_hashes = [item["hash"] for item in read_metadata(root)]
+        manifest = read_manifest(root)
+    except (FileNotFoundError, KeyError):
+        return False
+    return (
+        previous_hashes == hashes
+        and manifest["index_type"] == index_type
+        and manifest["metric"] == metric
+        and manifest["search_params"] == (search_params or {})
+        and all(manifest["build_params"].get(key) == value for key, value in index_params.items())
+    )
+
+
+async def ingest(paths, root, chunk_size=1000, overlap=200, index_type="flat", metric="l2", search_params=None, **index_params):
+    """
+    Chunks and embeds documents and publishes them as a new index bundle.
+
+    Chunk embeddings are stored by content hash next to the bundle, so unchanged chunks
+    are never embedded again; only new or edited text reaches the embeddings API. Nothing
+    is published when neither the chunks nor the index configuration changed.
+
+    Args:
+    - paths (list): Files or directories to ingest.
+    - root (str): Bundle root directory.
+    - chunk_size (int, optional): Maximum chunk length in characters. Defaults to 1000.
+    - overlap (int, optional): Characters shared by consecutive chunks. Defaults to 200.
+    - index_type (str, optional): Index type of the bundle. Defaults to "flat".
+    - metric (str, optional): Metric of the bundle. Defaults to "l2".
+    - search_params (dict, optional): Default `nprobe` / `ef_search` for the bundle.
+    - **index_params: Extra build parameters passed to `build_index`.
+
+    Returns:
+    - dict: Ingestion report with the published version and chunk counts.
+    """
+    started = time.perf_counter()
+    os.makedirs(root, exist_ok=True)
+    chunk_store = EmbeddingCache(os.path.join(root, CHUNK_STORE_FILE), max_memory_items=0, max_disk_items=10 ** 9)
+    client = AsyncAzureOpenAI(
+        api_key=config["AZURE"]["AZURE_API_KEY"],
+        api_version=config["AZURE"]["API_VERSION"],
+        azure_endpoint=config["AZURE"]["AZURE_OPENAI_ENDPOINT"]
+    )
+    batcher = EmbeddingBatcher(
+        client,
+        EMBEDDING_MODEL,
+        max_batch_size=get_setting("EMBEDDING-BATCHER", "INGEST_BATCH_SIZE", 256, int),
+        max_wait_ms=50,
+        max_concurrent_requests=get_setting("EMBEDDING-BATCHER", "INGEST_CONCURRENT_REQUESTS", 8, int)
+    )
+
+    texts, metadata, missing = [], [], {}
+    for source, page, page_text in read_documents(paths):
+        for position, chunk in enumerate(split_into_chunks(page_text, chunk_size, overlap)):
+            digest = chunk_hash(chunk)
+            texts.append(chunk)
+            metadata.append({"source": source, "page": page, "chunk": position, "hash": digest})
+            if digest not in missing and chunk_store.lookup(f"{EMBEDDING_MODEL}:{digest}") is None:
+                missing[digest] = chunk
+    if not texts:
+        raise ValueError("No text found in the given documents")
+
+    report = {"chunks": len(texts), "embedded": len(missing), "reused": len(texts) - len(missing)}
+    hashes = [item["hash"] for item in metadata]
+    if bundle_is_current(root, hashes, index_type, metric, search_params, **index_params):
+        report.update(version=current_version(root), published=False, seconds=time.perf_counter() - started)
+        return report
+
+    vectors = await batcher.embed_many(list(missing.values()))
+    for digest, vector in zip(missing, vectors):
+        chunk_store.store(f"{EMBEDDING_MODEL}:{digest}", vector)
+
+    all_vectors = np.stack([chunk_store.lookup(f"{EMBEDDING_MODEL}:{item['hash']}") for item in metadata])
+    version = write_bundle(
+        root, all_vectors, texts, metadata,
+        index_type=index_type, metric=metric, search_params=search_params, **index_params
+    )
+    report.update(version=version, published=True, seconds=time.perf_counter() - started, batching=batcher.get_stats())
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk, embed and index documents into the FAISS index bundle.")
+    parser.add_argument("paths", nargs="+", help="PDF, Markdown or text files, or directories containing them")
+    parser.add_argument("--root", default=get_setting("VECTOR-STORE", "BUNDLE_PATH", "vector_store_bundle"), help="Bundle root directory")
+    parser.add_argument("--chunk-size", type=int, default=get_setting("INGEST", "CHUNK_SIZE", 1000, int))
+    parser.add_argument("--overlap", type=int, default=get_setting("INGEST", "CHUNK_OVERLAP", 200, int))
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=get_setting("VECTOR-STORE", "INDEX_TYPE", "flat"))
+    parser.add_argument("--metric", choices=tuple(METRICS), default=get_setting("VECTOR-STORE", "METRIC", "l2"))
+    parser.add_argument("--nlist", type=int, help="IVF lists (default: picked from the number of chunks)")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantizers, must divide the dimension (default 16)")
+    parser.add_argument("--pq-nbits", type=int, help="Bits per PQ code (default 8)")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW neighbours per node (default 32)")
+    parser.add_argument("--ef-construction", type=int, help="HNSW build-time search depth (default 200)")
+    parser.add_argument("--nprobe", type=int, help="Default IVF lists visited per query")
+    parser.add_argument("--ef-search", type=int, help="Default HNSW search depth")
+    args = parser.parse_args()
+
+    search_params = {key: value for key, value in (("nprobe", args.nprobe), ("ef_search", args.ef_search)) if value}
+    # only the build parameters given on the command line are passed, so the others keep the
+    # build_index defaults and do not force a rebuild of an otherwise current bundle
+    index_params = {
+        key: getattr(args, key) for key in ("nlist", "pq_m", "pq_nbits", "hnsw_m", "ef_construction")
+        if getattr(args, key) is not None
+    }
+    print(asyncio.run(ingest(
+        args.paths, args.root, args.chunk_size, args.overlap,
+        index_type=args.index_type, metric=args.metric, search_params=search_params, **index_params
+    )))
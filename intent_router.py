@@ -0,0 +1,76 @@
+import re, json, logging
+
+
+logger = logging.getLogger("intent_router")
+
+VECTOR_TOOL = "handle_vector_query"
+SQL_TOOL = "handle_sql_query"
+
+# (pattern, tool, weight). Seeded from the tool descriptions and the get_prompt examples:
+# navigation / how-to / greetings go to the user manual, questions about the user's own
+# tasks, streams, requests, approvals, projects and organizations go to the database.
+RULES = [
+    (r"^\s*(hi|hello|hey|salam|good (morning|afternoon|evening)|thanks?|thank you)\b", VECTOR_TOOL, 3),
+    (r"\b(how (do|can|should|would) (i|we|you)|how to|steps to|guide me|walk me through)\b", VECTOR_TOOL, 3),
+    (r"\b(where (is|are|can|do)|navigate|find the|page|button|menu|click|screen|website|portal|dashboard)\b", VECTOR_TOOL, 2),
+    (r"\b(create|add|edit|delete|upload|assign|set up|configure|log ?in|sign ?in)\b", VECTOR_TOOL, 1),
+    (r"\b(do i have|have i got|assigned to me|for me|i('m| am) assigned|my|mine|i own|i created)\b", SQL_TOOL, 2),
+    (r"\b(tasks?|streams?|approvals?|requests?|projects?|organi[sz]ations?|orgs?|ministry)\b", SQL_TOOL, 1),
+    (r"\b(what|which|list|show|how many|count|status|deadline|due|pending|overdue|completed?|active)\b", SQL_TOOL, 1),
+]
+COMPILED_RULES = [(re.compile(pattern, re.IGNORECASE), tool, weight) for pattern, tool, weight in RULES]
+
+
+def score_query(query):
+    """
+    Scores a standalone question against the routing rules.
+
+    Args:
+    - query (str): Reformulated user question.
+
+    Returns:
+    - dict: Total rule weight per tool name.
+    """
+    scores = {VECTOR_TOOL: 0, SQL_TOOL: 0}
+    for pattern, tool, weight in COMPILED_RULES:
+        if pattern.search(query):
+            scores[tool] += weight
+    return scores
+
+
+def route_locally(query, confidence_threshold=0.75, min_score=2):
+    """
+    Picks a tool without an LLM call when the rules clearly favour one.
+
+    Confidence is the winning tool's share of the total rule weight; the decision is only
+    returned when that share reaches `confidence_threshold` and the winner scored at least
+    `min_score`.
+
+    Args:
+    - query (str): Reformulated user question.
+    - confidence_threshold (float, optional): Minimum share of the total weight. Defaults to 0.75.
+    - min_score (int, optional): Minimum weight of the winning tool. Defaults to 2.
+
+    Returns:
+    - tuple: Chosen tool name (None when unsure), confidence and the per-tool scores.
+    """
+    scores = score_query(query)
+    tool = max(scores, key=scores.get)
+    total = sum(scores.values())
+    confidence = scores[tool] / total if total else 0.0
+    if scores[tool] < min_score or confidence < confidence_threshold:
+        return None, confidence, scores
+    return tool, confidence, scores
+
+
+def log_decision(query, router, tool, confidence, scores, local_guess=None):
+    """Logs one routing decision as JSON so routing accuracy can be measured offline."""
+    logger.info(json.dumps({
+        "event": "routing_decision",
+        "router": router,
+        "tool": tool,
+        "local_guess": local_guess,
+        "confidence": round(confidence, 3),
+        "scores": scores,
+        "query": query,
+    }))
@@ -1,11 +1,24 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 # from endpoints.new_api import router as chatbot_router
 from route import router as chatbot_router
+from tracing import RequestIdMiddleware
+from resources import open_resources, close_resources
+from metrics import MetricsMiddleware, metrics_endpoint, mark_worker_dead
 # from new import router as chatbot_router
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # one SQL pool, Mongo client, OpenAI HTTP pool and SQL agent per worker
+    await open_resources()
+    yield
+    await close_resources()
+    mark_worker_dead()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     'https://day-front.graywave-c8c0d7b3.uaenorth.azurecontainerapps.io',
@@ -20,6 +33,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# request id and root span of every request, the id flows through the whole call chain
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 
 
 app.include_router(chatbot_router)
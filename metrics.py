@@ -0,0 +1,184 @@
+import os, time, asyncio
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from pymongo import monitoring
+from starlette.responses import Response
+from tracing import span_listeners
+
+
+# With several uvicorn workers every worker writes its samples to files in this directory
+# and /metrics aggregates them; it must be set before prometheus_client is imported
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# LLM calls and agent runs take seconds, the default buckets stop at 10s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+REQUESTS = Counter("chatbot_http_requests_total", "HTTP requests", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram("chatbot_http_request_duration_seconds", "HTTP request latency, including streamed bodies", ["method", "route"], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge("chatbot_http_requests_in_flight", "HTTP requests being served, including open streams", multiprocess_mode="livesum")
+STAGE_LATENCY = Histogram("chatbot_stage_duration_seconds", "Latency of each traced stage (LLM and embedding calls, tools, SQL, Mongo)", ["stage"], buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("chatbot_stage_errors_total", "Traced stages that raised", ["stage"])
+TOOL_CALLS = Counter("chatbot_tool_calls_total", "Questions answered per tool", ["tool"])
+MONGO_CONNECTIONS = Gauge("chatbot_mongo_connections", "Open MongoDB pool connections", multiprocess_mode="livesum")
+MONGO_CHECKED_OUT = Gauge("chatbot_mongo_connections_checked_out", "MongoDB pool connections in use", multiprocess_mode="livesum")
+MONGO_CHECKOUT_FAILURES = Counter("chatbot_mongo_checkout_failures_total", "Failed MongoDB connection checkouts", ["reason"])
+
+stat_sources = {} # component name -> object with get_stats()
+sql_engines = {} # pool name -> SQLAlchemy engine
+
+
+def observe_span(name, duration, status, attributes):
+    """Span listener feeding the per-stage latency histogram; request root spans are left to the middleware."""
+    if attributes.get("kind") == "server":
+        return
+    STAGE_LATENCY.labels(name).observe(duration)
+    if status != "OK":
+        STAGE_ERRORS.labels(name).inc()
+
+
+span_listeners.append(observe_span)
+
+
+def register_stats(name, source):
+    """Exposes the numeric `get_stats()` values of a cache or batcher at scrape time."""
+    stat_sources[name] = source
+
+
+def register_sql_engine(name, engine):
+    """Exposes the pool utilization of a SQLAlchemy engine at scrape time."""
+    sql_engines[name] = engine
+
+
+class ScrapeTimeCollector:
+    """
+    Reads cache statistics and SQL pool state only when /metrics is scraped.
+
+    These values live in the memory of one worker and cannot be merged from the
+    multiprocess files; in multiprocess mode they are labelled with the `worker` (PID)
+    that answered the scrape.
+    """
+
+    def __init__(self, worker=None):
+        self.worker = worker
+
+    def family(self, name, documentation, labels):
+        extra = ["worker"] if self.worker else []
+        return GaugeMetricFamily(name, documentation, labels=labels + extra)
+
+    def values(self, labels):
+        return labels + [self.worker] if self.worker else labels
+
+    def collect(self):
+        hit_ratio = self.family("chatbot_cache_hit_ratio", "Hit ratio per cache since startup", ["cache"])
+        stats = self.family("chatbot_component_stats", "Counters and sizes reported by caches and batchers", ["component", "stat"])
+        for name, source in list(stat_sources.items()):
+            for stat, value in source.get_stats().items():
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                if stat == "hit_ratio":
+                    hit_ratio.add_metric(self.values([name]), value)
+                else:
+                    stats.add_metric(self.values([name, stat]), value)
+        yield hit_ratio
+        yield stats
+
+        pool = self.family("chatbot_sql_pool_connections", "SQLAlchemy pool connections by state", ["pool", "state"])
+        for name, engine in list(sql_engines.items()):
+            engine_pool = engine.pool
+            for state in ("size", "checkedin", "checkedout", "overflow"):
+                if hasattr(engine_pool, state):
+                    pool.add_metric(self.values([name, state]), getattr(engine_pool, state)())
+        yield pool
+
+
+if not MULTIPROC_DIR:
+    REGISTRY.register(ScrapeTimeCollector())
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections of the MongoDB driver pool."""
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def connection_created(self, event):
+        MONGO_CONNECTIONS.inc()
+
+    def connection_closed(self, event):
+        MONGO_CONNECTIONS.dec()
+
+    def connection_checked_out(self, event):
+        MONGO_CHECKED_OUT.inc()
+
+    def connection_checked_in(self, event):
+        MONGO_CHECKED_OUT.dec()
+
+    def connection_check_out_failed(self, event):
+        MONGO_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request counts, latency and in-flight requests per route.
+
+    Routes are labelled with their path template (e.g. `/session/{session_id}`) so the
+    label set stays bounded; unmatched paths share the `unmatched` label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            REQUESTS.labels(scope["method"], route, str(status["code"])).inc()
+            REQUEST_LATENCY.labels(scope["method"], route).observe(time.perf_counter() - started)
+
+
+def scrape_registry():
+    """
+    Returns the registry to serve: the default one for a single worker, or in multiprocess
+    mode a fresh registry that merges the sample files of every worker.
+    """
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(ScrapeTimeCollector(worker=str(os.getpid())))
+    return registry
+
+
+def mark_worker_dead():
+    """Drops the live gauges of this worker from the multiprocess files when it shuts down."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+async def metrics_endpoint(request):
+    """
+    Serves the metrics in the Prometheus text format. The collectors read the multiprocess
+    files and take the cache locks, so the response is built in a worker thread.
+    """
+    body = await asyncio.to_thread(lambda: generate_latest(scrape_registry()))
+    return Response(body, media_type=CONTENT_TYPE_LATEST)
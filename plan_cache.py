@@ -0,0 +1,203 @@
+import re, time, difflib, threading
+from collections import OrderedDict
+from sqlglot import exp
+from sql_validation import validate_sql, check_emp_predicate, render_sql, SQLValidationError
+
+
+TOKEN_PATTERN = re.compile(r"\w+(?:['.-]\w+)*")
+SLOT_PATTERN = re.compile(r"^<slot_\d+>$")
+
+
+def tokenize(text):
+    """Splits text into word tokens, returned with their character spans."""
+    return [(match.group(), match.start(), match.end()) for match in TOKEN_PATTERN.finditer(text)]
+
+
+def find_span(tokens, words):
+    """Returns the index of the first run of `tokens` equal to `words` (case-insensitive), or None."""
+    words = [word.lower() for word in words]
+    for i in range(len(tokens) - len(words) + 1):
+        if [token.lower() for token in tokens[i:i + len(words)]] == words:
+            return i
+    return None
+
+
+def parameterize(question, statement, emp_id, constants=()):
+    """
+    Turns a question and the SQL that answered it into a reusable plan.
+
+    The employee ID literal becomes the `:emp_id` bind. Other literals whose words appear
+    in the question (project names, organizations, numbers) become `:slot_<n>` binds and
+    their words are replaced by `<slot_<n>>` in the question shape. Literals that do not
+    appear in the question, or are known status values, stay constants of the plan.
+
+    Args:
+    - question (str): Question the SQL answered.
+    - statement (sqlglot.exp.Expression): Validated SQL statement.
+    - emp_id (str): Employee ID the question was asked for.
+    - constants (set, optional): Values that are never turned into slots.
+
+    Returns:
+    - dict or None: Shape tokens, SQL with binds and slot specs, or None if the SQL does not
+      filter on the employee ID (such a plan cannot safely be shared between employees).
+    """
+    question_tokens = [token for token, _, _ in tokenize(question)]
+    shape = list(question_tokens)
+    slots, slot_names = [], {}
+    state = {"emp_id": False}
+
+    def replace(node):
+        if not isinstance(node, exp.Literal) or isinstance(node.parent, exp.Interval):
+            return node
+        value = str(node.this)
+        if value == str(emp_id):
+            state["emp_id"] = True
+            return exp.Placeholder(this="emp_id")
+        if value in slot_names:
+            return exp.Placeholder(this=slot_names[value])
+        if value in constants:
+            return node
+
+        core = value.strip("%") if node.is_string else value
+        words = [token for token, _, _ in tokenize(core)]
+        start = find_span(shape, words) if words else None
+        if start is None:
+            return node
+        name = f"slot_{len(slots)}"
+        slots.append({
+            "name": name,
+            "number": not node.is_string,
+            "prefix": value[:len(value) - len(value.lstrip("%"))] if node.is_string else "",
+            "suffix": value[len(value.rstrip("%")):] if node.is_string else "",
+        })
+        shape[start:start + len(words)] = [f"<{name}>"]
+        slot_names[value] = name
+        return exp.Placeholder(this=name)
+
+    statement = statement.transform(replace)
+    if not state["emp_id"]:
+        return None
+    return {"shape": [token.lower() for token in shape], "sql": render_sql(statement), "slots": slots}
+
+
+class PlanCache:
+    """
+    LRU cache of SQL plans learned from the agent, keyed by question shape.
+
+    A plan is stored after the agent answered a question with a query that passes
+    validation and filters on the employee ID. A later question reuses it only when it
+    has exactly the words of the plan's shape outside the slots: one added, dropped or
+    changed word ("not", "overdue", "completed") changes the meaning and the SQL. The
+    words aligned with the slots become the new bind values.
+    """
+
+    def __init__(self, max_items=500):
+        self.max_items = max_items
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "rejected": 0, "evictions": 0, "failures": 0}
+
+    def learn(self, question, sql, emp_id, constants=()):
+        """
+        Stores the plan of a question the agent answered successfully.
+
+        Args:
+        - question (str): Question the agent answered.
+        - sql (str): Final query the agent ran.
+        - emp_id (str): Employee ID the question was asked for.
+        - constants (set, optional): Values that are never turned into slots.
+
+        Returns:
+        - bool: Whether a plan was stored.
+        """
+        try:
+            statement = validate_sql(sql)
+            check_emp_predicate(statement, emp_id)
+            plan = parameterize(question, statement, emp_id, constants)
+        except SQLValidationError:
+            plan = None
+        with self.lock:
+            if plan is None:
+                self.stats["rejected"] += 1
+                return False
+            key = " ".join(plan["shape"])
+            plan["created_at"] = time.time()
+            self.plans[key] = plan
+            self.plans.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self.plans) > self.max_items:
+                self.plans.popitem(last=False)
+                self.stats["evictions"] += 1
+        return True
+
+    def match(self, plan, question, tokens):
+        """
+        Aligns a question with a plan; returns the slot bindings, or None if any word
+        outside the slots was inserted, deleted or replaced.
+        """
+        words = [token.lower() for token, _, _ in tokens]
+        shape = plan["shape"]
+        slots = {slot["name"]: slot for slot in plan["slots"]}
+        bindings = {}
+
+        matcher = difflib.SequenceMatcher(None, shape, words, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            slot_tokens = [token for token in shape[i1:i2] if SLOT_PATTERN.match(token)]
+            if tag == "equal":
+                continue
+            # only slot values may differ, and a slot must line up alone against the words that fill it
+            if tag != "replace" or i2 - i1 != 1 or not slot_tokens:
+                return None
+            slot = slots[slot_tokens[0][1:-1]]
+            value = question[tokens[j1][1]:tokens[j2 - 1][2]]
+            if slot["number"]:
+                if not re.fullmatch(r"\d+(\.\d+)?", value):
+                    return None
+                bindings[slot["name"]] = float(value) if "." in value else int(value)
+            else:
+                bindings[slot["name"]] = slot["prefix"] + value + slot["suffix"]
+
+        if len(bindings) != len(slots):
+            return None
+        return bindings
+
+    def lookup(self, question, emp_id):
+        """
+        Finds the plan whose shape a question fills; when several do, the one with the
+        fewest slots (most words fixed) wins.
+
+        Args:
+        - question (str): Standalone user question.
+        - emp_id (str): Employee ID bound into the plan.
+
+        Returns:
+        - dict or None: Plan key, SQL and bound parameters of the matching plan.
+        """
+        tokens = tokenize(question)
+        with self.lock:
+            best = None
+            for key, plan in self.plans.items():
+                bindings = self.match(plan, question, tokens)
+                if bindings is not None and (best is None or len(bindings) < len(best["params"]) - 1):
+                    best = {"key": key, "sql": plan["sql"], "params": dict(bindings, emp_id=emp_id)}
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+            self.plans.move_to_end(best["key"])
+            self.stats["hits"] += 1
+            return best
+
+    def discard(self, key):
+        """Drops a plan whose query failed when it was reused."""
+        with self.lock:
+            if self.plans.pop(key, None) is not None:
+                self.stats["failures"] += 1
+
+    def get_stats(self):
+        """Returns hit/miss counters, the hit ratio and the number of cached plans."""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["plans"] = len(self.plans)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -167,7 +167,23 @@ def get_followup_prompt(schema):
         Return the follow-up questions as a JSON array in the format: ["Question 1", "Question 2", "Question 3"]"""
 
 
-def get_suffix():
+def get_one_shot_prompt(schema, user_query, EmployeeID):
+
+    return get_prompt(schema, user_query, EmployeeID) + """
+    You cannot run queries yourself here. Only do Step 3: reply with the single SQL query that answers the user question, without running it, explaining it or wrapping it in markdown.
+    """
+
+
+def get_suffix(schema_in_prompt=False):
+    if schema_in_prompt:
+        return """Begin!
+    Relevant pieces of previous conversation:
+    {history}
+    (Note: Only reference this information if it is relevant to the current query.)
+    Question: {input}
+    Thought: The schema of the tables is already given in the instructions, so I do not need to list the tables or query the schema. I should write the SQL query and run it directly. If query response is empty then respond that no such data us available.
+    {agent_scratchpad}"""
+
     return """Begin!
     Relevant pieces of previous conversation:
     {history}
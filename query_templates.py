@@ -0,0 +1,160 @@
+import re
+from schema import get_view_columns
+from sql_cache import run_query
+
+
+# Question shapes shared by all templates, e.g. "what tasks do I have?",
+# "show me my pending approvals", "list all my requests in project gen ai".
+LEAD = r"(?:(?:what|which|show|list|give|get|tell|display)(?: me)?(?: are| is)?(?: all)?(?: of)?(?: my| the)?|(?:do i have|have i got)(?: any)?)"
+STATUS = r"(?:(?P<status>pending|open|active|ongoing|current|completed?|finished|done|all) )?"
+TAIL = r"(?: (?:do|did) i have| i have| assigned to me| for me| of mine| that i have)?"
+PROJECT = r"(?: (?:in|for|under|of) (?:the )?project (?P<project>.+?))?"
+
+TEMPLATES = [
+    {
+        "intent": "my_tasks",
+        "entity": r"tasks?",
+        "label": "tasks",
+        "view": "ProjectTasksStreamsView",
+        "column": "TaskName",
+        "status_column": "Status",
+        "owner_filter": '("AssignedTo" = :emp_id OR "AssignedBy" = :emp_id)',
+    },
+    {
+        "intent": "my_streams",
+        "entity": r"streams?",
+        "label": "streams",
+        "view": "ProjectTasksStreamsView",
+        "column": "StreamName",
+        "status_column": "Status",
+        "owner_filter": '("AssignedBy" = :emp_id OR "AssignedTo" = :emp_id)',
+    },
+    {
+        "intent": "my_requests",
+        "entity": r"requests?",
+        "label": "requests",
+        "view": "ProjectRequestsView",
+        "column": "RequestSubject",
+        "status_column": "RequestStatus",
+        "owner_filter": '("AssignedBy" = :emp_id OR "AssignedTo" = :emp_id)',
+    },
+    {
+        "intent": "my_approvals",
+        "entity": r"approvals?",
+        "label": "approvals",
+        "view": "ProjectApprovalsView",
+        "column": "ApprovalName",
+        "status_column": "Status",
+        "owner_filter": '("AssignedTo_One" = :emp_id OR "AssignedTo_Two" = :emp_id OR "AssignedTo_Three" = :emp_id OR "AssignedBy" = :emp_id)',
+    },
+    {
+        "intent": "my_projects",
+        "entity": r"projects?",
+        "label": "projects",
+        "view": "ProjectOrgView",
+        "column": "ProjectName",
+        "status_column": None,
+        "owner_filter": '"ProjectMemberID" = :emp_id',
+    },
+]
+
+for template in TEMPLATES:
+    template["pattern"] = re.compile(rf"^{LEAD} {STATUS}{template['entity']}{TAIL}{PROJECT}{TAIL}$", re.IGNORECASE)
+
+PROJECTS_BY_ORG_PATTERN = re.compile(
+    r"^(?:can i know |could you tell me )?(?:what|which|show|list)(?: me)?(?: all)?(?: the| my)? projects (?:are )?(?:under|in|of|for|belonging to) (?:the )?(?:organi[sz]ation )?(?P<org>.+?)(?: organi[sz]ation)?$",
+    re.IGNORECASE
+)
+
+EXCLUDED_STATUSES = ("Inactive", "Complete")
+
+
+def normalize_question(question):
+    """Lowercases, collapses whitespace and strips trailing punctuation."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").strip()
+
+
+def status_filter(status_column, status):
+    """
+    Builds the status condition for a status slot, always with bound parameters.
+
+    Returns:
+    - tuple: SQL fragment (empty when the view has no status column) and its parameters.
+    """
+    if not status_column:
+        return "", {}
+    if status in ("completed", "complete", "finished", "done"):
+        return f' AND "{status_column}" = :status', {"status": "Complete"}
+    if status == "all":
+        return f' AND "{status_column}" <> :excluded_0', {"excluded_0": "Inactive"}
+    conditions = " AND ".join(f'"{status_column}" <> :excluded_{i}' for i in range(len(EXCLUDED_STATUSES)))
+    return f" AND {conditions}", {f"excluded_{i}": value for i, value in enumerate(EXCLUDED_STATUSES)}
+
+
+def match_template(question, emp_id):
+    """
+    Matches a question against the template registry and fills its slots.
+
+    Args:
+    - question (str): Standalone user question.
+    - emp_id (str): Employee ID bound into the query.
+
+    Returns:
+    - dict or None: Intent, label, SQL text and bound parameters, or None if no template fits.
+    """
+    question = normalize_question(question)
+
+    match = PROJECTS_BY_ORG_PATTERN.match(question)
+    if match:
+        return {
+            "intent": "projects_by_org",
+            "label": "projects",
+            "sql": 'SELECT DISTINCT "ProjectName" FROM "ProjectOrgView" WHERE "OrgName" ILIKE :org_pattern AND "ProjectMemberID" = :emp_id',
+            "params": {"org_pattern": f"%{match.group('org')}%", "emp_id": emp_id},
+        }
+
+    for template in TEMPLATES:
+        match = template["pattern"].match(question)
+        if not match:
+            continue
+        sql = f'SELECT DISTINCT "{template["column"]}" FROM "{template["view"]}" WHERE {template["owner_filter"]}'
+        params = {"emp_id": emp_id}
+
+        fragment, status_params = status_filter(template["status_column"], (match.group("status") or "").lower())
+        sql += fragment
+        params.update(status_params)
+
+        if match.group("project"):
+            # only filter by project where the snapshot confirms the view has the column
+            if "ProjectName" not in get_view_columns(template["view"]):
+                return None
+            sql += ' AND "ProjectName" ILIKE :project_pattern'
+            params["project_pattern"] = f"%{match.group('project')}%"
+
+        return {"intent": template["intent"], "label": template["label"], "sql": sql, "params": params}
+    return None
+
+
+def execute_template(engine, matched, result_cache=None):
+    """
+    Runs a matched template on a pooled connection, through the SQL result cache if given.
+
+    Args:
+    - engine: SQLAlchemy engine.
+    - matched (dict): Output of `match_template`.
+    - result_cache (SQLResultCache, optional): Cache shared with the SQL agent.
+
+    Returns:
+    - list: Distinct values of the selected column.
+    """
+    rows = run_query(engine, matched["sql"], matched["params"], matched["params"]["emp_id"], result_cache)
+    return [row[0] for row in rows]
+
+
+def format_rows(label, rows):
+    """Phrases a template result without an LLM call."""
+    if not rows:
+        return "There is no such data available"
+    if len(rows) == 1:
+        return f"You have one {label[:-1]}: {rows[0]}."
+    return f"Here are your {label}:\n" + "\n".join(f"- {row}" for row in rows)
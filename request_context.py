@@ -0,0 +1,8 @@
+from contextvars import ContextVar
+
+
+# Per-request values that have to reach code LangChain calls on our behalf (tools,
+# SQL execution in executor threads). Context variables are copied into those calls,
+# so concurrent requests never see each other's values.
+current_emp_id = ContextVar("current_emp_id", default=None)
+current_request_id = ContextVar("current_request_id", default=None)
@@ -0,0 +1,253 @@
+import asyncio, time, logging
+import httpx
+from sqlalchemy import create_engine, text
+from motor.motor_asyncio import AsyncIOMotorClient
+from openai import AsyncAzureOpenAI
+from langchain_openai import AzureChatOpenAI
+from config import config as config
+from database.__init__ import get_conn
+from settings import get_setting
+from chat_store import ChatStore
+from metrics import MongoPoolListener, register_stats, register_sql_engine
+
+
+logger = logging.getLogger(__name__)
+
+
+class Resources:
+    """
+    Connections, clients and the SQL agent shared by every request of a worker.
+
+    `open_resources` creates the clients, which connect lazily, and starts the warm-up
+    steps concurrently in the background so the server accepts requests right away.
+    Code that needs a warmed-up value awaits `get(name)`, which waits for (or retries)
+    its step; `status` reports every step for the readiness endpoint. The warm-up task
+    retries failed steps with exponential backoff until they succeed, so a dependency that
+    was down at startup becomes ready even if no request asks for it.
+    """
+
+    def __init__(self):
+        self.sql_engine = None
+        self.mongo_client = None
+        self.chat_store = None
+        self.http_client = None
+        self.async_client = None
+        self.llm = None
+        self.embedding_batcher = None
+        self.faiss_data = None
+        self.agent = None
+        self.chains = None
+        self.steps = {} # warm-up step name -> coroutine function, its result is stored under the name
+        self.tasks = {}
+        self.status = {}
+        self.warmup_task = None
+
+    def start(self, name):
+        self.tasks[name] = asyncio.ensure_future(self.run_step(name))
+        return self.tasks[name]
+
+    async def run_step(self, name):
+        self.status[name] = {"state": "warming"}
+        started = time.perf_counter()
+        try:
+            value = await self.steps[name]()
+        except Exception as e:
+            self.status[name] = {"state": "failed", "error": str(e), "ms": round((time.perf_counter() - started) * 1000, 1)}
+            logger.exception(f"Warm-up step {name} failed")
+            raise
+        if value is not None:
+            setattr(self, name, value)
+        self.status[name] = {"state": "ready", "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    def current_task(self, name):
+        """Returns the running or succeeded task of a step, starting it again if it failed."""
+        task = self.tasks.get(name)
+        if task is None or (task.done() and task.exception() is not None):
+            task = self.start(name)
+        return task
+
+    async def get(self, name):
+        """
+        Returns a warmed-up resource, waiting for its warm-up step if it is still running.
+
+        A step that failed is started again, so a dependency that was down at startup is
+        picked up by the first request after it recovers.
+        """
+        await asyncio.shield(self.current_task(name))
+        return getattr(self, name)
+
+    async def warm_up(self, name, initial_delay=1.0, max_delay=60.0):
+        """
+        Runs a warm-up step until it succeeds, waiting `initial_delay` seconds after the
+        first failure and doubling the wait up to `max_delay` after each further one.
+        """
+        delay = initial_delay
+        while True:
+            try:
+                await asyncio.shield(self.current_task(name))
+                return
+            except Exception:
+                self.status[name]["retry_in"] = delay
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
+    def is_ready(self):
+        return bool(self.status) and all(step["state"] == "ready" for step in self.status.values())
+
+
+resources = Resources()
+
+
+def create_sql_engine():
+    """
+    Creates the one pooled SQLAlchemy engine of the worker.
+
+    `database.get_conn` only provides the connection URL here; its own engine is disposed
+    and a new one is built with the SQL-POOL settings.
+
+    Returns:
+    - Engine: SQLAlchemy engine.
+    """
+    base_engine = get_conn()
+    url = base_engine.url
+    base_engine.dispose()
+    return create_engine(
+        url,
+        pool_size=get_setting("SQL-POOL", "POOL_SIZE", 5, int),
+        max_overflow=get_setting("SQL-POOL", "MAX_OVERFLOW", 10, int),
+        pool_timeout=get_setting("SQL-POOL", "TIMEOUT_SECONDS", 30, float),
+        pool_recycle=get_setting("SQL-POOL", "RECYCLE_SECONDS", 1800, int),
+        pool_pre_ping=get_setting("SQL-POOL", "PRE_PING", True, bool)
+    )
+
+
+def create_mongo_client():
+    """Creates the MongoDB client of the worker with the MONGODB pool settings."""
+    return AsyncIOMotorClient(
+        config["MONGODB"]["CONNECTION_STRING"],
+        maxPoolSize=get_setting("MONGODB", "MAX_POOL_SIZE", 50, int),
+        minPoolSize=get_setting("MONGODB", "MIN_POOL_SIZE", 0, int),
+        maxIdleTimeMS=get_setting("MONGODB", "MAX_IDLE_TIME_MS", 300000, int),
+        event_listeners=[MongoPoolListener()]
+    )
+
+
+def create_http_client():
+    """Creates the keep-alive HTTP connection pool shared by every Azure OpenAI call."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=get_setting("OPENAI-HTTP", "MAX_CONNECTIONS", 100, int),
+            max_keepalive_connections=get_setting("OPENAI-HTTP", "MAX_KEEPALIVE_CONNECTIONS", 20, int),
+            keepalive_expiry=get_setting("OPENAI-HTTP", "KEEPALIVE_EXPIRY", 30, float)
+        ),
+        timeout=httpx.Timeout(get_setting("OPENAI-HTTP", "TIMEOUT_SECONDS", 60, float), connect=10)
+    )
+
+
+async def open_resources():
+    """Creates the shared clients and starts the background warm-up; called from the FastAPI lifespan."""
+    # imported here because both modules read `resources` themselves
+    from functions import create_agent, EMBEDDING_MODEL, deployment
+    from embedding_batcher import EmbeddingBatcher
+    from vector_store import load_index_bundle
+    from tools import build_chains
+
+    api_key = config["AZURE"]["AZURE_API_KEY"]
+    azure_endpoint = config["AZURE"]["AZURE_OPENAI_ENDPOINT"]
+    azure_version = config["AZURE"]["API_VERSION"]
+
+    # Clients and pools only connect on first use, creating them is cheap
+    resources.http_client = create_http_client()
+    resources.async_client = AsyncAzureOpenAI(
+        api_key=api_key,
+        api_version=azure_version,
+        azure_endpoint=azure_endpoint,
+        http_client=resources.http_client
+    )
+    resources.llm = AzureChatOpenAI(
+        api_key=api_key,
+        api_version=azure_version,
+        azure_endpoint=azure_endpoint,
+        azure_deployment=deployment,
+        http_async_client=resources.http_client
+    )
+    # Concurrent cache misses are coalesced into batched embeddings requests
+    resources.embedding_batcher = EmbeddingBatcher(
+        resources.async_client,
+        EMBEDDING_MODEL,
+        max_batch_size=get_setting("EMBEDDING-BATCHER", "MAX_BATCH_SIZE", 64, int),
+        max_wait_ms=get_setting("EMBEDDING-BATCHER", "MAX_WAIT_MS", 5, float),
+        max_concurrent_requests=get_setting("EMBEDDING-BATCHER", "MAX_CONCURRENT_REQUESTS", 4, int)
+    )
+    resources.sql_engine = create_sql_engine()
+    resources.mongo_client = create_mongo_client()
+    resources.chat_store = ChatStore(resources.mongo_client[config["MONGODB"]["DATABASE"]])
+    resources.chains = build_chains(resources.llm)
+
+    register_sql_engine("default", resources.sql_engine)
+    register_stats("embedding_batcher", resources.embedding_batcher)
+    register_stats("history_cache", resources.chat_store.history)
+    register_stats("chat_writer", resources.chat_store.writer)
+    resources.chat_store.writer.start()
+
+    async def load_faiss_data():
+        return await asyncio.to_thread(
+            load_index_bundle, # memory-mapped FAISS index and text store
+            get_setting("VECTOR-STORE", "BUNDLE_PATH", "vector_store_bundle"),
+            nprobe=get_setting("VECTOR-STORE", "NPROBE", cast=int),
+            ef_search=get_setting("VECTOR-STORE", "EF_SEARCH", cast=int)
+        )
+
+    async def build_agent():
+        # schema introspection is blocking I/O
+        return await asyncio.to_thread(create_agent, resources.sql_engine, resources.llm)
+
+    async def ping_sql():
+        await asyncio.to_thread(check_sql, resources.sql_engine)
+
+    async def ping_mongo():
+        await resources.mongo_client.admin.command("ping")
+        await resources.chat_store.ensure_indexes()
+
+    async def prime_llm():
+        # opens the TLS connections of the HTTP pool before the first question
+        if get_setting("STARTUP", "WARMUP_LLM", True, bool):
+            await resources.async_client.chat.completions.create(
+                model=deployment,
+                messages=[{"role": "user", "content": "ping"}],
+                max_tokens=1
+            )
+
+    resources.steps = {
+        "faiss_data": load_faiss_data,
+        "agent": build_agent,
+        "sql": ping_sql,
+        "mongo": ping_mongo,
+        "llm": prime_llm,
+    }
+    initial_delay = get_setting("STARTUP", "RETRY_INITIAL_SECONDS", 1, float)
+    max_delay = get_setting("STARTUP", "RETRY_MAX_SECONDS", 60, float)
+    resources.warmup_task = asyncio.ensure_future(
+        asyncio.gather(*(resources.warm_up(name, initial_delay, max_delay) for name in resources.steps))
+    )
+
+
+def check_sql(engine):
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+async def close_resources():
+    """Stops the warm-up and releases the pools of the worker on shutdown."""
+    if resources.warmup_task is not None:
+        resources.warmup_task.cancel()
+    for task in resources.tasks.values():
+        task.cancel()
+    if resources.chat_store is not None:
+        await resources.chat_store.writer.close() # buffered chat history is written before the client closes
+    if resources.mongo_client is not None:
+        resources.mongo_client.close()
+    if resources.sql_engine is not None:
+        resources.sql_engine.dispose()
+    if resources.http_client is not None:
+        await resources.http_client.aclose()
@@ -1,7 +1,10 @@
-from fastapi import HTTPException, APIRouter, Body, Request
-from fastapi.responses import StreamingResponse
-from database.__init__ import get_conn, conn_mongodb
-from functions import create_agent, employee_ID, llm
+from fastapi import HTTPException, APIRouter, Body, Request, Query, Depends, Header
+from fastapi.responses import StreamingResponse, JSONResponse
+from functions import employee_ID, sql_result_cache
+from sql_cache import ALLOWED_VIEWS
+from resources import resources
+from request_context import current_emp_id
+from settings import get_setting
 from session_operations import (
     create_session_if_not_exists,
     get_all_sessions,
@@ -9,138 +12,151 @@ from session_operations import (
     get_session_by_id,
     delete_session_by_id,
     update_session_name_by_id,
-    # generate_response_stream
+    generate_response_stream
 )
 from config import config as config
-import asyncio, json
-from typing import AsyncGenerator
+import asyncio, json, time, secrets
 
 
 router = APIRouter()
 
-# local storage for token and employee ID
-token_storage = {}
-emp_id_storage = {}
+# token -> (employee ID, expiry), so a chat turn does not wait for the LDAP service
+TOKEN_CACHE_SECONDS = get_setting("AUTH", "TOKEN_CACHE_SECONDS", 300, int)
+TOKEN_CACHE_SIZE = 10000
+employee_ids = {}
+
+# shared secret of the admin routes, sent as the X-Admin-Token header; unset disables them
+ADMIN_TOKEN = get_setting("ADMIN", "TOKEN")
+
+
+async def current_employee(token: str) -> str:
+    """
+    Dependency resolving the employee of a request from its `token` query parameter.
+
+    The employee ID is also bound to `request_context.current_emp_id` for the tools and
+    the SQL result cache of this request.
+
+    Args:
+    - token (str): Employee token for authentication.
+
+    Returns:
+    - str: Employee ID.
+    """
+    now = time.monotonic()
+    cached = employee_ids.get(token)
+    if cached is not None and cached[1] > now:
+        emp_id = cached[0]
+    else:
+        emp_id = await employee_ID(resources.sql_engine, token)
+        if len(employee_ids) >= TOKEN_CACHE_SIZE:
+            employee_ids.clear()
+        employee_ids[token] = (emp_id, now + TOKEN_CACHE_SECONDS)
+    current_emp_id.set(emp_id)
+    return emp_id
+
+
+async def admin_access(x_admin_token: str = Header(None)):
+    """Dependency rejecting requests without the configured `ADMIN` / `TOKEN` header."""
+    if not ADMIN_TOKEN or x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
-db = get_conn() # connect to database
-agent = create_agent(db, llm) # create database agent
-collection = conn_mongodb() # connect to mongoDB
 
 
 
 @router.get("/sessions", tags=["Chatbot"])
-async def get_all_sessions_endpoint(token: str):
+async def get_all_sessions_endpoint(emp_id: str = Depends(current_employee), limit: int = Query(None, ge=1, le=200), before: str = None):
     """
-    Endpoint to retrieve all sessions associated with the provided token.
+    Endpoint to retrieve the sessions associated with the provided token, one page at a time.
 
     Args:
     - token (str): Employee token for authentication.
+    - limit (int, optional): Page size, up to 200. Defaults to `SESSIONS` / `PAGE_SIZE`.
+    - before (str, optional): `next_before` value of the previous page.
 
     Returns:
-    - dict: Dictionary containing the status and sessions retrieved.
+    - dict: Dictionary containing the status, the sessions of the page and the cursor of the next page.
     """
 
-    emp_id = employee_ID(db, token)
-    emp_id_storage['emp_id'] = emp_id
-    token_storage['token_storage'] = token
-    
-    create_session_if_not_exists(collection, emp_id)
+    await create_session_if_not_exists(resources.chat_store, emp_id)
     
-    sessions = get_all_sessions(collection, emp_id)
-    return {"status": "success", "sessions": sessions}
+    page = await get_all_sessions(resources.chat_store, emp_id, limit, before)
+    return {"status": "success", "sessions": page["sessions"], "next_before": page["next_before"]}
 
 
 @router.post("/chatbot")
-async def handle_query_endpoint(query: str , session_id: str = None):
+async def handle_query_endpoint(query: str , session_id: str = None, stream: bool = False, emp_id: str = Depends(current_employee)):
     """
     Endpoint to handle user queries and interact with the chatbot.
 
     Args:
+    - token (str): Employee token for authentication.
     - query (str): User query to be processed.
     - session_id (str, optional): Session ID for context, if provided.
+    - stream (bool, optional): Stream the answer token by token as server-sent events. Defaults to False.
 
     Returns:
     - dict: Dictionary containing the status, response, and session ID.
+    - StreamingResponse: Server-sent events (`session`, `token`, `done`) when streaming.
 
     """
 
-    emp_id = emp_id_storage.get('emp_id')
+    if stream:
+        return StreamingResponse(
+            generate_response_stream(resources.chat_store, emp_id, query, session_id),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
     
-    response = handle_query_logic(collection, emp_id, query, session_id)
+    response = await handle_query_logic(resources.chat_store, emp_id, query, session_id)
 
     return response
 
-# @router.post("/chatbot")
-# async def handle_query_endpoint(query: str, session_id: str):
-#     """
-#     Endpoint to handle user queries and interact with the chatbot.
-
-#     Args:
-#     - query (str): User query to be processed.
-#     - session_id (str, optional): Session ID for context, if provided.
-
-#     Returns:
-#     - StreamingResponse: Streamed response from the chatbot.
-#     """
-
-#     emp_id = emp_id_storage.get('emp_id')
-    
-#     async def stream_and_store() -> AsyncGenerator[str, None]:
-#         # ai_response = ""
-#         async for chunk in generate_response_stream(query, emp_id, collection, session_id):
-#             # ai_response += chunk
-#             # print(chunk)  # Print each chunk to the terminal
-#             yield chunk
-        
-#     return StreamingResponse(stream_and_store(), media_type="text/plain")
-    
- 
 
 
 
 @router.get("/session/{session_id}")
-async def get_session_endpoint(session_id: str):
+async def get_session_endpoint(session_id: str, emp_id: str = Depends(current_employee)):
     """
     Endpoint to retrieve session details by session ID.
 
     Args:
+    - token (str): Employee token for authentication.
     - session_id (str): Session ID to retrieve details for.
 
     Returns:
     - dict: Dictionary containing session details.
 
     """
-   
-    emp_id = emp_id_storage.get('emp_id')
-    session_data = get_session_by_id(collection, emp_id, session_id)
+    session_data = await get_session_by_id(resources.chat_store, emp_id, session_id)
     return session_data
     
 
 
 @router.delete("/session/{session_id}")
-async def delete_session_endpoint(session_id: str):
+async def delete_session_endpoint(session_id: str, emp_id: str = Depends(current_employee)):
     """
     Endpoint to delete a session by session ID.
 
     Args:
+    - token (str): Employee token for authentication.
     - session_id (str): Session ID to delete.
 
     Returns:
     - dict: Dictionary containing status message.
     """
 
-    emp_id = emp_id_storage.get('emp_id')
-    response = delete_session_by_id(collection, emp_id, session_id)
+    response = await delete_session_by_id(resources.chat_store, emp_id, session_id)
     return response
    
 
 
 @router.put("/session/{session_id}/update-name")
-async def update_session_name_endpoint(session_id: str, new_name: str = Body(...)):
+async def update_session_name_endpoint(session_id: str, new_name: str = Body(...), emp_id: str = Depends(current_employee)):
     """
     Endpoint to update session name by session ID.
 
     Args:
+    - token (str): Employee token for authentication.
     - session_id (str): Session ID to update.
     - new_name (str): New name for the session.
 
@@ -149,6 +165,48 @@ async def update_session_name_endpoint(session_id: str, new_name: str = Body(...
 
     """
 
-    emp_id = emp_id_storage.get('emp_id')
-    response = update_session_name_by_id(collection, emp_id, session_id, new_name)
-    return response
\ No newline at end of file
+    response = await update_session_name_by_id(resources.chat_store, emp_id, session_id, new_name)
+    return response
+
+@router.get("/healthz", tags=["Health"])
+async def healthz_endpoint():
+    """
+    Liveness probe: the worker is running and serving requests, warm or not.
+
+    Returns:
+    - dict: Dictionary containing the status.
+    """
+    return {"status": "alive"}
+
+
+@router.get("/readyz", tags=["Health"])
+async def readyz_endpoint():
+    """
+    Readiness probe: every warm-up step (vector index, SQL pool, SQL agent, MongoDB, LLM) finished.
+
+    Returns:
+    - JSONResponse: 200 with the state and duration of each step when ready, 503 otherwise.
+    """
+    ready = resources.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "warming", "steps": resources.status}
+    )
+
+
+@router.post("/admin/sql-cache/invalidate", tags=["Admin"], dependencies=[Depends(admin_access)])
+async def invalidate_sql_cache_endpoint(view: str = None, emp_id: str = None):
+    """
+    Drops cached SQL results of this worker, for the application that writes to the views.
+
+    Args:
+    - view (str, optional): Only drop results that read from this view.
+    - emp_id (str, optional): Only drop results cached for this employee.
+
+    Returns:
+    - dict: Dictionary containing the status and the number of dropped results.
+    """
+    if view is not None and view not in ALLOWED_VIEWS:
+        raise HTTPException(status_code=400, detail=f"Unknown view '{view}', expected one of {', '.join(ALLOWED_VIEWS)}")
+    dropped = sql_result_cache.invalidate(view=view, emp_id=emp_id)
+    return {"status": "success", "invalidated": dropped}
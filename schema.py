@@ -1,2 +1,168 @@
 # Define the schema of the tables if required.
-# This step reduces the number of tools that the agent calls, hence reducing the time to get the response.
\ No newline at end of file
+# This step reduces the number of tools that the agent calls, hence reducing the time to get the response.
+import os, re, json, hashlib, datetime, argparse
+from sqlalchemy import text, inspect
+from settings import get_setting
+from sql_cache import ALLOWED_VIEWS
+
+
+SNAPSHOT_PATH = get_setting("SCHEMA", "SNAPSHOT_PATH", "schema_snapshot.json")
+STATUS_COLUMN_PATTERN = re.compile(r"status", re.IGNORECASE)
+
+schema_snapshot = None # snapshot currently injected into the prompts
+
+
+def build_schema_snapshot(db, views=ALLOWED_VIEWS, max_distinct_values=25):
+    """
+    Introspects the views the agent may query.
+
+    Args:
+    - db (SQLDatabase): LangChain SQL database wrapper of the views.
+    - views (list, optional): Views to describe. Defaults to ALLOWED_VIEWS.
+    - max_distinct_values (int, optional): Status columns with more distinct values are not listed. Defaults to 25.
+
+    Returns:
+    - dict: Snapshot with the table info (columns, types, sample rows), the column names and
+      distinct status values per view, the rendered prompt text and its version hash.
+    """
+    table_info = db.get_table_info(views)
+    engine = db._engine
+    inspector = inspect(engine)
+
+    distinct_values, columns = {}, {}
+    with engine.connect() as connection:
+        for view in views:
+            view_columns = inspector.get_columns(view)
+            columns[view] = [column["name"] for column in view_columns]
+            for column in view_columns:
+                name = column["name"]
+                if not STATUS_COLUMN_PATTERN.search(name):
+                    continue
+                rows = connection.execute(
+                    text(f'SELECT DISTINCT "{name}" FROM "{view}" WHERE "{name}" IS NOT NULL LIMIT :limit'),
+                    {"limit": max_distinct_values + 1}
+                ).fetchall()
+                if len(rows) <= max_distinct_values:
+                    distinct_values[f"{view}.{name}"] = sorted(str(row[0]) for row in rows)
+
+    rendered = table_info
+    if distinct_values:
+        rendered += "\n\n/*\nPossible values of the status columns:\n"
+        rendered += "\n".join(f"{column}: {', '.join(values)}" for column, values in distinct_values.items())
+        rendered += "\n*/"
+
+    return {
+        "version": hashlib.sha256(rendered.encode("utf-8")).hexdigest()[:12],
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "views": list(views),
+        "columns": columns,
+        "distinct_values": distinct_values,
+        "schema": rendered,
+    }
+
+
+def save_schema_snapshot(snapshot, path=SNAPSHOT_PATH):
+    """Writes a snapshot to disk atomically."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_schema_snapshot(path=SNAPSHOT_PATH):
+    """Reads the snapshot cached on disk, or returns None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def refresh_schema(db, path=SNAPSHOT_PATH):
+    """
+    Rebuilds the snapshot from the database, caches it on disk and makes it current.
+
+    Args:
+    - db (SQLDatabase): LangChain SQL database wrapper of the views.
+    - path (str, optional): Snapshot file. Defaults to SCHEMA / SNAPSHOT_PATH.
+
+    Returns:
+    - dict: The current snapshot.
+    """
+    global schema_snapshot
+    snapshot = build_schema_snapshot(db)
+    previous = load_schema_snapshot(path)
+    if not previous or previous["version"] != snapshot["version"]:
+        save_schema_snapshot(snapshot, path)
+    schema_snapshot = snapshot
+    return snapshot
+
+
+def init_schema(db, path=SNAPSHOT_PATH):
+    """
+    Makes a snapshot current at startup, from disk unless SCHEMA / REFRESH_ON_STARTUP is set.
+
+    Args:
+    - db (SQLDatabase): LangChain SQL database wrapper of the views.
+    - path (str, optional): Snapshot file. Defaults to SCHEMA / SNAPSHOT_PATH.
+
+    Returns:
+    - dict: The current snapshot.
+    """
+    global schema_snapshot
+    snapshot = None
+    if not get_setting("SCHEMA", "REFRESH_ON_STARTUP", False, bool):
+        snapshot = load_schema_snapshot(path)
+    if snapshot is None:
+        return refresh_schema(db, path)
+    schema_snapshot = snapshot
+    return snapshot
+
+
+def get_schema(escaped=True):
+    """
+    Returns the schema text injected into the SQL prompt.
+
+    Braces are doubled by default because the text ends up inside a prompt template.
+
+    Args:
+    - escaped (bool, optional): Double the braces. Defaults to True.
+
+    Returns:
+    - str: Rendered snapshot, or an empty string if no snapshot has been loaded.
+    """
+    if schema_snapshot is None:
+        return ""
+    if not escaped:
+        return schema_snapshot["schema"]
+    return schema_snapshot["schema"].replace("{", "{{").replace("}", "}}")
+
+
+def get_view_columns(view):
+    """Returns the column names of a view from the current snapshot, or an empty list."""
+    if schema_snapshot is None:
+        return []
+    return schema_snapshot.get("columns", {}).get(view, [])
+
+
+def get_status_values():
+    """Returns every distinct status value recorded in the current snapshot."""
+    if schema_snapshot is None:
+        return set()
+    return {value for values in schema_snapshot["distinct_values"].values() for value in values}
+
+
+def get_schema_version():
+    """Returns the version hash of the current snapshot, or None."""
+    return schema_snapshot["version"] if schema_snapshot else None
+
+
+if __name__ == "__main__":
+    from database.__init__ import get_conn
+    from langchain_community.utilities import SQLDatabase
+
+    parser = argparse.ArgumentParser(description="Rebuild the schema snapshot used by the SQL agent.")
+    parser.add_argument("--path", default=SNAPSHOT_PATH, help="Snapshot file")
+    args = parser.parse_args()
+
+    snapshot = refresh_schema(SQLDatabase(get_conn(), view_support=True, include_tables=ALLOWED_VIEWS), args.path)
+    print(snapshot["version"])
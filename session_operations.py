@@ -1,92 +1,242 @@
 import datetime
 import uuid
 from fastapi import HTTPException
-from tools import call_tools
+from tools import call_tools, stream_tools
 from translation import translate_text
 from config import config as config
-from functions import generate_session_name, chunk_text
-import asyncio, time
+from functions import generate_session_name
+from tracing import span
+from settings import get_setting
+import asyncio, time, logging
 import json
-from pymongo.collection import Collection
 from typing import AsyncGenerator
 
 
+logger = logging.getLogger(__name__)
+SESSIONS_PAGE_SIZE = get_setting("SESSIONS", "PAGE_SIZE", 50, int)
+HISTORY_MESSAGES = 6 # same window select_tool reads when it loads the history itself
+PROVISIONAL_NAME_LENGTH = 40
+background_tasks = set()
+
 # timezone = config['TIMEZONE']['TZ']
 # tz = pytz.timezone(timezone)
 
 
-def create_session_if_not_exists(collection, emp_id):
+async def create_session_if_not_exists(store, emp_id):
     """
-    Creates a new session for the employee if one does not already exist.
+    Kept for the API: sessions are now created with their first message, an employee
+    needs no document of their own.
 
     Args:
-    - collection (MongoDB collection): MongoDB collection object.
-    - emp_id (str): Employee ID for whom the session is being created.
-
-    Raises:
-    - HTTPException 404: If session creation fails or employee ID is not found in the collection.
+    - store (ChatStore): Sessions and messages collections.
+    - emp_id (str): Employee ID.
     """
-    try:
-        if not collection.find_one({'emp_id': emp_id}):
-            collection.insert_one({'emp_id': emp_id, 'sessions': []})
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Failed to create session: {str(e)}")
+    return None
 
 
 
-def get_all_sessions(collection, emp_id):
+async def get_all_sessions(store, emp_id, limit=None, before=None):
     """
-    Retrieves all sessions associated with the employee ID from the collection.
+    Retrieves one page of the employee's sessions, most recently active first.
+
+    Served from the `(emp_id, last_activity, session_id)` index with a projection that
+    leaves out the messages, so a page costs the same however long the history is.
 
     Args:
-    - collection (MongoDB collection): MongoDB collection object.
+    - store (ChatStore): Sessions and messages collections.
     - emp_id (str): Employee ID for whom sessions are being retrieved.
+    - limit (int, optional): Page size. Defaults to `SESSIONS` / `PAGE_SIZE`.
+    - before (str, optional): `next_before` cursor of the previous page.
 
     Returns:
-    - list: List of dictionaries containing session details.
+    - dict: Sessions of the page (ID, name, last activity, message count) and the
+      `next_before` cursor, None on the last page.
 
     Raises:
-    - HTTPException 404: If no sessions are found for the specified employee ID.
+    - HTTPException 400: If the cursor is malformed.
+    - HTTPException 404: If the sessions cannot be retrieved.
     """
+    limit = limit or SESSIONS_PAGE_SIZE
+    query = {'emp_id': emp_id}
+    if before:
+        last_activity, separator, session_id = before.partition('|')
+        if not separator:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query['$or'] = [
+            {'last_activity': {'$lt': last_activity}},
+            {'last_activity': last_activity, 'session_id': {'$lt': session_id}}
+        ]
     try:
-        employee = collection.find_one({'emp_id': emp_id}, {'sessions': 1})
-        
-        if employee and 'sessions' in employee:
-            sessions = []
-            for session in employee['sessions']:
-                session_id = session['session_id']
-                session_name = session.get('session_name', '')
-                
-                # Extract the most recent timestamp from the session messages
-                if 'messages' in session and session['messages']:
-                    most_recent_message = max(session['messages'], key=lambda msg: msg['timestamp'])
-                    most_recent_timestamp = most_recent_message['timestamp']
-                else:
-                    most_recent_timestamp = None
-                
-                sessions.append({'session_id': session_id, 'session_name': session_name, 'most_recent_timestamp': most_recent_timestamp})
-            
-            # Sort sessions by most recent timestamp in descending order
-            sessions.sort(key=lambda x: x['most_recent_timestamp'], reverse=True)
-            
-            # Remove the 'most_recent_timestamp' from the output
-            for session in sessions:
-                session.pop('most_recent_timestamp')
-            
-            return sessions
-        else:
-            raise HTTPException(status_code=404, detail="No sessions found for this employee")
+        with span("mongo.find", operation="list_sessions", limit=limit):
+            cursor = store.sessions.find(
+                query,
+                {'_id': 0, 'session_id': 1, 'session_name': 1, 'last_activity': 1, 'message_count': 1}
+            ).sort([('last_activity', -1), ('session_id', -1)]).limit(limit + 1)
+            sessions = [
+                {
+                    'session_id': session['session_id'],
+                    'session_name': session.get('session_name', ''),
+                    'last_activity': session.get('last_activity'),
+                    'message_count': session.get('message_count', 0)
+                }
+                async for session in cursor
+            ]
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Failed to retrieve sessions: {str(e)}")
 
+    next_before = None
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        next_before = f"{sessions[-1]['last_activity']}|{sessions[-1]['session_id']}"
+    return {'sessions': sessions, 'next_before': next_before}
+
    
 
-def handle_query_logic(collection, emp_id, query, session_id=None):
+async def timed(stages_ms, stage, awaitable):
+    """Awaits `awaitable` and records its wall time in `stages_ms[stage]`."""
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        stages_ms[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+
+
+def run_in_background(coroutine):
+    """Runs work the response does not wait for, keeping a reference until it is done."""
+    task = asyncio.ensure_future(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+
+async def name_session(store, session_id, query, provisional_name):
+    """Generates the title of a new session and stores it once it is ready."""
+    started = time.perf_counter()
+    try:
+        session_name = await generate_session_name(query)
+        await store.set_generated_name(session_id, provisional_name, session_name)
+    except Exception as e:
+        logger.warning(f"Session {session_id} keeps its provisional name: {e}")
+    logger.info(json.dumps({"event": "session_naming", "session_id": session_id, "ms": round((time.perf_counter() - started) * 1000, 1)}))
+
+
+
+async def store_user_turn(store, emp_id, session_id, query, timestamp, new_session):
+    """
+    Stores the user message of a turn, creating the session first when it is new.
+
+    A new session gets the beginning of the question as provisional name; the generated
+    title replaces it in the background so the answer never waits for the title call.
+    """
+    if new_session:
+        provisional_name = query[:PROVISIONAL_NAME_LENGTH]
+        await store.add_session({
+            'session_id': session_id,
+            'emp_id': emp_id,
+            'session_name': provisional_name,
+            'created_at': timestamp,
+            'last_activity': timestamp,
+            'message_count': 1
+        })
+        store.history.start(session_id)
+        run_in_background(name_session(store, session_id, query, provisional_name))
+
+    # translated_query_response = translate_text(query, 'en')
+    # detected_language = translated_query_response[0]['detectedLanguage']['language']
+    # translated_query = translated_query_response[0]['translations'][0]['text']
+    await store.add_message({
+        'session_id': session_id,
+        'emp_id': emp_id,
+        'role': 'user',
+        'content': query,
+        'timestamp': timestamp
+    })
+
+
+
+async def load_turn_history(store, emp_id, session_id, timestamp, stages_ms):
+    """
+    Checks the session of a turn, records the new message in it and returns its history.
+
+    The history is read after the session check because the check returns the message
+    count the cached history is validated against (see `ChatStore.last_messages`).
+
+    Raises:
+    - HTTPException 404: If the employee has no such session.
+    """
+    message_count = await timed(stages_ms, "check_session", store.touch_session(session_id, emp_id, timestamp))
+    if message_count is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # the count includes the user message of this turn, which is not stored yet
+    return await timed(stages_ms, "history", store.last_messages(session_id, HISTORY_MESSAGES, message_count - 1))
+
+
+
+async def start_query_turn(store, emp_id, query, session_id=None):
+    """
+    Opens a chatbot turn: checks (or creates) the session, reads its history and stores
+    the user message.
+
+    Args:
+    - store (ChatStore): Sessions and messages collections.
+    - emp_id (str): Employee ID for whom the query is being processed.
+    - query (str): User query to be processed.
+    - session_id (str, optional): Session ID where the query should be processed. Defaults to None.
+
+    Returns:
+    - tuple: Session ID of the turn (newly generated if none was given) and the last
+      messages of the session before this turn.
+
+    Raises:
+    - HTTPException 404: If the requested session is not found.
+    """
+    timestamp = datetime.datetime.now().isoformat()
+    new_session = not session_id
+    if new_session:
+        session_id = str(uuid.uuid4())
+        last_messages = []
+    else:
+        last_messages = await load_turn_history(store, emp_id, session_id, timestamp, {})
+    await store_user_turn(store, emp_id, session_id, query, timestamp, new_session)
+    return session_id, last_messages
+
+
+
+async def save_ai_message(store, emp_id, session_id, content):
+    """
+    Stores the chatbot answer of a turn in the session.
+
+    Args:
+    - store (ChatStore): Sessions and messages collections.
+    - emp_id (str): Employee ID owning the session.
+    - session_id (str): Session ID the answer belongs to.
+    - content (str): Full answer text.
+    """
+    timestamp = datetime.datetime.now().isoformat()
+    await store.add_message({
+        'session_id': session_id,
+        'emp_id': emp_id,
+        'role': 'ai',
+        'content': content,
+        'timestamp': timestamp
+    })
+    await store.touch_session(session_id, emp_id, timestamp, verified=True)
+
+
+
+async def handle_query_logic(store, emp_id, query, session_id=None):
     """
     Handles the logic for processing user queries within a session.
 
+    The independent steps of the turn run concurrently: the user message is stored while
+    the tools answer, and a new session is named in the background (see `store_user_turn`).
+    The history read follows the session check, which usually leaves it to the history
+    cache. Stage timings are logged as `turn_latency`.
+
     Args:
-    - collection (MongoDB collection): MongoDB collection object.
+    - store (ChatStore): Sessions and messages collections.
     - emp_id (str): Employee ID for whom the query is being processed.
     - query (str): User query to be processed.
     - session_id (str, optional): Session ID where the query should be processed. Defaults to None.
@@ -95,183 +245,89 @@ def handle_query_logic(collection, emp_id, query, session_id=None):
     - dict: Response containing the status, translated response, and session ID.
 
     Raises:
-    - HTTPException 404: If session or token data is not found, or if there are issues with API calls.
+    - HTTPException 404: If the session is not found, or if there are issues with API calls.
     """
+    stages_ms = {}
+    started = time.perf_counter()
+    new_session = not session_id
     try:
-        token_data = collection.find_one({'emp_id': emp_id})
-        print("1")
-        if not token_data:
-            raise HTTPException(status_code=404, detail="Token not found")
-        print("2")
-        if session_id:
-            print("3")
-            session = next((s for s in token_data['sessions'] if s['session_id'] == session_id), None)
-            print("4")
-            if not session:
-                raise HTTPException(status_code=404, detail="Session not found")
-        else:
-            print("5")
-            session_id = str(uuid.uuid4())
-            print("6")
-            session_name = generate_session_name(query)
-            print("7")
-            new_session = {'session_id': session_id, 'session_name': session_name, 'messages': []}
-            print("8")
-            collection.update_one(
-                {'emp_id': emp_id},
-                {'$push': {'sessions': new_session}}
+        with span("handle_query_logic", new_session=new_session) as current:
+            timestamp = datetime.datetime.now().isoformat()
+            if new_session:
+                session_id = str(uuid.uuid4())
+                last_messages = [] # nothing to read for a new session
+            else:
+                last_messages = await load_turn_history(store, emp_id, session_id, timestamp, stages_ms)
+
+            final_response, _ = await asyncio.gather(
+                timed(stages_ms, "answer", call_tools(query, emp_id, session_id, last_messages)),
+                timed(stages_ms, "user_message", store_user_turn(store, emp_id, session_id, query, timestamp, new_session))
             )
-            print("9")
-            session = new_session
-
-        # translated_query_response = translate_text(query, 'en')
-        # detected_language = translated_query_response[0]['detectedLanguage']['language']
-        # translated_query = translated_query_response[0]['translations'][0]['text']
-        print("10")
-        message = {
-            'role': 'user',
-            'content': query,
-            'timestamp': datetime.datetime.now().isoformat()
-        }
-        print("11")
-        collection.update_one(
-            {'emp_id': emp_id, 'sessions.session_id': session_id},
-            {'$push': {'sessions.$.messages': message}}
-        )
-        print("12")
-        final_response = call_tools(query, emp_id, session_id)
-        print("13")
-        # if detected_language.lower() == 'en':
-        #     translated_response = final_response
-        # else:
-        #     translated_response = translate_text(final_response, detected_language)[0]['translations'][0]['text']
-
-        print("14")
-        message = {
-            'role': 'ai',
-            'content': final_response,
-            'timestamp': datetime.datetime.now().isoformat()
-        }
-        collection.update_one(
-            {'emp_id': emp_id, 'sessions.session_id': session_id},
-            {'$push': {'sessions.$.messages': message}}
-        )
+            # if detected_language.lower() == 'en':
+            #     translated_response = final_response
+            # else:
+            #     translated_response = translate_text(final_response, detected_language)[0]['translations'][0]['text']
+
+            await timed(stages_ms, "ai_message", save_ai_message(store, emp_id, session_id, final_response))
+            current.set(stages_ms=stages_ms)
         
         return {"status": "success", "response": final_response, "session_id": session_id}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Failed to handle query: {str(e)}")
+    finally:
+        logger.info(json.dumps({
+            "event": "turn_latency",
+            "new_session": new_session,
+            "stages_ms": stages_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        }))
 
 
-# chunck by line
-def chunk_text(text: str, by_line: bool = True, chunk_size: int = 1):
-    """Chunk text into lines if by_line is True, otherwise split into words."""
-    if by_line:
-        lines = text.split('\n')
-        for line in lines:
-            yield line
-    else:
-        words = text.split()
-        for i in range(0, len(words), chunk_size):
-            yield " ".join(words[i:i + chunk_size])
-
-
-# async def generate_response_stream(query: str, emp_id: str, collection: Collection, session_id: str = None) -> AsyncGenerator[str, None]:
-#     """
-#     Generate response in chunks to support streaming.
-#     """
-#     try:
-#         # Retrieve token data
-#         token_data = collection.find_one({'emp_id': emp_id})
-#         if not token_data:
-#             raise HTTPException(status_code=404, detail="Token not found")
-        
-#         # Handle session
-        
-#         session = next((s for s in token_data['sessions'] if s['session_id'] == session_id), None)
-        
-#         if not session:
-#             # session_id = str(uuid.uuid4())
-#             session_name = generate_session_name(query)
-#             new_session = {'session_id': session_id, 'session_name': session_name, 'messages': []}
-#             collection.update_one(
-#                 {'emp_id': emp_id},
-#                 {'$push': {'sessions': new_session}}
-#             )
-#             session = new_session
-
-#         # Log user message
-#         message = {
-#             'role': 'user',
-#             'content': query,
-#             'timestamp':datetime.datetime.now(datetime.timezone.utc).isoformat()
-#         }
-#         collection.update_one(
-#             {'emp_id': emp_id, 'sessions.session_id': session_id},
-#             {'$push': {'sessions.$.messages': message}}
-#         )
-
-#         # Generate final response
-#         final_response = call_tools(query, emp_id, session_id)
-#         # print(final_response)
-
-#         # Decide chunking strategy based on presence of new lines
-#         by_line = '\n' in final_response
-
-#         # Initialize full response string
-#         full_response = ""
-
-#         # Use chunk_text function based on by_line flag
-#         chunks = chunk_text(final_response, by_line=by_line, chunk_size=1)
-
-#         # Stream and store each chunk
-#         if (by_line == True):
-#             for chunk in chunks:
-#                 full_response += chunk + "\n"  # Concatenate chunk to full response
-#                 yield chunk + "\n"  # Stream the chunk
-#                 await asyncio.sleep(0.1)  # Simulate delay
-
-#         else:
-#             for chunk in chunks:
-#                 chunk = chunk.strip()
-#                 full_response += chunk + " "
-#                 yield chunk + " "
-#                 await asyncio.sleep(0.1)
-
-#             # Store each chunk in MongoDB
-#             # collection.update_one(
-#             #     {'emp_id': emp_id, 'sessions.session_id': session_id},
-#             #     {'$push': {'sessions.$.messages': {
-#             #         'role': 'ai',
-#             #         'content': chunk,
-#             #         'timestamp': datetime.datetime.now().isoformat()
-#             #     }}}
-#             # )
-
-#         # Store the final combined response in MongoDB
-#         ai_message = {
-#             "role": "ai",
-#             "content": full_response.strip(),
-#             "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()
-#         }
-#         collection.update_one(
-#             {'emp_id': emp_id, 'sessions.session_id': session_id},
-#             {'$push': {'sessions.$.messages': ai_message}}
-#         )
-        
-#     except Exception as e:
-#         yield "An error occurred. Please try rephrasing your question or ask something else."
-#         print(f"Error: {e}")
+def format_sse(event: str, data: dict) -> str:
+    """Formats one server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def generate_response_stream(store, emp_id: str, query: str, session_id: str = None) -> AsyncGenerator[str, None]:
+    """
+    Handles a user query like handle_query_logic but streams the answer as server-sent events.
+
+    Emits a `session` event with the session ID, one `token` event per model token and a
+    final `done` event. The full answer is stored in the session once the stream finishes.
 
-# # Generator function to convert generator to list if needed
-# def generator_to_list(generator):
-#     return list(generator)
+    Args:
+    - store (ChatStore): Sessions and messages collections.
+    - emp_id (str): Employee ID for whom the query is being processed.
+    - query (str): User query to be processed.
+    - session_id (str, optional): Session ID where the query should be processed. Defaults to None.
 
-def get_session_by_id(collection, emp_id, session_id):
+    Yields:
+    - str: Server-sent event frames.
+    """
+    try:
+        session_id, last_messages = await start_query_turn(store, emp_id, query, session_id)
+        yield format_sse("session", {"session_id": session_id})
+
+        full_response = ""
+        async for token in stream_tools(query, emp_id, session_id, last_messages):
+            full_response += token
+            yield format_sse("token", {"content": token})
+
+        await save_ai_message(store, emp_id, session_id, full_response.strip())
+        yield format_sse("done", {"status": "success", "session_id": session_id})
+    except Exception as e:
+        logger.exception(f"Streaming turn failed: {e}")
+        yield format_sse("error", {"detail": "An error occurred. Please try rephrasing your question or ask something else."})
+
+
+async def get_session_by_id(store, emp_id, session_id):
     """
     Retrieves a session's details by its session ID.
 
     Args:
-    - collection (MongoDB collection): MongoDB collection object.
+    - store (ChatStore): Sessions and messages collections.
     - emp_id (str): Employee ID for whom the session details are being retrieved.
     - session_id (str): Session ID of the session to retrieve.
 
@@ -282,21 +338,17 @@ def get_session_by_id(collection, emp_id, session_id):
     - HTTPException 404: If session details are not found for the specified session ID.
     """
     try:
-        session = collection.find_one({'emp_id': emp_id, 'sessions.session_id': session_id}, {'sessions.$': 1})
-
-        if session and session.get('sessions'):
-            session_data = session['sessions'][0]
-            session_data['messages'] = [
-                {
-                    'role': msg['role'],
-                    'content': msg['content'],
-                    'timestamp': msg['timestamp']
-                }
-                for msg in session_data.get('messages', [])
-            ]
-            return session_data
-        else:
+        if store.writer.new_sessions.get(session_id) == emp_id:
+            await store.writer.flush() # the session document is still buffered
+        session = await store.sessions.find_one(
+            {'session_id': session_id, 'emp_id': emp_id},
+            {'_id': 0, 'session_id': 1, 'session_name': 1}
+        )
+        if not session:
             raise HTTPException(status_code=404, detail="Session not found")
+
+        session['messages'] = await store.session_messages(session_id)
+        return session
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Failed to retrieve session: {str(e)}")
 
@@ -304,12 +356,12 @@ def get_session_by_id(collection, emp_id, session_id):
 
 
 
-def delete_session_by_id(collection, emp_id, session_id):
+async def delete_session_by_id(store, emp_id, session_id):
     """
-    Deletes a session by its session ID.
+    Deletes a session and its messages by its session ID.
 
     Args:
-    - collection (MongoDB collection): MongoDB collection object.
+    - store (ChatStore): Sessions and messages collections.
     - emp_id (str): Employee ID for whom the session is being deleted.
     - session_id (str): Session ID of the session to delete.
 
@@ -320,11 +372,14 @@ def delete_session_by_id(collection, emp_id, session_id):
     - HTTPException 404: If session deletion fails or session ID is not found.
     """
     try:
-        result = collection.update_one(
-            {'emp_id': emp_id},
-            {'$pull': {'sessions': {'session_id': session_id}}}
-        )
-        if result.modified_count == 1:
+        await store.writer.flush() # buffered writes of the session would recreate it
+        with span("mongo.delete", operation="delete_session") as current:
+            result = await store.sessions.delete_one({'session_id': session_id, 'emp_id': emp_id})
+            if result.deleted_count == 1:
+                store.history.discard(session_id)
+                deleted = await store.messages.delete_many({'session_id': session_id})
+                current.set(messages=deleted.deleted_count)
+        if result.deleted_count == 1:
             return {"status": "success", "message": f"Session with session_id '{session_id}' deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail=f"Session with session_id '{session_id}' not found")
@@ -334,12 +389,12 @@ def delete_session_by_id(collection, emp_id, session_id):
 
 
 
-def update_session_name_by_id(collection, emp_id, session_id, new_name):
+async def update_session_name_by_id(store, emp_id, session_id, new_name):
     """
     Updates a session's name by its session ID.
 
     Args:
-    - collection (MongoDB collection): MongoDB collection object.
+    - store (ChatStore): Sessions and messages collections.
     - emp_id (str): Employee ID for whom the session name is being updated.
     - session_id (str): Session ID of the session whose name is to be updated.
     - new_name (str): New name to assign to the session.
@@ -351,14 +406,16 @@ def update_session_name_by_id(collection, emp_id, session_id, new_name):
     - HTTPException 404: If session name update fails or session ID is not found.
     """
     try:
-        result = collection.update_one(
-            {'emp_id': emp_id, 'sessions.session_id': session_id},
-            {'$set': {'sessions.$.session_name': new_name}}
-        )
+        await store.writer.flush() # the session may not be stored yet
+        with span("mongo.update", operation="rename_session"):
+            result = await store.sessions.update_one(
+                {'session_id': session_id, 'emp_id': emp_id},
+                {'$set': {'session_name': new_name}}
+            )
 
-        if result.modified_count == 1:
+        if result.matched_count == 1:
             return {"status": "success", "message": f"Session name updated successfully for session_id '{session_id}'"}
         else:
             raise HTTPException(status_code=404, detail=f"Session with session_id '{session_id}' not found")
     except Exception as e:
-        raise HTTPException(status_code=404, detail=f"Failed to update session name: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=f"Failed to update session name: {str(e)}")
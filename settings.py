@@ -0,0 +1,23 @@
+from config import config as config
+
+
+def get_setting(section, key, default=None, cast=str):
+    """
+    Reads an optional setting from the config file, falling back to a default.
+
+    Args:
+    - section (str): Config section, e.g. "VECTOR-STORE".
+    - key (str): Key inside the section.
+    - default: Value returned when the section or key is missing.
+    - cast (callable, optional): Converter applied to the raw value. Defaults to str.
+
+    Returns:
+    - The converted setting, or `default` if it is not configured.
+    """
+    try:
+        value = config[section][key]
+    except KeyError:
+        return default
+    if cast is bool and isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return cast(value)
@@ -0,0 +1,68 @@
+import asyncio, difflib, logging
+from embedding_cache import normalize_text
+
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeRetrieval:
+    """
+    Starts the vector retrieval of a question while the router is still deciding.
+
+    The retrieval runs on the raw question. It is reused when the router picks the vector
+    tool for a question whose text is at least `min_similarity` similar (difflib ratio on
+    normalized text) to the raw one, so a rewrite that only fixed the wording keeps the
+    prefetched chunks. Otherwise it is cancelled, or discarded if it already finished,
+    and counted as wasted work.
+    """
+
+    def __init__(self, min_similarity=0.9):
+        self.min_similarity = min_similarity
+        self.stats = {"started": 0, "used": 0, "cancelled": 0, "discarded": 0, "failed": 0}
+
+    def start(self, retrieve, query):
+        """Starts `retrieve(query)` in the background and returns the speculation."""
+        self.stats["started"] += 1
+        return {"query": query, "task": asyncio.ensure_future(retrieve(query))}
+
+    def similarity(self, query, tool_query):
+        return difflib.SequenceMatcher(None, normalize_text(query), normalize_text(tool_query), autojunk=False).ratio()
+
+    async def resolve(self, speculation, reusable, tool_query):
+        """
+        Returns the prefetched retrieval if it can answer `tool_query`, and drops it otherwise.
+
+        Args:
+        - speculation (dict): Value returned by `start`.
+        - reusable (bool): Whether the chosen tool uses vector retrieval.
+        - tool_query (str): Question the chosen tool will answer.
+
+        Returns:
+        - Any or None: Result of the retrieval, or None when it was not reused.
+        """
+        task = speculation["task"]
+        if reusable and self.similarity(speculation["query"], tool_query) >= self.min_similarity:
+            try:
+                result = await task
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"Speculative retrieval failed: {e}")
+                return None
+            self.stats["used"] += 1
+            return result
+
+        if task.done():
+            self.stats["discarded"] += 1
+            if not task.cancelled():
+                task.exception() # retrieved, so a failure is not reported as unhandled
+        else:
+            self.stats["cancelled"] += 1
+            task.cancel()
+        return None
+
+    def get_stats(self):
+        """Returns the counters and the share of speculative retrievals that were not used."""
+        stats = dict(self.stats)
+        resolved = stats["used"] + stats["cancelled"] + stats["discarded"] + stats["failed"]
+        stats["wasted_ratio"] = (resolved - stats["used"]) / resolved if resolved else 0.0
+        return stats
@@ -0,0 +1,167 @@
+import re, json, time, threading
+from collections import OrderedDict
+from sqlalchemy import text
+from langchain_community.utilities import SQLDatabase
+from request_context import current_emp_id
+from tracing import span
+
+
+ALLOWED_VIEWS = ["ProjectOrgView", "ProjectTasksStreamsView", "ProjectRequestsView", "ProjectApprovalsView"]
+QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")")
+READ_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """
+    Normalizes SQL text for cache keys: collapses whitespace, lowercases everything
+    outside quoted literals and identifiers and drops the trailing semicolon.
+    """
+    parts = QUOTED_PATTERN.split(sql.strip().rstrip(";"))
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part.lower()) for i, part in enumerate(parts)).strip()
+
+
+def referenced_views(sql, views=ALLOWED_VIEWS):
+    """Returns the known views a statement reads from."""
+    return {view for view in views if re.search(rf'\b{view}\b', sql, re.IGNORECASE)}
+
+
+class SQLResultCache:
+    """
+    LRU cache of query results keyed by normalized SQL text and employee ID.
+
+    Each entry lives for the shortest TTL of the views it reads from. Results above
+    `max_rows` rows or `max_bytes` (approximate, by repr) are not cached.
+    """
+
+    def __init__(self, default_ttl=60, view_ttls=None, max_entries=2000, max_rows=500, max_bytes=256 * 1024):
+        self.default_ttl = default_ttl
+        self.view_ttls = view_ttls or {}
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "too_large": 0, "expired": 0, "evictions": 0, "invalidated": 0}
+
+    def make_key(self, sql, emp_id, fetch="all", parameters=None):
+        return (normalize_sql(sql), emp_id, fetch, json.dumps(parameters or {}, sort_keys=True, default=str))
+
+    def get(self, key):
+        """Returns the cached rows for a key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if time.time() > entry["expires_at"]:
+                del self.entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry["rows"]
+
+    def put(self, key, rows):
+        """Caches rows for a key unless they exceed the size caps."""
+        if len(rows) > self.max_rows or len(repr(rows)) > self.max_bytes:
+            self.stats["too_large"] += 1
+            return
+        views = referenced_views(key[0])
+        ttl = min([self.view_ttls.get(view, self.default_ttl) for view in views] or [self.default_ttl])
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = {"rows": rows, "views": views, "emp_id": key[1], "expires_at": time.time() + ttl}
+            self.entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, view=None, emp_id=None):
+        """
+        Drops cached results, e.g. after the main application wrote to a view's tables.
+
+        Args:
+        - view (str, optional): Only drop results that read from this view.
+        - emp_id (str, optional): Only drop results cached for this employee.
+
+        Returns:
+        - int: Number of dropped entries.
+        """
+        with self.lock:
+            keys = [
+                key for key, entry in self.entries.items()
+                if (view is None or view in entry["views"]) and (emp_id is None or entry["emp_id"] == emp_id)
+            ]
+            for key in keys:
+                del self.entries[key]
+            self.stats["invalidated"] += len(keys)
+        return len(keys)
+
+    def get_stats(self):
+        """Returns hit/miss counters, the hit ratio and the number of cached results."""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def run_query(engine, sql, params, emp_id, result_cache=None):
+    """
+    Runs a parameterized read query on a pooled connection, through the result cache if given.
+
+    Args:
+    - engine: SQLAlchemy engine.
+    - sql (str): Query text with `:name` binds.
+    - params (dict): Bound parameters.
+    - emp_id (str): Employee ID the results are cached for.
+    - result_cache (SQLResultCache, optional): Cache shared with the SQL agent.
+
+    Returns:
+    - list: Result rows as tuples.
+    """
+    with span("sql.execute") as current:
+        key = None
+        if result_cache is not None:
+            key = result_cache.make_key(sql, emp_id, "all", params)
+            rows = result_cache.get(key)
+            if rows is not None:
+                current.set(cached=True, rows=len(rows))
+                return rows
+
+        with engine.connect() as connection:
+            rows = [tuple(row) for row in connection.execute(text(sql), params).fetchall()]
+        current.set(cached=False, rows=len(rows))
+        if key is not None:
+            result_cache.put(key, rows)
+        return rows
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase whose read queries are served from a SQLResultCache.
+
+    The employee ID of the cache key comes from `request_context.current_emp_id`, which
+    LangChain copies into the executor thread that runs the agent's SQL tool.
+    """
+
+    def __init__(self, engine, result_cache, **kwargs):
+        super().__init__(engine, **kwargs)
+        self.result_cache = result_cache
+
+    def _execute(self, command, fetch="all", *, parameters=None, execution_options=None):
+        if not isinstance(command, str) or fetch == "cursor" or not READ_PATTERN.match(command):
+            return super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+
+        with span("sql.execute") as current:
+            key = self.result_cache.make_key(command, current_emp_id.get(), fetch, parameters)
+            rows = self.result_cache.get(key)
+            current.set(cached=rows is not None)
+            if rows is None:
+                rows = super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+                self.result_cache.put(key, rows)
+            return rows
@@ -0,0 +1,175 @@
+import re
+import sqlglot
+from sqlglot import exp
+from sql_cache import ALLOWED_VIEWS
+
+
+DIALECT = "postgres"
+WRITE_EXPRESSIONS = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter, exp.Command, exp.Into)
+PYFORMAT_PATTERN = re.compile(r"%\((\w+)\)s")
+VIEW_SCHEMA = "public" # the only schema qualifier a view reference may carry
+# Columns of the views that hold an employee ID; an OR of equalities on these counts as the employee filter
+EMP_ID_COLUMNS = {"employeeid", "projectmemberid", "assignedto", "assignedby", "assignedto_one", "assignedto_two", "assignedto_three"}
+# Functions generated SQL may call, as named by sqlglot; anything else (pg_sleep, dblink, ...) is rejected
+ALLOWED_FUNCTIONS = {
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "ARRAY_AGG", "GROUP_CONCAT", "LOGICAL_AND", "LOGICAL_OR",
+    "ROW_NUMBER", "RANK", "DENSE_RANK", "LAG", "LEAD", "FIRST_VALUE", "LAST_VALUE",
+    "LOWER", "UPPER", "TRIM", "LENGTH", "SUBSTRING", "CONCAT", "REPLACE", "SPLIT_PART", "STR_POSITION",
+    "COALESCE", "NULLIF", "GREATEST", "LEAST", "CAST", "TRY_CAST", "CASE", "IF", "EXISTS",
+    "ROUND", "ABS", "FLOOR", "CEIL",
+    "CURRENT_DATE", "CURRENT_TIMESTAMP", "LOCALTIMESTAMP", "EXTRACT", "TIMESTAMP_TRUNC", "DATE_TRUNC",
+    "TIME_TO_STR", "STR_TO_DATE", "AGE", "DATE", "DATE_ADD", "DATE_SUB", "DATE_DIFF",
+}
+
+
+class SQLValidationError(ValueError):
+    """Raised when generated SQL is not a single read-only query over the allowed views."""
+
+
+def validate_sql(sql, allowed_views=ALLOWED_VIEWS):
+    """
+    Parses a statement and checks that it only reads from the allowed views.
+
+    Args:
+    - sql (str): SQL text produced by the agent or the model.
+    - allowed_views (list, optional): Views the statement may read from. Defaults to ALLOWED_VIEWS.
+
+    Returns:
+    - sqlglot.exp.Expression: Parsed statement.
+
+    Raises:
+    - SQLValidationError: If the text does not parse, holds several statements, writes
+      anything, touches a table outside `allowed_views` or qualifies a view with a schema
+      other than VIEW_SCHEMA or with a catalog.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=DIALECT) if statement is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLValidationError(f"SQL does not parse: {e}")
+    if len(statements) != 1:
+        raise SQLValidationError(f"Expected one statement, got {len(statements)}")
+
+    statement = statements[0]
+    if not isinstance(statement, exp.Query):
+        raise SQLValidationError(f"Only SELECT queries are allowed, got {statement.key.upper()}")
+    if statement.find(*WRITE_EXPRESSIONS):
+        raise SQLValidationError("The query contains a write")
+
+    for function in statement.find_all(exp.Func):
+        if isinstance(function, exp.Connector): # AND / OR
+            continue
+        name = function.name.upper() if isinstance(function, exp.Anonymous) else function.sql_name()
+        if name not in ALLOWED_FUNCTIONS:
+            raise SQLValidationError(f"Function {name} is not allowed")
+
+    ctes = {cte.alias_or_name for cte in statement.find_all(exp.CTE)}
+    allowed = {view.lower() for view in allowed_views}
+    for table in statement.find_all(exp.Table):
+        if table.name in ctes and not table.db:
+            continue
+        if table.catalog or (table.db and table.db.lower() != VIEW_SCHEMA):
+            raise SQLValidationError(f"Table {table.sql(dialect=DIALECT)} is outside the {VIEW_SCHEMA} schema")
+        if table.name.lower() not in allowed:
+            raise SQLValidationError(f"Table {table.name} is not one of the allowed views")
+    return statement
+
+
+def conjuncts(condition):
+    """Top-level AND terms of a condition; terms under OR or NOT stay whole."""
+    while isinstance(condition, exp.Paren):
+        condition = condition.this
+    if isinstance(condition, exp.And):
+        return conjuncts(condition.this) + conjuncts(condition.expression)
+    return [condition]
+
+
+def disjuncts(condition):
+    """OR terms of a condition, with parentheses stripped."""
+    while isinstance(condition, exp.Paren):
+        condition = condition.this
+    if isinstance(condition, exp.Or):
+        return disjuncts(condition.this) + disjuncts(condition.expression)
+    return [condition]
+
+
+def emp_column(term, emp_id):
+    """The column of a `column = '<emp_id>'` (or `column IN ('<emp_id>')`) term, else None."""
+    if isinstance(term, exp.EQ):
+        column, values = term.this, [term.expression]
+        if isinstance(values[0], exp.Column) and isinstance(column, exp.Literal):
+            column, values = values[0], [column]
+    elif isinstance(term, exp.In):
+        column, values = term.this, term.expressions
+    else:
+        return None
+    if isinstance(column, exp.Column) and values and all(
+        isinstance(value, exp.Literal) and value.is_string and str(value.this) == str(emp_id) for value in values
+    ):
+        return column
+    return None
+
+
+def emp_filtered_tables(select, emp_id):
+    """
+    Table qualifiers ('' when unqualified) filtered on the employee ID by the WHERE of a SELECT.
+
+    A top-level AND term counts when it is a `column = '<emp_id>'` term on an employee-ID
+    column, or an OR whose every branch is one, all on the same table, as in
+    `("AssignedTo" = '3454' OR "AssignedBy" = '3454')`.
+    """
+    where = select.args.get("where")
+    qualifiers = set()
+    for term in conjuncts(where.this) if where else []:
+        columns = [emp_column(branch, emp_id) for branch in disjuncts(term)]
+        if not all(column is not None and column.name.lower() in EMP_ID_COLUMNS for column in columns):
+            continue
+        tables = {column.table.lower() for column in columns}
+        if len(tables) == 1:
+            qualifiers |= tables
+    return qualifiers
+
+
+def check_emp_predicate(statement, emp_id, allowed_views=ALLOWED_VIEWS):
+    """
+    Checks that every SELECT reading one of the views filters it on the employee ID.
+
+    Each view referenced in the FROM or JOINs of a SELECT (UNION arms, subqueries and CTEs
+    included) needs a `column = '<emp_id>'` (or `column IN ('<emp_id>')`) term on one of
+    EMP_ID_COLUMNS, or an OR of such terms, that is a top-level AND conjunct of that SELECT's
+    WHERE, qualified with the view's alias or unqualified when the SELECT reads a single view.
+    ORs with any other branch and terms under NOT do not count.
+
+    Raises:
+    - SQLValidationError: If some view is read without such a filter.
+    """
+    views = {view.lower() for view in allowed_views}
+    for select in statement.find_all(exp.Select):
+        sources = [select.args.get("from_") or select.args.get("from")] + list(select.args.get("joins") or [])
+        tables = [
+            source.this for source in sources
+            if source is not None and isinstance(source.this, exp.Table) and source.this.name.lower() in views
+        ]
+        if not tables:
+            continue
+        filtered = emp_filtered_tables(select, emp_id)
+        for table in tables:
+            names = {table.alias_or_name.lower(), table.name.lower()}
+            if names & filtered or (len(tables) == 1 and "" in filtered):
+                continue
+            raise SQLValidationError(f"{table.name} is not filtered on the employee ID {emp_id}")
+
+
+def apply_limit(statement, max_rows):
+    """Adds a LIMIT of `max_rows` to a statement without one and lowers larger literal limits."""
+    limit = statement.args.get("limit")
+    if limit is None:
+        return statement.limit(max_rows)
+    value = limit.expression
+    if isinstance(value, exp.Literal) and not value.is_string and int(value.this) > max_rows:
+        return statement.limit(max_rows)
+    return statement
+
+
+def render_sql(statement):
+    """Renders a parsed statement for `sqlalchemy.text`, with placeholders as `:name` binds."""
+    return PYFORMAT_PATTERN.sub(r":\1", statement.sql(dialect=DIALECT))
@@ -0,0 +1,64 @@
+import sys, json, time, argparse, statistics, subprocess
+import httpx
+
+
+def time_import(module):
+    """Seconds a fresh interpreter takes to import `module`."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - started
+
+
+def time_startup(app, port, timeout):
+    """
+    Starts one uvicorn worker and polls it until it is live and until it is ready.
+
+    Returns:
+    - dict: Seconds from process start to the first /healthz and /readyz 200 responses,
+      and the warm-up step durations reported by /readyz.
+    """
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"])
+    started = time.perf_counter()
+    result = {"live_s": None, "ready_s": None, "steps": None}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1) as client:
+            while time.perf_counter() - started < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+                try:
+                    if result["live_s"] is None and client.get("/healthz").status_code == 200:
+                        result["live_s"] = round(time.perf_counter() - started, 3)
+                    response = client.get("/readyz")
+                except httpx.TransportError:
+                    time.sleep(0.05)
+                    continue
+                result["steps"] = response.json().get("steps")
+                if response.status_code == 200:
+                    result["ready_s"] = round(time.perf_counter() - started, 3)
+                    break
+                time.sleep(0.05)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import-to-ready time of the API.")
+    parser.add_argument("--app", default="main:app", help="ASGI app passed to uvicorn")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for /readyz per run")
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.runs):
+        run = time_startup(args.app, args.port, args.timeout)
+        run["import_s"] = round(time_import(args.app.split(":")[0]), 3)
+        runs.append(run)
+
+    summary = {}
+    for key in ("import_s", "live_s", "ready_s"):
+        values = [run[key] for run in runs if run[key] is not None]
+        summary[key] = round(statistics.median(values), 3) if values else None
+    print(json.dumps({"median": summary, "runs": runs}, indent=2))
@@ -0,0 +1,10 @@
+import os, sys, types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py holds deployment credentials and is not part of the repository; the unit
+# tests only need the defaults of `settings.get_setting`.
+try:
+    import config # noqa: F401
+except ModuleNotFoundError:
+    sys.modules["config"] = types.SimpleNamespace(config={})
@@ -0,0 +1,39 @@
+import time
+from answer_cache import SemanticAnswerCache
+
+
+def test_similar_query_with_same_chunks_hits():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store([1.0, 0.0], [3, 1], "answer", index_version="v1")
+    assert cache.lookup([0.99, 0.05], [1, 3], index_version="v1") == "answer"
+    assert cache.lookup([1.0, 0.0], [1, 4], index_version="v1") is None # other chunks
+    assert cache.lookup([0.5, 0.5], [1, 3], index_version="v1") is None # other meaning
+
+
+def test_new_index_version_drops_every_answer():
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], [1, 3], "answer", index_version="v1")
+    assert cache.lookup([1.0, 0.0], [1, 3], index_version="v2") is None
+    assert cache.lookup([1.0, 0.0], [1, 3], index_version="v1") is None
+    stats = cache.get_stats()
+    assert stats["invalidations"] == 1 and stats["items"] == 0
+
+
+def test_expired_answers_are_dropped(monkeypatch):
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store([1.0, 0.0], [1], "answer")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.lookup([1.0, 0.0], [1]) is None
+    assert cache.get_stats()["expired"] == 1
+
+
+def test_least_recently_used_answer_is_evicted():
+    cache = SemanticAnswerCache(max_items=2)
+    cache.store([1.0, 0.0], [1], "first")
+    cache.store([1.0, 0.0], [2], "second")
+    cache.lookup([1.0, 0.0], [1])
+    cache.store([1.0, 0.0], [3], "third")
+    assert cache.lookup([1.0, 0.0], [2]) is None
+    assert cache.lookup([1.0, 0.0], [1]) == "first"
+    assert cache.get_stats()["evictions"] == 1
@@ -0,0 +1,45 @@
+import asyncio
+import numpy as np
+from embedding_cache import EmbeddingCache, normalize_text
+
+
+MODEL = "text-embedding-ada-002"
+
+
+def test_normalized_text_shares_a_key():
+    assert normalize_text("  What  tasks\ndo I have? ") == "what tasks do i have?"
+    assert EmbeddingCache.make_key("What tasks  do I have?", MODEL) == EmbeddingCache.make_key("what tasks do i have?", MODEL)
+    assert EmbeddingCache.make_key("tasks", MODEL) != EmbeddingCache.make_key("tasks", "other-model")
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path)
+    assert asyncio.run(cache.aget("hello", MODEL)) is None
+    asyncio.run(cache.aput("hello", MODEL, [1.0, 2.0]))
+    assert asyncio.run(cache.aget("Hello ", MODEL)).tolist() == [1.0, 2.0]
+
+    restarted = EmbeddingCache(path)
+    assert asyncio.run(restarted.aget("hello", MODEL)).dtype == np.float32
+    asyncio.run(restarted.aget("hello", MODEL))
+    stats = restarted.get_stats()
+    assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1 and stats["disk_items"] == 1
+
+
+def test_memory_hit_does_not_touch_the_disk_tier(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    asyncio.run(cache.aput("hello", MODEL, [1.0]))
+    with cache.disk_lock: # a disk read would block on the held lock
+        assert asyncio.run(cache.aget("hello", MODEL)).tolist() == [1.0]
+        assert cache.get_stats()["disk_items"] == 1
+
+
+def test_both_tiers_are_bounded(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_memory_items=2, max_disk_items=50)
+    for i in range(100):
+        cache.store(f"key{i}", [float(i)])
+    stats = cache.get_stats()
+    assert stats["memory_items"] == 2 and stats["memory_evictions"] == 98
+    assert stats["disk_items"] == 50 and stats["disk_evictions"] == 50
+    assert cache.lookup("key0") is None
+    assert cache.lookup("key99").tolist() == [99.0]
@@ -0,0 +1,52 @@
+from history_cache import HistoryCache, MESSAGE_OVERHEAD_BYTES
+
+
+def test_buffer_keeps_the_last_messages():
+    cache = HistoryCache(max_messages=3)
+    cache.load("s1", [{"role": "user", "content": str(i), "timestamp": ""} for i in range(5)], 5)
+    assert [m["content"] for m in cache.get("s1", 3)] == ["2", "3", "4"]
+    cache.append("s1", {"role": "ai", "content": "5", "timestamp": ""})
+    assert [m["content"] for m in cache.get("s1", 2, message_count=6)] == ["4", "5"]
+    assert cache.get("s1", 4) is None # more than a buffer holds
+    assert cache.bytes == 3 * (1 + MESSAGE_OVERHEAD_BYTES)
+
+
+def test_least_recently_used_session_is_evicted():
+    cache = HistoryCache(max_sessions=2)
+    cache.start("s1")
+    cache.start("s2")
+    cache.get("s1", 1)
+    cache.start("s3")
+    assert cache.get("s2", 1) is None
+    assert cache.get("s1", 1) == [] and cache.get("s3", 1) == []
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_byte_cap_evicts_but_keeps_the_most_recent_session():
+    cache = HistoryCache(max_bytes=3 * MESSAGE_OVERHEAD_BYTES)
+    cache.load("s1", [{"role": "user", "content": "a", "timestamp": ""}], 1)
+    cache.load("s2", [{"role": "user", "content": "b", "timestamp": ""}], 1)
+    cache.load("s3", [{"role": "user", "content": "x" * 1000, "timestamp": ""}], 1)
+    assert list(cache.buffers) == ["s3"]
+    assert cache.bytes == 1000 + MESSAGE_OVERHEAD_BYTES
+    cache.discard("s3")
+    assert cache.bytes == 0
+
+
+def test_session_written_by_another_worker_is_reloaded():
+    cache = HistoryCache()
+    cache.start("s1")
+    cache.append("s1", {"role": "user", "content": "question", "timestamp": ""})
+    cache.append("s1", {"role": "ai", "content": "answer", "timestamp": ""})
+    assert len(cache.get("s1", 5, message_count=2)) == 2
+    assert cache.get("s1", 5, message_count=4) is None
+    assert "s1" not in cache.buffers
+    stats = cache.get_stats()
+    assert stats["stale"] == 1 and stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_buffer_with_unknown_count_is_revalidated():
+    cache = HistoryCache()
+    cache.load("s1", [{"role": "user", "content": "question", "timestamp": ""}])
+    assert cache.get("s1", 5) is not None
+    assert cache.get("s1", 5, message_count=1) is None
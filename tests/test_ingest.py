@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("pypdf")
+from ingest import bundle_is_current, split_into_chunks, chunk_hash
+from vector_store import write_bundle
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    texts = ["first chunk", "second chunk"]
+    metadata = [{"source": "doc.md", "page": 1, "chunk": i, "hash": chunk_hash(text)} for i, text in enumerate(texts)]
+    vectors = np.random.default_rng(0).normal(size=(2, 8)).astype("float32")
+    write_bundle(str(tmp_path), vectors, texts, metadata, index_type="hnsw", metric="cosine", search_params={"ef_search": 64}, hnsw_m=16)
+    return str(tmp_path), [item["hash"] for item in metadata]
+
+
+def test_unchanged_chunks_and_config_are_current(bundle):
+    root, hashes = bundle
+    assert bundle_is_current(root, hashes, "hnsw", "cosine", {"ef_search": 64}, hnsw_m=16)
+    assert bundle_is_current(root, hashes, "hnsw", "cosine", {"ef_search": 64})
+
+
+@pytest.mark.parametrize("change", [
+    {"hashes": ["edited"]},
+    {"index_type": "flat"},
+    {"metric": "l2"},
+    {"search_params": {"ef_search": 128}},
+    {"search_params": None},
+    {"hnsw_m": 32},
+])
+def test_changed_chunks_or_config_rebuild(bundle, change):
+    root, hashes = bundle
+    args = {"hashes": hashes, "index_type": "hnsw", "metric": "cosine", "search_params": {"ef_search": 64}, **change}
+    assert not bundle_is_current(root, **args)
+
+
+def test_missing_bundle_is_not_current(tmp_path):
+    assert not bundle_is_current(str(tmp_path), [], "flat", "l2")
+
+
+def test_chunks_overlap_and_respect_size():
+    text = " ".join(f"word{i}" for i in range(400))
+    chunks = list(split_into_chunks(text, chunk_size=200, overlap=50))
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert chunks[0].split()[-1] in chunks[1]
+    assert chunks[-1].endswith("word399")
+
+
+def test_chunk_hash_identifies_content():
+    assert chunk_hash("same text") == chunk_hash("same text")
+    assert chunk_hash("same text") != chunk_hash("same text.")
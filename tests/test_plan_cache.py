@@ -0,0 +1,80 @@
+import pytest
+from plan_cache import PlanCache
+
+
+TASKS_SQL = """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE ("AssignedTo" = '3454' OR "AssignedBy" = '3454') AND "Status" NOT IN ('Inactive', 'Complete')"""
+APPROVALS_SQL = """SELECT DISTINCT "ApprovalName" FROM "ProjectApprovalsView" WHERE ("AssignedTo_One" = '3454' OR "AssignedTo_Two" = '3454' OR "AssignedTo_Three" = '3454' OR "AssignedBy" = '3454') AND "Status" NOT IN ('Inactive', 'Complete')"""
+OWNED_SQL = """SELECT "ProjectName" FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' AND "Status" NOT IN ('Inactive', 'Complete')"""
+ORG_SQL = """SELECT "ProjectName" FROM "ProjectOrgView" WHERE "OrgName" ILIKE '%Ministry of Artificial Intelligence%' AND "ProjectMemberID" = '3775'"""
+
+
+@pytest.mark.parametrize("question, sql", [
+    ("What tasks do I have?", TASKS_SQL),
+    ("What are my pending approvals?", APPROVALS_SQL),
+])
+def test_or_filtered_plan_is_reused_for_another_employee(question, sql):
+    cache = PlanCache()
+    assert cache.learn(question, sql, "3454")
+    plan = cache.lookup(question.lower(), "3775")
+    assert plan["params"] == {"emp_id": "3775"}
+    assert "'3454'" not in plan["sql"] and '"AssignedBy" = :emp_id' in plan["sql"]
+
+
+def test_plan_is_reused_for_another_employee():
+    cache = PlanCache()
+    assert cache.learn("What projects do I own?", OWNED_SQL, "3775")
+    plan = cache.lookup("what projects do I own", "3454")
+    assert plan["params"] == {"emp_id": "3454"}
+    assert ":emp_id" in plan["sql"] and "'3775'" not in plan["sql"] and "'Inactive'" in plan["sql"]
+
+
+def test_slot_value_is_rebound():
+    cache = PlanCache()
+    assert cache.learn("Which projects are under Ministry of Artificial Intelligence?", ORG_SQL, "3775")
+    plan = cache.lookup("Which projects are under Ministry of Health?", "3454")
+    assert plan["params"] == {"slot_0": "%Ministry of Health%", "emp_id": "3454"}
+
+
+@pytest.mark.parametrize("question", [
+    "What projects do I not own?",
+    "What completed projects do I own?",
+    "What projects do you own?",
+    "What projects do I own today?",
+    "projects do I own",
+    "Which projects are not under Ministry of Health?",
+    "Which completed projects are under Ministry of Health?",
+])
+def test_negated_or_modified_question_misses(question):
+    cache = PlanCache()
+    cache.learn("What projects do I own?", OWNED_SQL, "3775")
+    cache.learn("Which projects are under Ministry of Artificial Intelligence?", ORG_SQL, "3775")
+    assert cache.lookup(question, "3775") is None
+
+
+def test_unsafe_or_unfiltered_sql_is_not_learned():
+    cache = PlanCache()
+    assert not cache.learn("What projects are there?", 'SELECT "ProjectName" FROM "ProjectOrgView"', "3775")
+    assert not cache.learn("What projects do I own?", OWNED_SQL.replace("'3775'", "'3775' OR 1 = 1"), "3775")
+    assert not cache.learn("What tasks do I have?", TASKS_SQL.replace('"AssignedBy" = \'3454\'', '"Status" = \'Open\''), "3454")
+    assert not cache.learn("Who am I?", """SELECT * FROM "Employees" WHERE "EmployeeID" = '3775'""", "3775")
+    assert not cache.learn("Remove my projects", """DELETE FROM "ProjectOrgView" WHERE "EmployeeID" = '3775'""", "3775")
+    assert cache.get_stats()["rejected"] == 5
+
+
+def test_most_specific_plan_wins():
+    cache = PlanCache()
+    cache.learn("What tasks do I have under Ministry of Health?", TASKS_SQL.replace("AND", """AND "OrgName" ILIKE '%Ministry of Health%' AND""", 1), "3454")
+    cache.learn("What tasks do I have under Ministry of Health?", TASKS_SQL, "3454")
+    plan = cache.lookup("What tasks do I have under Ministry of Health?", "3454")
+    assert plan["params"] == {"emp_id": "3454"}
+
+
+def test_discard_and_eviction():
+    cache = PlanCache(max_items=1)
+    cache.learn("What projects do I own?", OWNED_SQL, "3775")
+    cache.learn("Which projects are under Ministry of Artificial Intelligence?", ORG_SQL, "3775")
+    assert cache.lookup("What projects do I own?", "3775") is None
+    plan = cache.lookup("Which projects are under Ministry of Artificial Intelligence?", "3775")
+    cache.discard(plan["key"])
+    stats = cache.get_stats()
+    assert stats["plans"] == 0 and stats["evictions"] == 1 and stats["failures"] == 1
@@ -0,0 +1,59 @@
+import time
+from sql_cache import SQLResultCache, normalize_sql, referenced_views
+
+
+TASKS_SQL = """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE ("AssignedTo" = '3454' OR "AssignedBy" = '3454')"""
+PROJECTS_SQL = """SELECT "ProjectName" FROM "ProjectOrgView" WHERE "ProjectMemberID" = '3454'"""
+
+
+def test_normalized_sql_shares_a_key():
+    assert normalize_sql('select  "TaskName"\nFROM X where "OrgName" = \'Zeus\';') == 'select "TaskName" from x where "OrgName" = \'Zeus\''
+    cache = SQLResultCache()
+    assert cache.make_key(TASKS_SQL + " ;", "3454") == cache.make_key(TASKS_SQL.replace("SELECT", "select"), "3454")
+    assert cache.make_key(TASKS_SQL, "3454") != cache.make_key(TASKS_SQL, "3775")
+
+
+def test_entry_lives_for_the_shortest_view_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = SQLResultCache(default_ttl=60, view_ttls={"ProjectTasksStreamsView": 10})
+    key = cache.make_key(TASKS_SQL + " UNION " + PROJECTS_SQL, "3454")
+    assert referenced_views(key[0]) == {"ProjectTasksStreamsView", "ProjectOrgView"}
+    cache.put(key, [("Review budget",)])
+    now[0] += 9
+    assert cache.get(key) == [("Review budget",)]
+    now[0] += 2
+    assert cache.get(key) is None
+    assert cache.get_stats()["expired"] == 1
+
+
+def test_zero_ttl_and_large_results_are_not_cached():
+    cache = SQLResultCache(view_ttls={"ProjectOrgView": 0}, max_rows=2)
+    cache.put(cache.make_key(PROJECTS_SQL, "3454"), [("Apollo",)])
+    cache.put(cache.make_key(TASKS_SQL, "3454"), [("a",), ("b",), ("c",)])
+    stats = cache.get_stats()
+    assert stats["entries"] == 0 and stats["too_large"] == 1
+
+
+def test_invalidate_by_view_and_employee():
+    cache = SQLResultCache()
+    for sql in (TASKS_SQL, PROJECTS_SQL):
+        for emp_id in ("3454", "3775"):
+            cache.put(cache.make_key(sql, emp_id), [(emp_id,)])
+    assert cache.invalidate(view="ProjectOrgView", emp_id="3454") == 1
+    assert cache.get(cache.make_key(PROJECTS_SQL, "3454")) is None
+    assert cache.get(cache.make_key(PROJECTS_SQL, "3775")) is not None
+    assert cache.invalidate(view="ProjectTasksStreamsView") == 2
+    assert cache.invalidate() == 1
+    assert cache.get_stats()["invalidated"] == 4
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SQLResultCache(max_entries=2)
+    keys = [cache.make_key(f'SELECT "ProjectName" FROM "ProjectOrgView" WHERE "ProjectID" = {i}', "3454") for i in range(3)]
+    cache.put(keys[0], [(0,)])
+    cache.put(keys[1], [(1,)])
+    cache.get(keys[0])
+    cache.put(keys[2], [(2,)])
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) == [(0,)]
+    assert cache.get_stats()["evictions"] == 1
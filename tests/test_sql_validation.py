@@ -0,0 +1,103 @@
+import pytest
+from sql_validation import validate_sql, check_emp_predicate, apply_limit, render_sql, SQLValidationError
+
+
+PROJECTS_SQL = """SELECT "ProjectName" FROM "ProjectOrgView" WHERE "OrgName" ILIKE '%Ministry of Artificial Intelligence%' AND "ProjectMemberID" = '3775'"""
+
+
+@pytest.mark.parametrize("sql", [
+    PROJECTS_SQL,
+    """WITH mine AS (SELECT * FROM "ProjectTasksStreamsView" WHERE "AssignedTo" = '3775') SELECT count(*) FROM mine""",
+    """SELECT t."TaskName" FROM "ProjectTasksStreamsView" t JOIN "ProjectOrgView" p ON p."ProjectID" = t."ProjectID" WHERE p."ProjectMemberID" = '3775'""",
+])
+def test_read_queries_over_the_views_are_valid(sql):
+    validate_sql(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    """DELETE FROM "ProjectOrgView" WHERE "ProjectMemberID" = '3775'""",
+    """SELECT * FROM "ProjectOrgView"; SELECT * FROM "ProjectRequestsView\"""",
+    """SELECT * FROM "Employees" WHERE "EmployeeID" = '3775'""",
+    "SELECT FROM WHERE",
+    """SELECT * FROM other."ProjectTasksStreamsView" WHERE "AssignedTo" = '3775'""",
+    """SELECT * FROM prod.public."ProjectTasksStreamsView" WHERE "AssignedTo" = '3775'""",
+    """WITH mine AS (SELECT * FROM "ProjectTasksStreamsView" WHERE "AssignedTo" = '3775') SELECT * FROM other.mine""",
+])
+def test_other_statements_are_rejected(sql):
+    with pytest.raises(SQLValidationError):
+        validate_sql(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    PROJECTS_SQL,
+    """SELECT * FROM "ProjectOrgView" WHERE '3775' = "EmployeeID\"""",
+    """SELECT * FROM "ProjectOrgView" WHERE ("EmployeeID" = '3775' AND "Status" <> 'Complete')""",
+    """SELECT * FROM "ProjectOrgView" WHERE "ProjectMemberID" IN ('3775')""",
+    """SELECT t."TaskName" FROM "ProjectTasksStreamsView" t JOIN "ProjectOrgView" p ON p."ProjectID" = t."ProjectID" WHERE p."ProjectMemberID" = '3775' AND t."AssignedTo" = '3775'""",
+    """WITH mine AS (SELECT * FROM "ProjectTasksStreamsView" WHERE "AssignedTo" = '3775') SELECT count(*) FROM mine""",
+    """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE "AssignedTo" = '3775' UNION SELECT "RequestSubject" FROM "ProjectRequestsView" WHERE "AssignedTo" = '3775'""",
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' AND "ProjectID" IN (SELECT "ProjectID" FROM "ProjectApprovalsView" WHERE "AssignedBy" = '3775')""",
+    """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE ("AssignedTo" = '3775' OR "AssignedBy" = '3775') AND "Status" NOT IN ('Inactive', 'Complete')""",
+    """SELECT distinct "RequestSubject" FROM "ProjectRequestsView" WHERE ("AssignedBy" = '3775' OR "AssignedTo" = '3775') AND "RequestStatus" NOT IN ('Inactive', 'Complete')""",
+    """SELECT DISTINCT "ApprovalName" FROM "ProjectApprovalsView" WHERE ("AssignedTo_One" = '3775' OR "AssignedTo_Two" = '3775' OR "AssignedTo_Three" = '3775' OR "AssignedBy" = '3775') AND "Status" NOT IN ('Inactive', 'Complete')""",
+    """SELECT t."TaskName" FROM "ProjectTasksStreamsView" t JOIN "ProjectOrgView" p ON p."ProjectID" = t."ProjectID" WHERE p."EmployeeID" = '3775' AND (t."AssignedTo" = '3775' OR t."AssignedBy" = '3775')""",
+    """SELECT "TaskName" FROM public."ProjectTasksStreamsView" WHERE "AssignedTo" = '3775'""",
+])
+def test_filtered_queries_pass(sql):
+    check_emp_predicate(validate_sql(sql), "3775")
+
+
+@pytest.mark.parametrize("sql", [
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' OR 1 = 1""",
+    """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE ("AssignedTo" = '3775' OR "Status" = 'Open')""",
+    """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE ("AssignedTo" = '3775' OR "AssignedBy" = '3454')""",
+    """SELECT "TaskName" FROM "ProjectTasksStreamsView" WHERE ("AssignedTo" = '3775' OR "TaskName" = '3775')""",
+    """SELECT t."TaskName" FROM "ProjectTasksStreamsView" t JOIN "ProjectOrgView" p ON p."ProjectID" = t."ProjectID" WHERE (t."AssignedTo" = '3775' OR p."EmployeeID" = '3775')""",
+    """SELECT * FROM "ProjectOrgView" WHERE NOT "EmployeeID" = '3775'""",
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" IN ('3775', '3454')""",
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' UNION SELECT * FROM "ProjectOrgView\"""",
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' INTERSECT SELECT * FROM "ProjectOrgView\"""",
+    """SELECT t."TaskName" FROM "ProjectTasksStreamsView" t JOIN "ProjectOrgView" p ON p."ProjectID" = t."ProjectID" WHERE p."ProjectMemberID" = '3775'""",
+    """WITH everyone AS (SELECT * FROM "ProjectOrgView") SELECT * FROM everyone WHERE "EmployeeID" = '3775'""",
+    """SELECT * FROM (SELECT * FROM "ProjectOrgView") s WHERE s."EmployeeID" = '3775'""",
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' AND "ProjectID" IN (SELECT "ProjectID" FROM "ProjectApprovalsView")""",
+    """SELECT "EmployeeID" FROM "ProjectOrgView" GROUP BY "EmployeeID" HAVING "EmployeeID" = '3775'""",
+])
+def test_unfiltered_branches_are_rejected(sql):
+    with pytest.raises(SQLValidationError):
+        check_emp_predicate(validate_sql(sql), "3775")
+
+
+@pytest.mark.parametrize("sql", [
+    """SELECT pg_sleep(10) FROM "ProjectOrgView" WHERE "EmployeeID" = '3775'""",
+    """SELECT * FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' AND dblink('x', 'y') IS NULL""",
+])
+def test_functions_outside_the_allowlist_are_rejected(sql):
+    with pytest.raises(SQLValidationError):
+        validate_sql(sql)
+
+
+def test_common_functions_are_allowed():
+    validate_sql(
+        """SELECT count(*), lower("ProjectName"), date_trunc('day', "CreatedAt"), coalesce("Status", 'none') """
+        """FROM "ProjectOrgView" WHERE "EmployeeID" = '3775' AND "CreatedAt" > now() - interval '7 days' GROUP BY 2, 3, 4"""
+    )
+
+
+def test_query_must_filter_on_the_employee():
+    check_emp_predicate(validate_sql(PROJECTS_SQL), "3775")
+    with pytest.raises(SQLValidationError):
+        check_emp_predicate(validate_sql(PROJECTS_SQL), "3454")
+    with pytest.raises(SQLValidationError):
+        check_emp_predicate(validate_sql("""SELECT "ProjectName" FROM "ProjectOrgView\""""), "3775")
+
+
+def test_apply_limit_caps_rows():
+    assert "LIMIT 100" in apply_limit(validate_sql(PROJECTS_SQL), 100).sql()
+    assert "LIMIT 100" in apply_limit(validate_sql(PROJECTS_SQL + " LIMIT 5000"), 100).sql()
+    assert "LIMIT 5" in apply_limit(validate_sql(PROJECTS_SQL + " LIMIT 5"), 100).sql()
+
+
+def test_render_sql_uses_named_binds():
+    statement = validate_sql("""SELECT "ProjectName" FROM "ProjectOrgView" WHERE "ProjectMemberID" = %(emp_id)s""")
+    assert '"ProjectMemberID" = :emp_id' in render_sql(statement)
@@ -0,0 +1,101 @@
+import asyncio
+from pymongo.errors import BulkWriteError
+from write_behind import WriteBehindQueue, DUPLICATE_KEY
+
+
+class FakeCollection:
+    """Records bulk writes; `failures` holds the exceptions raised by the next calls."""
+
+    def __init__(self):
+        self.written = []
+        self.failures = []
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, BulkWriteError): # the writes before the failed one are stored
+                self.written.extend(operations[:failure.details["writeErrors"][0]["index"]])
+            raise failure
+        self.written.extend(operations)
+
+
+def test_ack_mode_writes_right_away():
+    messages = FakeCollection()
+    queue = WriteBehindQueue({"messages": messages})
+    asyncio.run(queue.write("messages", "s1", "insert"))
+    assert messages.written == ["insert"] and queue.queue_depth() == 0
+
+
+def test_flush_keeps_the_order_within_a_session():
+    sessions, messages = FakeCollection(), FakeCollection()
+    queue = WriteBehindQueue({"sessions": sessions, "messages": messages}, durability="write_behind")
+    for i in range(3):
+        for session_id in ("b", "a"):
+            asyncio.run(queue.write("messages", session_id, f"{session_id}{i}", {"content": f"{session_id}{i}"}))
+    asyncio.run(queue.write("sessions", "a", "touch a"))
+    assert [m["content"] for m in queue.pending_messages("a")] == ["a0", "a1", "a2"]
+    assert asyncio.run(queue.flush())
+    assert messages.written == ["a0", "a1", "a2", "b0", "b1", "b2"]
+    assert sessions.written == ["touch a"]
+    assert queue.pending_messages("a") == [] and queue.get_stats()["flushes"] == 1
+
+
+def test_failed_flush_is_requeued_ahead_of_newer_writes():
+    messages = FakeCollection()
+    queue = WriteBehindQueue({"messages": messages}, durability="write_behind")
+    messages.failures.append(ConnectionError("down"))
+    asyncio.run(queue.write("messages", "s1", "m1", {"content": "m1"}))
+    assert not asyncio.run(queue.flush())
+    assert [m["content"] for m in queue.pending_messages("s1")] == ["m1"]
+    asyncio.run(queue.write("messages", "s1", "m2", {"content": "m2"}))
+    assert asyncio.run(queue.flush())
+    assert messages.written == ["m1", "m2"]
+    assert queue.get_stats()["retries"] == 1 and queue.get_stats()["failed_writes"] == 0
+
+
+def test_bulk_write_error_drops_only_the_failed_write():
+    messages = FakeCollection()
+    queue = WriteBehindQueue({"messages": messages}, durability="write_behind")
+    # m2 was stored by an interrupted flush, m4 is rejected by the server
+    messages.failures += [
+        BulkWriteError({"writeErrors": [{"index": 1, "code": DUPLICATE_KEY, "errmsg": "duplicate key"}]}),
+        BulkWriteError({"writeErrors": [{"index": 1, "code": 121, "errmsg": "validation failed"}]}),
+    ]
+    for i in range(1, 6):
+        asyncio.run(queue.write("messages", "s1", f"m{i}"))
+    assert not asyncio.run(queue.flush())
+    assert not asyncio.run(queue.flush())
+    assert asyncio.run(queue.flush())
+    assert messages.written == ["m1", "m3", "m5"]
+    assert queue.get_stats()["failed_writes"] == 1
+
+
+def test_new_session_is_forgotten_once_stored():
+    sessions = FakeCollection()
+    queue = WriteBehindQueue({"sessions": sessions}, durability="write_behind")
+    queue.new_sessions["s1"] = "3775"
+    sessions.failures.append(ConnectionError("down"))
+    asyncio.run(queue.write("sessions", "s1", "insert s1"))
+    asyncio.run(queue.flush())
+    assert queue.new_sessions == {"s1": "3775"}
+    asyncio.run(queue.flush())
+    assert queue.new_sessions == {}
+
+
+async def write_with_background_flush(queue, messages):
+    queue.start()
+    await queue.write("messages", "s1", "m1")
+    await queue.write("messages", "s1", "m2") # a full batch flushes without waiting
+    for _ in range(10):
+        await asyncio.sleep(0)
+    flushed = list(messages.written)
+    await queue.write("messages", "s1", "m3")
+    await queue.close()
+    return flushed
+
+
+def test_background_task_flushes_full_batches_and_close_drains():
+    messages = FakeCollection()
+    queue = WriteBehindQueue({"messages": messages}, durability="write_behind", max_batch=2, max_wait_ms=10_000)
+    assert asyncio.run(write_with_background_flush(queue, messages)) == ["m1", "m2"]
+    assert messages.written == ["m1", "m2", "m3"] and queue.queue_depth() == 0
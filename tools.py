@@ -1,51 +1,85 @@
-from azure.storage.blob import BlobServiceClient
 from operator import itemgetter
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools.render import render_text_description
-from functions import load_faiss_data_from_npy, search_vector_store, generate_response, get_response, llm, create_agent 
+from functions import get_openai_embedding, search_chunk_ids, generate_response, generate_response_stream, get_response, get_response_stream, get_template_response
 from langchain_core.tools import tool
 from config import config as config
 from langchain_core.output_parsers import JsonOutputParser
-from database.__init__ import get_conn, conn_mongodb
-from pymongo import MongoClient
+from request_context import current_emp_id
+from resources import resources
+from settings import get_setting
+from answer_cache import SemanticAnswerCache
+from speculative_retrieval import SpeculativeRetrieval
+from intent_router import route_locally, log_decision
+from tracing import span, TracingCallbackHandler
+from metrics import TOOL_CALLS, register_stats
+from pydantic import BaseModel, Field
+from typing import Literal
+import time, json, logging
+from contextvars import ContextVar
 
-# Load configuration
-storage_string = config["BLOB-STORAGE-STRING"]["STRING"]
-blob_service_client = BlobServiceClient.from_connection_string(storage_string)
-container_name = "day-chatbot-file" 
-connection_string = config["BLOB-STORAGE-STRING"]["STRING"]  
+logger = logging.getLogger(__name__)
 
-# faiss_data = load_faiss_data_from_npy(container_name, storage_string) # load data from azure blob storage
-directory_path = "C:/Users/mmurtuza001/chatbot new pdf/"
-faiss_data = load_faiss_data_from_npy(directory_path)
+answer_cache = SemanticAnswerCache( # answers to repeated navigation questions
+    threshold=get_setting("ANSWER-CACHE", "SIMILARITY_THRESHOLD", 0.95, float),
+    ttl_seconds=get_setting("ANSWER-CACHE", "TTL_SECONDS", 3600, float),
+    max_items=get_setting("ANSWER-CACHE", "MAX_ITEMS", 1000, int)
+)
 
-emp_id_storage = {} #emp_id storage
-db= get_conn() # Connect to database
-agent = create_agent(db, llm) # Create agent for language model
-collection = conn_mongodb() # Connect to MongoDB collection
+register_stats("answer_cache", answer_cache)
+
+# Vector retrieval started on the raw question while the router decides (ROUTER / SPECULATIVE_RETRIEVAL)
+speculative_retrieval = SpeculativeRetrieval(
+    min_similarity=get_setting("ROUTER", "SPECULATION_MIN_SIMILARITY", 0.9, float)
+)
+register_stats("speculative_retrieval", speculative_retrieval)
+prefetched_retrieval = ContextVar("prefetched_retrieval", default=None) # (query, (faiss_data, embedding, chunk_ids))
+
+
+async def retrieve_chunks(faiss_data, query, k=3):
+    """Embeds the query and returns its embedding with the ids of the k nearest chunks."""
+    with span("retrieve_chunks", k=k):
+        query_embedding = await get_openai_embedding(query)
+        with span("search_vector_store", index_version=faiss_data["version"]):
+            chunk_ids = search_chunk_ids(faiss_data, query_embedding, k)
+    return query_embedding, chunk_ids
+
+
+async def retrieve(query):
+    """Retrieves the chunks of a query, reusing the speculative retrieval of this turn when there is one."""
+    prefetched = prefetched_retrieval.get()
+    if prefetched is not None and prefetched[0] == query:
+        return prefetched[1]
+    faiss_data = await resources.get("faiss_data")
+    query_embedding, chunk_ids = await retrieve_chunks(faiss_data, query)
+    return faiss_data, query_embedding, chunk_ids
 
 
 @tool
-def handle_vector_query(query:str): 
+async def handle_vector_query(query:str): 
     """this tool helps users guide themselves through the website by helping them find solutions for creating projects, tasks etc or for navigating through the website. Also it can be used for greeting."""
     try:
-        top_k_texts = search_vector_store(faiss_data["index"], faiss_data["texts"], query, k=3)
-        context = " ".join(top_k_texts)
-        print(query)
-        answer =  generate_response(query, context)
+        faiss_data, query_embedding, chunk_ids = await retrieve(query)
+        cached_answer = answer_cache.lookup(query_embedding, chunk_ids, faiss_data["version"])
+        if cached_answer is not None:
+            return cached_answer
+
+        context = " ".join(faiss_data["texts"][i] for i in chunk_ids)
+        answer = await generate_response(query, context)
+        answer_cache.store(query_embedding, chunk_ids, answer, faiss_data["version"])
         return answer
     except Exception as e:
         raise RuntimeError(status_code=500, detail=f"Error processing request: {e}")
 
 
 @tool
-def handle_sql_query(query: str):
+async def handle_sql_query(query: str):
     """ this tool helps with specific user queries on tasks, projects, streams, approvals etc"""
     try:
-        emp_id = emp_id_storage.get('emp_id')
-        print(emp_id)
-        # emp_id = emp_id_storage.get('emp_id')
-        response = get_response(agent, query, emp_id)
+        emp_id = current_emp_id.get()
+        response = await get_template_response(query, emp_id)
+        if response is None:
+            response = await get_response(await resources.get("agent"), query, emp_id)
 
         return  response
     except Exception as e:
@@ -55,6 +89,103 @@ def handle_sql_query(query: str):
 tools = [handle_vector_query, handle_sql_query]
 
 
+async def stream_vector_query(query):
+    """Streaming counterpart of handle_vector_query, yields the answer token by token."""
+    faiss_data, query_embedding, chunk_ids = await retrieve(query)
+    cached_answer = answer_cache.lookup(query_embedding, chunk_ids, faiss_data["version"])
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    context = " ".join(faiss_data["texts"][i] for i in chunk_ids)
+    answer = ""
+    async for token in generate_response_stream(query, context):
+        answer += token
+        yield token
+    answer_cache.store(query_embedding, chunk_ids, answer.strip(), faiss_data["version"])
+
+
+async def stream_sql_query(query):
+    """Streaming counterpart of handle_sql_query, yields the agent's final answer token by token."""
+    answer = await get_template_response(query, current_emp_id.get())
+    if answer is not None:
+        yield answer
+        return
+    async for token in get_response_stream(await resources.get("agent"), query, current_emp_id.get()):
+        yield token
+
+
+stream_map = {
+    handle_vector_query.name: stream_vector_query,
+    handle_sql_query.name: stream_sql_query,
+}
+
+
+# Prompts are built once at import and chains once per worker instead of on every question
+contextualize_q_system_prompt = (
+    "Given a chat history and the latest user question "
+    "which might reference context in the chat history, "
+    "formulate a standalone question which can be understood "
+    "without the chat history. Do NOT answer the question, "
+    "just reformulate it if needed and otherwise return it as is."
+)
+
+contextualize_q_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", contextualize_q_system_prompt),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ]
+)
+
+
+# Render tools description
+rendered_tools = render_text_description(tools)
+routing_system_prompt = f"""You are an assistant that has access to the following set of tools. Here are the names and descriptions for each tool:
+
+    {rendered_tools}
+
+    Given the user input, return the name and input of the tool to use. Return your response as a JSON blob with 'name' and 'arguments' keys."""
+
+routing_prompt = ChatPromptTemplate.from_messages(
+    [("system", routing_system_prompt), ("user", "{input}")]
+)
+
+
+
+class RoutedQuestion(BaseModel):
+    """Standalone version of the user's latest question and the tool that should answer it."""
+
+    standalone_question: str = Field(description="The latest user question rewritten so it can be understood without the chat history")
+    tool: Literal["handle_vector_query", "handle_sql_query"] = Field(description="Name of the tool that should answer the standalone question")
+
+
+rewrite_and_route_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", contextualize_q_system_prompt + "\n\nThen choose the tool that should answer the standalone question. "
+            "Here are the names and descriptions for each tool:\n\n" + rendered_tools),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ]
+)
+
+def build_chains(llm):
+    """
+    Builds the rewrite and routing chains once for the shared language model.
+
+    Args:
+    - llm: Language model of the worker.
+
+    Returns:
+    - dict: The "contextualize_q", "routing" and "rewrite_and_route" chains.
+    """
+    return {
+        "contextualize_q": contextualize_q_prompt | llm,
+        "routing": routing_prompt | llm | JsonOutputParser(),
+        "rewrite_and_route": rewrite_and_route_prompt | llm.with_structured_output(RoutedQuestion),
+    }
+
+
 def tool_chain(model_output):
     """
     Function to choose and invoke the appropriate tool based on model output.
@@ -69,76 +200,168 @@ def tool_chain(model_output):
     chosen_tool = tool_map[model_output["name"]]
     return itemgetter("arguments") | chosen_tool
 
-def get_last_n_messages(emp_id, session_id, n=5):
-    
-    # Find the chat history for the emp_id and session_id and limit to last n messages
-    chat_history = collection.find_one(
-        {"emp_id": emp_id, "sessions.session_id": session_id},
-        {"sessions.$": 1}
+async def get_last_n_messages(emp_id, session_id, n=5):
+    """Returns the last n messages of a session, oldest first."""
+    return await resources.chat_store.last_messages(session_id, n)
+
+async def select_tool(query, emp_id, session_id, last_messages=None):
+    """
+    Function to reformulate the user input with the chat history and pick a tool.
+
+    With ROUTER / MODE "combined" a session with history costs a single structured-output
+    call that returns both the standalone question and the tool. Otherwise the question is
+    rewritten (only when there is history) and routed by the local rules or the routing
+    chain. Stage latencies are logged for both modes.
+
+    Args:
+    - query (str): User input query.
+    - emp_id (str): Employee ID for context (stored for the SQL tool).
+    - session_id (str): Session ID whose history is used for the reformulation.
+    - last_messages (list, optional): History already loaded by the caller; read from the
+      session when None.
+
+    Returns:
+    - dict: Model output with the chosen tool 'name' and its 'arguments'.
+    """
+    current_emp_id.set(emp_id)
+    mode = get_setting("ROUTER", "MODE", "two_step")
+    stages_ms = {}
+
+    started = time.perf_counter()
+    if last_messages is None:
+        with span("load_history"):
+            last_messages = await get_last_n_messages(emp_id, session_id, n=6)
+    # the current question has already been stored, it is not part of the history
+    if last_messages and last_messages[-1]["role"] == "user" and last_messages[-1]["content"] == query:
+        last_messages = last_messages[:-1]
+    chat_history = [(msg["role"], msg["content"]) for msg in last_messages[-5:]]
+    stages_ms["history"] = (time.perf_counter() - started) * 1000
+
+    if chat_history and mode == "combined":
+        started = time.perf_counter()
+        with span("rewrite_and_route"):
+            routed = await resources.chains["rewrite_and_route"].ainvoke(
+                {"input": query, "chat_history": chat_history}, config={"callbacks": [TracingCallbackHandler()]}
+            )
+        stages_ms["rewrite_and_route"] = (time.perf_counter() - started) * 1000
+        log_stages(mode, stages_ms)
+        log_decision(routed.standalone_question, "combined", routed.tool, 1.0, {})
+        return {"name": routed.tool, "arguments": {"query": routed.standalone_question}}
+
+    standalone_query = query
+    if chat_history:
+        # Reformulate the query
+        started = time.perf_counter()
+        with span("rewrite"):
+            reformulated_query = await resources.chains["contextualize_q"].ainvoke(
+                {"input": query, "chat_history": chat_history}, config={"callbacks": [TracingCallbackHandler()]}
+            )
+        standalone_query = reformulated_query.content
+        stages_ms["rewrite"] = (time.perf_counter() - started) * 1000
+
+    # Clear-cut questions are routed by local rules, saving the routing LLM call
+    local_tool, confidence, scores = route_locally(
+        standalone_query,
+        confidence_threshold=get_setting("ROUTER", "CONFIDENCE_THRESHOLD", 0.75, float),
+        min_score=get_setting("ROUTER", "MIN_SCORE", 2, int)
     )
-    
-    if chat_history and "sessions" in chat_history:
-        messages = chat_history["sessions"][0]["messages"]
-        return messages[-n:]  # Get the last n messages
-    
-    return []
+    if local_tool and get_setting("ROUTER", "LOCAL_ENABLED", True, bool):
+        log_stages(mode, stages_ms)
+        log_decision(standalone_query, "local", local_tool, confidence, scores)
+        return {"name": local_tool, "arguments": {"query": standalone_query}}
+
+    started = time.perf_counter()
+    with span("route"):
+        model_output = await resources.chains["routing"].ainvoke({"input": standalone_query}, config={"callbacks": [TracingCallbackHandler()]})
+    stages_ms["route"] = (time.perf_counter() - started) * 1000
+    log_stages(mode, stages_ms)
+    log_decision(standalone_query, "llm", model_output.get("name"), confidence, scores, local_guess=local_tool)
+    return model_output
+
+
+def log_stages(mode, stages_ms):
+    """Logs the latency of each routing stage so both routing modes can be compared."""
+    logger.info(json.dumps({
+        "event": "routing_latency",
+        "mode": mode,
+        "stages_ms": {stage: round(ms, 1) for stage, ms in stages_ms.items()},
+        "total_ms": round(sum(stages_ms.values()), 1),
+    }))
 
-def call_tools(query, emp_id, session_id):
+
+def tool_query_of(model_output):
+    arguments = model_output["arguments"]
+    return arguments["query"] if isinstance(arguments, dict) else arguments
+
+
+async def select_tool_speculatively(query, emp_id, session_id, last_messages=None):
+    """
+    Picks the tool like select_tool. With ROUTER / SPECULATIVE_RETRIEVAL the vector
+    retrieval of the raw question runs meanwhile; if the vector tool is picked for a
+    close enough question, its result is handed to the tool through `prefetched_retrieval`.
+    """
+    if not get_setting("ROUTER", "SPECULATIVE_RETRIEVAL", False, bool):
+        return await select_tool(query, emp_id, session_id, last_messages)
+
+    speculation = speculative_retrieval.start(retrieve, query)
+    try:
+        model_output = await select_tool(query, emp_id, session_id, last_messages)
+    except BaseException:
+        speculation["task"].cancel()
+        raise
+    tool_query = tool_query_of(model_output)
+    with span("speculative_retrieval") as current:
+        result = await speculative_retrieval.resolve(speculation, model_output["name"] == handle_vector_query.name, tool_query)
+        current.set(used=result is not None)
+    if result is not None:
+        prefetched_retrieval.set((tool_query, result))
+    return model_output
+
+
+async def call_tools(query, emp_id, session_id, last_messages=None):
     """
     Function to call tools asynchronously based on user input.
 
     Args:
     - query (str): User input query.
     - emp_id (str): Employee ID for context (stored globally).
+    - session_id (str): Session ID whose history is used for the reformulation.
+    - last_messages (list, optional): History already loaded by the caller.
 
     Returns:
     - dict: Final response generated by the tool chain.
     """
     try:
+        with span("call_tools") as current:
+            model_output = await select_tool_speculatively(query, emp_id, session_id, last_messages)
+            current.set(tool=model_output["name"])
+            TOOL_CALLS.labels(model_output["name"]).inc()
+            with span(f"tool.{model_output['name']}"):
+                final_response = await tool_chain(model_output).ainvoke(model_output)
         
-        emp_id_storage['emp_id'] = emp_id
-
-        last_messages = get_last_n_messages(emp_id, session_id, n=5)
-        chat_history = [(msg["type"], msg["content"]) for msg in last_messages]
-
-        contextualize_q_system_prompt = (
-            "Given a chat history and the latest user question "
-            "which might reference context in the chat history, "
-            "formulate a standalone question which can be understood "
-            "without the chat history. Do NOT answer the question, "
-            "just reformulate it if needed and otherwise return it as is."
-        )
-        
-        contextualize_q_prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", contextualize_q_system_prompt),
-                MessagesPlaceholder("chat_history"),
-                ("human", "{input}"),
-            ]
-        )
+        return final_response
+    
+    except Exception as e:
+        raise RuntimeError(f"Error processing request: {str(e)}")
 
-        contextualize_q_chain = contextualize_q_prompt | llm
 
-        # Reformulate the query
-        reformulated_query = contextualize_q_chain.invoke(
-            {"input": query, "chat_history": chat_history}
-        )
-        # Render tools description
-        rendered_tools = render_text_description(tools)
-        system_prompt = f"""You are an assistant that has access to the following set of tools. Here are the names and descriptions for each tool:
+async def stream_tools(query, emp_id, session_id, last_messages=None):
+    """
+    Function to stream the answer of the chosen tool based on user input.
 
-        {rendered_tools}
+    Args:
+    - query (str): User input query.
+    - emp_id (str): Employee ID for context.
+    - session_id (str): Session ID whose history is used for the reformulation.
+    - last_messages (list, optional): History already loaded by the caller.
 
-        Given the user input, return the name and input of the tool to use. Return your response as a JSON blob with 'name' and 'arguments' keys."""
-        
-        prompt = ChatPromptTemplate.from_messages(
-            [("system", system_prompt), ("user", "{input}")]
-        )
-        
-        chain = prompt | llm | JsonOutputParser() | tool_chain
-        final_response = chain.invoke(reformulated_query)
-        
-        return final_response
-    
-    except Exception as e:
-        raise RuntimeError(f"Error processing request: {str(e)}")
\ No newline at end of file
+    Yields:
+    - str: Answer tokens as they are produced by the chosen tool.
+    """
+    with span("stream_tools") as current:
+        model_output = await select_tool_speculatively(query, emp_id, session_id, last_messages)
+        current.set(tool=model_output["name"])
+        TOOL_CALLS.labels(model_output["name"]).inc()
+        tool_query = tool_query_of(model_output)
+        async for token in stream_map[model_output["name"]](tool_query):
+            yield token
@@ -0,0 +1,186 @@
+import time, json, uuid, logging, contextlib
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from request_context import current_request_id
+from settings import get_setting
+
+
+# Spans are written as one JSON log record each, with OpenTelemetry field names, so they
+# can be shipped as-is or converted by a collector. The request id is the trace id.
+logger = logging.getLogger("tracing")
+current_span = ContextVar("current_span", default=None)
+TRACING_ENABLED = get_setting("TRACING", "ENABLED", True, bool)
+span_listeners = [] # called with (name, duration in seconds, status, attributes) for every finished span
+
+
+def new_id(length=16):
+    return uuid.uuid4().hex[:length]
+
+
+def export_span(name, span_id, parent_id, start_ns, end_ns, status, attributes):
+    """Passes one finished span to the listeners and writes it as a JSON log record."""
+    for listener in span_listeners:
+        listener(name, (end_ns - start_ns) / 1e9, status, attributes)
+    if not TRACING_ENABLED:
+        return
+    logger.info(json.dumps({
+        "event": "span",
+        "trace_id": current_request_id.get(),
+        "span_id": span_id,
+        "parent_span_id": parent_id,
+        "name": name,
+        "start_time_unix_nano": start_ns,
+        "end_time_unix_nano": end_ns,
+        "duration_ms": round((end_ns - start_ns) / 1e6, 2),
+        "status": status,
+        "attributes": attributes,
+    }, default=str))
+
+
+class Span:
+    """A timed unit of work; attributes can be added while it is open."""
+
+    def __init__(self, name, attributes):
+        parent = current_span.get()
+        self.name = name
+        self.span_id = new_id()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        export_span(self.name, self.span_id, self.parent_id, self.start_ns, time.time_ns(), self.status, self.attributes)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a span nested under the current one.
+
+    Args:
+    - name (str): Span name, e.g. "call_tools" or "mongo.update_one".
+    - **attributes: Initial span attributes.
+
+    Yields:
+    - Span: The open span, to add attributes such as token counts.
+    """
+    current = Span(name, attributes)
+    token = current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "ERROR"
+        current.set(error=repr(e))
+        raise
+    finally:
+        try:
+            current_span.reset(token)
+        except ValueError:
+            # closed from another context, e.g. a streaming generator finished elsewhere
+            pass
+        current.end()
+
+
+def record_usage(current, usage):
+    """Adds the token counts of an OpenAI response usage object to a span."""
+    if usage is not None:
+        current.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler turning model calls and tool runs into spans.
+
+    One handler is created per call so it can also count the agent iterations of that call.
+    """
+
+    def __init__(self):
+        self.runs = {}
+        self.agent_iterations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def start(self, run_id, name, attributes):
+        parent = current_span.get()
+        self.runs[run_id] = {
+            "name": name,
+            "span_id": new_id(),
+            "parent_id": parent.span_id if parent else None,
+            "start_ns": time.time_ns(),
+            "attributes": attributes,
+        }
+
+    def finish(self, run_id, status="OK", **attributes):
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        run["attributes"].update(attributes)
+        export_span(run["name"], run["span_id"], run["parent_id"], run["start_ns"], time.time_ns(), status, run["attributes"])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.start(run_id, "llm", {"model": (kwargs.get("metadata") or {}).get("ls_model_name")})
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.start(run_id, "llm", {"model": (kwargs.get("metadata") or {}).get("ls_model_name")})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage and response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], "message", None)
+            metadata = getattr(message, "usage_metadata", None) or {}
+            usage = {"prompt_tokens": metadata.get("input_tokens"), "completion_tokens": metadata.get("output_tokens")}
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+        self.finish(run_id, prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.finish(run_id, "ERROR", error=repr(error))
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.start(run_id, f"tool.{serialized.get('name')}", {"input": input_str})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.finish(run_id, "ERROR", error=repr(error))
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        self.agent_iterations += 1
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware giving every HTTP request a request id and a root span.
+
+    The id is taken from the X-Request-ID header when present, stored in
+    `request_context.current_request_id` for the whole call chain and echoed back.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or uuid.uuid4().hex
+        token = current_request_id.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            with span(f"{scope['method']} {scope['path']}", kind="server") as root:
+                await self.app(scope, receive, send_with_request_id)
+                root.set(route=scope.get("route").path if scope.get("route") else scope["path"])
+        finally:
+            current_request_id.reset(token)
@@ -0,0 +1,465 @@
+import os, json, hashlib, datetime, argparse, time
+import numpy as np
+import faiss
+
+
+BUNDLE_FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+INDEX_FILE = "index.faiss"
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+METADATA_FILE = "metadata.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# Memory-map the index codes instead of reading them into private memory, so every
+# worker on the host shares the same page-cached copy of the vectors.
+MMAP_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT, "cosine": faiss.METRIC_INNER_PRODUCT}
+
+
+class TextStore:
+    """
+    Read-only, memory-mapped store of chunk texts addressed by their position in the index.
+
+    The texts are kept as one UTF-8 blob plus an offsets array, so opening the store costs
+    nothing and a lookup only touches the pages of the requested chunk.
+    """
+
+    def __init__(self, directory):
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+        texts_path = os.path.join(directory, TEXTS_FILE)
+        if os.path.getsize(texts_path):
+            self.data = np.memmap(texts_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.data[start:end]).decode("utf-8")
+
+
+def prepare_vectors(vectors, metric):
+    """
+    Converts vectors to contiguous float32 and L2-normalizes them for the cosine metric.
+
+    Args:
+    - vectors (np.ndarray): Vectors of shape (n, dim).
+    - metric (str): One of "l2", "ip" or "cosine".
+
+    Returns:
+    - np.ndarray: Vectors ready to be added to or searched in the index.
+    """
+    vectors = np.array(vectors, dtype="float32", order="C", copy=True)
+    if metric == "cosine":
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def default_nlist(count):
+    """Picks a number of IVF lists that keeps at least ~39 training points per centroid."""
+    return max(1, min(int(4 * np.sqrt(count)), count // 39))
+
+
+def build_index(vectors, index_type="flat", metric="l2", nlist=None, pq_m=16, pq_nbits=8, hnsw_m=32, ef_construction=200):
+    """
+    Builds and, where required, trains a FAISS index of the given type.
+
+    Args:
+    - vectors (np.ndarray): Vectors prepared with `prepare_vectors`, shape (n, dim).
+    - index_type (str, optional): One of "flat", "ivf_flat", "ivf_pq" or "hnsw". Defaults to "flat".
+    - metric (str, optional): One of "l2", "ip" or "cosine". Defaults to "l2".
+    - nlist (int, optional): Number of IVF lists. Defaults to `default_nlist(n)`.
+    - pq_m (int, optional): Number of PQ sub-quantizers, must divide dim. Defaults to 16.
+    - pq_nbits (int, optional): Bits per PQ code. Defaults to 8.
+    - hnsw_m (int, optional): HNSW neighbours per node. Defaults to 32.
+    - ef_construction (int, optional): HNSW build-time search depth. Defaults to 200.
+
+    Returns:
+    - tuple: The populated index and the build parameters that were used.
+
+    Raises:
+    - ValueError: If the index type or metric is unknown or the parameters do not fit the data.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {tuple(METRICS)}")
+    count, dim = vectors.shape
+    faiss_metric = METRICS[metric]
+    params = {}
+
+    if index_type == "flat":
+        index = faiss.IndexFlat(dim, faiss_metric)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss_metric)
+        index.hnsw.efConstruction = ef_construction
+        params = {"hnsw_m": hnsw_m, "ef_construction": ef_construction}
+    else:
+        nlist = nlist or default_nlist(count)
+        if count < nlist:
+            raise ValueError(f"IVF index needs at least nlist={nlist} vectors, got {count}")
+        quantizer = faiss.IndexFlat(dim, faiss_metric)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss_metric)
+            params = {"nlist": nlist}
+        else:
+            if dim % pq_m:
+                raise ValueError(f"pq_m={pq_m} must divide the vector dimension {dim}")
+            if count < 2 ** pq_nbits:
+                raise ValueError(f"IVF-PQ with pq_nbits={pq_nbits} needs at least {2 ** pq_nbits} vectors, got {count}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, faiss_metric)
+            params = {"nlist": nlist, "pq_m": pq_m, "pq_nbits": pq_nbits}
+        index.train(vectors)
+
+    index.add(vectors)
+    return index, params
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """
+    Applies search-time parameters; options that do not apply to the index type are ignored.
+
+    Args:
+    - index: FAISS index.
+    - nprobe (int, optional): IVF lists visited per query.
+    - ef_search (int, optional): HNSW search depth.
+    """
+    parameter_space = faiss.ParameterSpace()
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        parameter_space.set_index_parameter(index, "nprobe", int(nprobe))
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        parameter_space.set_index_parameter(index, "efSearch", int(ef_search))
+
+
+def search_index(bundle, query_vectors, k):
+    """
+    Searches a loaded bundle, applying the metric's query preprocessing. Used by the
+    chatbot's retrieval and by `benchmark_indexes`.
+
+    Args:
+    - bundle (dict): Bundle returned by `load_index_bundle`, or any dict with the
+      `index` and a `manifest` holding its `metric`.
+    - query_vectors (np.ndarray): Query vectors, shape (q, dim).
+    - k (int): Number of nearest neighbours to retrieve.
+
+    Returns:
+    - tuple: Distances and ids arrays of shape (q, k); missing neighbours have id -1.
+    """
+    queries = prepare_vectors(query_vectors, bundle["manifest"]["metric"])
+    return bundle["index"].search(queries, k)
+
+
+def write_texts(directory, texts):
+    """
+    Writes chunk texts as a UTF-8 blob with an int64 offsets array.
+
+    Args:
+    - directory (str): Bundle version directory.
+    - texts (iterable): Chunk texts in index order.
+    """
+    offsets = [0]
+    with open(os.path.join(directory, TEXTS_FILE), "wb") as f:
+        for text in texts:
+            encoded = str(text).encode("utf-8")
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    np.save(os.path.join(directory, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+
+
+def write_bundle(root, vectors, texts, metadata=None, index_type="flat", metric="l2", search_params=None, **index_params):
+    """
+    Writes a new version of the index bundle and publishes it as the current one.
+
+    Layout of `<root>/<version>/`: `index.faiss` (serialized FAISS index), `texts.bin` and
+    `offsets.npy` (text store), `metadata.jsonl` (one JSON object per chunk) and
+    `manifest.json`. `<root>/CURRENT` names the version loaders open.
+
+    Args:
+    - root (str): Directory holding all bundle versions.
+    - vectors (np.ndarray): Chunk embeddings, shape (n, dim).
+    - texts (list): Chunk texts in the same order as `vectors`.
+    - metadata (list, optional): Per-chunk metadata dictionaries. Defaults to None.
+    - index_type (str, optional): Index type passed to `build_index`. Defaults to "flat".
+    - metric (str, optional): Metric passed to `build_index`. Defaults to "l2".
+    - search_params (dict, optional): Default `nprobe` / `ef_search` stored in the manifest.
+    - **index_params: Extra build parameters passed to `build_index`.
+
+    Returns:
+    - str: Version identifier of the published bundle.
+    """
+    vectors = prepare_vectors(vectors, metric)
+    if len(vectors) != len(texts):
+        raise ValueError(f"Got {len(vectors)} vectors for {len(texts)} texts")
+    metadata = metadata or [{} for _ in texts]
+
+    digest = hashlib.sha256(vectors.tobytes())
+    for text in texts:
+        digest.update(str(text).encode("utf-8"))
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    version = f"{created_at.strftime('%Y%m%dT%H%M%SZ')}-{digest.hexdigest()[:8]}"
+
+    directory = os.path.join(root, version)
+    os.makedirs(directory, exist_ok=True)
+
+    index, build_params = build_index(vectors, index_type, metric, **index_params)
+    faiss.write_index(index, os.path.join(directory, INDEX_FILE))
+
+    write_texts(directory, texts)
+    with open(os.path.join(directory, METADATA_FILE), "w", encoding="utf-8") as f:
+        for item in metadata:
+            f.write(json.dumps(item) + "\n")
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "version": version,
+        "created_at": created_at.isoformat(),
+        "count": int(index.ntotal),
+        "dim": int(vectors.shape[1]),
+        "index_type": index_type,
+        "metric": metric,
+        "build_params": build_params,
+        "search_params": search_params or {},
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    publish_version(root, version)
+    return version
+
+
+def publish_version(root, version):
+    """Atomically points `<root>/CURRENT` at the given bundle version."""
+    tmp_path = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def current_version(root):
+    """Returns the version named by `<root>/CURRENT`."""
+    with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def load_index_bundle(root, version=None, nprobe=None, ef_search=None):
+    """
+    Opens an index bundle without copying the vectors into process memory.
+
+    Args:
+    - root (str): Directory holding all bundle versions.
+    - version (str, optional): Version to open. Defaults to the current one.
+    - nprobe (int, optional): Overrides the IVF `nprobe` stored in the manifest.
+    - ef_search (int, optional): Overrides the HNSW `efSearch` stored in the manifest.
+
+    Returns:
+    - dict: Dictionary containing the FAISS index, the text store, the manifest and the version.
+    """
+    version = version or current_version(root)
+    directory = os.path.join(root, version)
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index bundle format {manifest['format_version']}")
+
+    index = faiss.read_index(os.path.join(directory, INDEX_FILE), MMAP_FLAGS)
+    configure_search(
+        index,
+        nprobe=nprobe or manifest["search_params"].get("nprobe"),
+        ef_search=ef_search or manifest["search_params"].get("ef_search")
+    )
+    texts = TextStore(directory)
+    return {"index": index, "texts": texts, "manifest": manifest, "version": version}
+
+
+def read_manifest(root, version=None):
+    """Reads the manifest of a bundle version."""
+    directory = os.path.join(root, version or current_version(root))
+    with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_metadata(root, version=None):
+    """Reads the per-chunk metadata of a bundle version, in index order."""
+    directory = os.path.join(root, version or current_version(root))
+    with open(os.path.join(directory, METADATA_FILE), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def reconstruct_vectors(bundle):
+    """
+    Recovers the stored vectors of a bundle so it can be rebuilt with another index type.
+
+    Args:
+    - bundle (dict): Bundle returned by `load_index_bundle`.
+
+    Returns:
+    - np.ndarray: Vectors in index order, shape (n, dim).
+
+    Raises:
+    - ValueError: If the index only keeps compressed (PQ) codes.
+    """
+    index = bundle["index"]
+    if bundle["manifest"]["index_type"] == "ivf_pq":
+        raise ValueError("IVF-PQ bundles only keep compressed codes; rebuild from a flat, IVF-Flat or HNSW bundle")
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def rebuild_bundle(root, index_type, metric, search_params=None, **index_params):
+    """
+    Trains and serializes the current bundle's vectors with a different index type.
+
+    Args:
+    - root (str): Directory holding all bundle versions.
+    - index_type (str): Target index type.
+    - metric (str): Target metric.
+    - search_params (dict, optional): Default `nprobe` / `ef_search` for the new bundle.
+    - **index_params: Extra build parameters passed to `build_index`.
+
+    Returns:
+    - str: Version identifier of the published bundle.
+    """
+    version = current_version(root)
+    bundle = load_index_bundle(root, version)
+    vectors = reconstruct_vectors(bundle)
+    texts = [bundle["texts"][i] for i in range(len(bundle["texts"]))]
+    return write_bundle(
+        root, vectors, texts, read_metadata(root, version),
+        index_type=index_type, metric=metric, search_params=search_params, **index_params
+    )
+
+
+def parse_index_spec(spec):
+    """
+    Parses a benchmark spec such as `ivf_pq:nlist=64,pq_m=16,nprobe=8` or `hnsw:ef_search=64`.
+
+    Returns:
+    - tuple: Index type, build parameters and search parameters.
+    """
+    index_type, _, options = spec.partition(":")
+    build_params, search_params = {}, {}
+    for option in filter(None, options.split(",")):
+        key, value = option.split("=")
+        target = search_params if key in ("nprobe", "ef_search") else build_params
+        target[key] = int(value)
+    return index_type, build_params, search_params
+
+
+def benchmark_indexes(vectors, specs, metric="l2", k=3, n_queries=200, seed=0):
+    """
+    Measures recall@k and per-query latency of index configurations against exact search.
+
+    Queries are corpus vectors with a little gaussian noise, so the exact neighbours are
+    realistic but not trivially the query itself.
+
+    Args:
+    - vectors (np.ndarray): Corpus vectors, shape (n, dim).
+    - specs (list): Index specs understood by `parse_index_spec`.
+    - metric (str, optional): Metric used by every configuration. Defaults to "l2".
+    - k (int, optional): Number of neighbours compared. Defaults to 3.
+    - n_queries (int, optional): Number of sampled queries. Defaults to 200.
+    - seed (int, optional): Random seed for the query sample. Defaults to 0.
+
+    Returns:
+    - list: One dictionary per spec with recall, p50/p95 latency in ms and build time in s.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = prepare_vectors(vectors, metric)
+    sample = vectors[rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)]
+    queries = sample + rng.normal(scale=0.01, size=sample.shape)
+    manifest = {"metric": metric}
+
+    exact_index, _ = build_index(vectors, "flat", metric)
+    _, exact_ids = search_index({"index": exact_index, "manifest": manifest}, queries, k)
+
+    report = []
+    for spec in specs:
+        index_type, build_params, search_params = parse_index_spec(spec)
+        started = time.perf_counter()
+        index, _ = build_index(vectors, index_type, metric, **build_params)
+        build_seconds = time.perf_counter() - started
+        configure_search(index, **search_params)
+        bundle = {"index": index, "manifest": manifest}
+
+        # timed through the same path as the chatbot's queries, preprocessing included
+        latencies, hits = [], 0
+        for query, expected in zip(queries, exact_ids):
+            started = time.perf_counter()
+            _, ids = search_index(bundle, query[None, :], k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(set(ids[0]) & set(expected))
+        report.append({
+            "spec": spec,
+            "recall_at_k": hits / (k * len(queries)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "build_s": build_seconds,
+        })
+    return report
+
+
+def convert_npy_directory(directory_path, root):
+    """
+    Converts the legacy `file_index.npy` / `file_texts.npy` files into an index bundle.
+
+    Args:
+    - directory_path (str): Directory containing the legacy .npy files.
+    - root (str): Directory the bundle versions are written to.
+
+    Returns:
+    - str: Version identifier of the published bundle.
+    """
+    vectors = np.load(os.path.join(directory_path, "file_index.npy"), allow_pickle=True)
+    texts = np.load(os.path.join(directory_path, "file_texts.npy"), allow_pickle=True)
+    return write_bundle(root, vectors, [str(text) for text in texts])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the FAISS index bundle used by the chatbot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Convert legacy .npy files into an index bundle.")
+    convert_parser.add_argument("source", help="Directory containing file_index.npy and file_texts.npy")
+    convert_parser.add_argument("root", help="Bundle root directory")
+
+    build_parser = subparsers.add_parser("build", help="Rebuild the current bundle with another index type.")
+    build_parser.add_argument("root", help="Bundle root directory")
+    build_parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    build_parser.add_argument("--metric", choices=tuple(METRICS), default="l2")
+    build_parser.add_argument("--nlist", type=int)
+    build_parser.add_argument("--pq-m", type=int, default=16)
+    build_parser.add_argument("--pq-nbits", type=int, default=8)
+    build_parser.add_argument("--hnsw-m", type=int, default=32)
+    build_parser.add_argument("--ef-construction", type=int, default=200)
+    build_parser.add_argument("--nprobe", type=int, help="Default IVF lists visited per query")
+    build_parser.add_argument("--ef-search", type=int, help="Default HNSW search depth")
+
+    bench_parser = subparsers.add_parser("bench", help="Report recall and latency of index types against flat search.")
+    bench_parser.add_argument("root", help="Bundle root directory")
+    bench_parser.add_argument("specs", nargs="+", help="Index specs, e.g. flat ivf_flat:nprobe=8 ivf_pq:pq_m=16,nprobe=16 hnsw:ef_search=64")
+    bench_parser.add_argument("--metric", choices=tuple(METRICS), default="l2")
+    bench_parser.add_argument("--k", type=int, default=3)
+    bench_parser.add_argument("--queries", type=int, default=200)
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        print(convert_npy_directory(args.source, args.root))
+    elif args.command == "build":
+        search_params = {key: value for key, value in (("nprobe", args.nprobe), ("ef_search", args.ef_search)) if value}
+        print(rebuild_bundle(
+            args.root, args.index_type, args.metric, search_params,
+            nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits,
+            hnsw_m=args.hnsw_m, ef_construction=args.ef_construction
+        ))
+    elif args.command == "bench":
+        vectors = reconstruct_vectors(load_index_bundle(args.root))
+        print(f"{'spec':<40} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+        for row in benchmark_indexes(vectors, args.specs, args.metric, args.k, args.queries):
+            print(f"{row['spec']:<40} {row['recall_at_k']:>10.3f} {row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} {row['build_s']:>8.2f}")
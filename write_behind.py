@@ -0,0 +1,159 @@
+import asyncio, time, logging
+from pymongo.errors import BulkWriteError
+from tracing import span
+
+
+logger = logging.getLogger(__name__)
+DUPLICATE_KEY = 11000
+
+
+class WriteBehindQueue:
+    """
+    Buffer of chat-history writes flushed to MongoDB with `bulk_write`.
+
+    With `durability="ack"` every write is sent right away and awaited, so a turn only
+    answers once its messages are stored. With `durability="write_behind"` writes are
+    appended to an in-process buffer and the caller returns immediately; a background
+    task flushes the buffer when `max_batch` writes are queued or `max_wait_ms` after the
+    first one. A flush sends one ordered `bulk_write` per collection with the writes
+    grouped by session, so the writes of a session are applied in the order they were
+    made. Unflushed messages stay visible through `pending_messages` and the buffer is
+    drained by `close`; a crash loses at most the writes of the last flush interval.
+    """
+
+    def __init__(self, database, durability="ack", max_batch=200, max_wait_ms=50, retry_seconds=1):
+        self.database = database # collection name -> collection
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.retry_seconds = retry_seconds
+        self.pending = [] # (collection name, session_id, operation, document) in write order
+        self.inflight = []
+        self.new_sessions = {} # session_id -> emp_id of sessions created but not flushed yet
+        self.has_work = asyncio.Event()
+        self.full = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.task = None
+        self.stats = {"writes": 0, "flushes": 0, "failed_writes": 0, "retries": 0}
+
+    def start(self):
+        if self.durability == "write_behind" and self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def write(self, collection, session_id, operation, document=None):
+        """
+        Queues one write, or performs it right away in "ack" mode.
+
+        Args:
+        - collection (str): Collection name, "sessions" or "messages".
+        - session_id (str): Session the write belongs to.
+        - operation (pymongo operation): InsertOne, UpdateOne, ...
+        - document (dict, optional): Inserted message, kept readable until it is flushed.
+        """
+        self.stats["writes"] += 1
+        if self.durability != "write_behind":
+            with span("mongo.bulk_write", collection=collection, operations=1):
+                await self.database[collection].bulk_write([operation])
+            return
+        self.pending.append((collection, session_id, operation, document))
+        self.has_work.set()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+
+    def pending_messages(self, session_id):
+        """Messages of a session that are queued or being flushed, in write order."""
+        return [
+            document for collection, queued_session_id, _, document in self.inflight + self.pending
+            if collection == "messages" and queued_session_id == session_id and document is not None
+        ]
+
+    def queue_depth(self):
+        return len(self.pending) + len(self.inflight)
+
+    async def run(self):
+        while True:
+            await self.has_work.wait()
+            try:
+                await asyncio.wait_for(self.full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            if not await self.flush():
+                await asyncio.sleep(self.retry_seconds)
+
+    async def flush(self):
+        """
+        Writes every queued operation; failed batches are queued again in front.
+
+        Returns:
+        - bool: Whether every collection was written without a connection-level failure.
+        """
+        async with self.flush_lock:
+            batch, self.pending = self.pending, []
+            self.has_work.clear()
+            self.full.clear()
+            if not batch:
+                return True
+            self.inflight = batch
+            try:
+                by_collection = {}
+                for entry in sorted(batch, key=lambda entry: entry[1]): # stable, keeps the order within a session
+                    by_collection.setdefault(entry[0], []).append(entry)
+                with span("mongo.flush", operations=len(batch)):
+                    results = await asyncio.gather(
+                        *(self.flush_collection(collection, entries) for collection, entries in by_collection.items())
+                    )
+                requeue = [entry for entries in results for entry in entries]
+            finally:
+                self.inflight = []
+
+            self.stats["flushes"] += 1
+            for collection, session_id, _, _ in batch:
+                if collection == "sessions" and not any(entry[1] == session_id for entry in requeue):
+                    self.new_sessions.pop(session_id, None)
+            if requeue:
+                self.stats["retries"] += len(requeue)
+                self.pending = requeue + self.pending
+                self.has_work.set()
+                return False
+            if self.pending:
+                self.has_work.set()
+            return True
+
+    async def flush_collection(self, collection, entries):
+        """Runs one ordered bulk write; returns the entries that have to be written again."""
+        try:
+            await self.database[collection].bulk_write([entry[2] for entry in entries], ordered=True)
+            return []
+        except BulkWriteError as e:
+            # an ordered bulk write stops at the first error: drop that write, retry the rest
+            failed = e.details["writeErrors"][0]
+            if failed.get("code") != DUPLICATE_KEY: # a duplicate _id was stored by an earlier, interrupted flush
+                self.stats["failed_writes"] += 1
+                logger.error(f"Dropped {collection} write of session {entries[failed['index']][1]}: {failed.get('errmsg')}")
+            return entries[failed["index"] + 1:]
+        except Exception as e:
+            logger.exception(f"Flushing {len(entries)} {collection} writes failed: {e}")
+            return entries
+
+    async def close(self, timeout=10):
+        """Stops the background task and drains the buffer, retrying until `timeout` seconds."""
+        if self.task is not None:
+            async with self.flush_lock: # let a running flush finish, its batch is not in `pending`
+                self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            if not await self.flush():
+                await asyncio.sleep(min(self.retry_seconds, max(deadline - time.monotonic(), 0)))
+        if self.pending:
+            logger.error(f"Shutting down with {len(self.pending)} chat-history writes not stored")
+
+    def get_stats(self):
+        """Returns write, flush and failure counters and the current queue depth."""
+        stats = dict(self.stats)
+        stats["queue_depth"] = self.queue_depth()
+        return stats